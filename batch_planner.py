@@ -0,0 +1,203 @@
+"""モデルの切り替えが少なくなるよう、投入順を並べ替える計画段と、複数の画像を1つの
+プロンプトにまとめる段。
+
+AffinityPlanner: 入力を最大 window 件まで先読みし、スキップ集合の署名（＝残るモデルローダーの
+組み合わせ）ごとにまとめて続けて流す。同じ署名が max_run 件続いたら、最も長く待っている
+別の署名へ切り替える（1つのグループが他を飢えさせないための上限）。
+
+AdaptiveBatcher: 同じ署名が続く Job を最大 K 件まで1つの Job（batch）にまとめる。K は観測した
+1枚あたりの実行時間から、1プロンプトの実行時間が target_seconds 程度になるよう決める
+（1枚が短いワークフローほど多くまとめ、/prompt の送信・検証などのプロンプトごとの負担を薄める）。
+"""
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Callable, Deque, Iterator, List, Optional
+
+from scheduler import Job
+
+_END = object()
+
+
+class AffinityPlanner:
+    """Job 列を署名ごとにまとめ直すイテレータ。None（今は入力が無い）は素通しする。"""
+
+    def __init__(self, classify: Callable[[Path], str], window: int = 256, max_run: int = 32) -> None:
+        self.classify = classify
+        self.window = max(1, int(window))
+        self.max_run = max(1, int(max_run))
+        # 署名 → (到着順, Job) の列。OrderedDict は最初に現れた順
+        self._buckets: "OrderedDict[str, Deque[tuple]]" = OrderedDict()
+        self._buffered = 0
+        self._seq = 0
+        self._current: Optional[str] = None
+        self._run = 0
+        # 到着順のまま流した場合と、計画後の切り替え回数
+        self._last_arrival: Optional[str] = None
+        self.arrival_switches = 0
+        self.planned_switches = 0
+        self.emitted = 0
+
+    def _accept(self, job: Job) -> None:
+        sig = self.classify(job.path)
+        job.signature = sig
+        if self._last_arrival is not None and sig != self._last_arrival:
+            self.arrival_switches += 1
+        self._last_arrival = sig
+        self._buckets.setdefault(sig, deque()).append((self._seq, job))
+        self._seq += 1
+        self._buffered += 1
+
+    def _choose(self) -> Optional[str]:
+        cur = self._current
+        if cur is not None and self._buckets.get(cur) and self._run < self.max_run:
+            return cur
+        others = [sig for sig, q in self._buckets.items() if q and sig != cur]
+        if not others:
+            return cur if cur is not None and self._buckets.get(cur) else None
+        # 上限に達したか、現在の署名が尽きた: 最も長く待っている署名へ
+        return min(others, key=lambda sig: self._buckets[sig][0][0])
+
+    def _emit(self) -> Optional[Job]:
+        sig = self._choose()
+        if sig is None:
+            return None
+        _, job = self._buckets[sig].popleft()
+        if not self._buckets[sig]:
+            del self._buckets[sig]
+        self._buffered -= 1
+        if sig == self._current:
+            self._run += 1
+        else:
+            if self._current is not None:
+                self.planned_switches += 1
+            self._current = sig
+            self._run = 1
+        self.emitted += 1
+        return job
+
+    def plan(self, jobs: Iterator[Optional[Job]]) -> Iterator[Optional[Job]]:
+        exhausted = False
+        while True:
+            # 窓が埋まるか、上流に今すぐ出せる入力が無くなるまで先読み
+            while not exhausted and self._buffered < self.window:
+                job = next(jobs, _END)
+                if job is _END:
+                    exhausted = True
+                    break
+                if job is None:
+                    break
+                self._accept(job)  # type: ignore[arg-type]
+            out = self._emit()
+            if out is not None:
+                yield out
+                continue
+            if exhausted:
+                return
+            yield None
+
+    def report(self) -> str:
+        avoided = self.arrival_switches - self.planned_switches
+        return (
+            f"[plan] emitted={self.emitted} buffered={self._buffered} groups={len(self._buckets)} "
+            f"model_switches={self.planned_switches} (in arrival order: {self.arrival_switches}, avoided: {avoided})"
+        )
+
+
+class AdaptiveBatcher:
+    """同じ署名の連続する Job をまとめるイテレータ。None（今は入力が無い）は素通しする。
+
+    まとめる件数は observe() で受け取った実行時間から決める。実行時間を観測するまでは1件ずつ流す。
+    """
+
+    def __init__(
+        self,
+        classify: Callable[[Path], str],
+        max_size: int = 8,
+        target_seconds: float = 30.0,
+        alpha: float = 0.3,
+    ) -> None:
+        self.classify = classify
+        self.max_size = max(1, int(max_size))
+        self.target_seconds = float(target_seconds)
+        self.alpha = alpha
+        # 1枚あたりの実行時間（EMA）
+        self.per_image: Optional[float] = None
+        self.prompts = 0
+        self.images = 0
+
+    def observe(self, job: Job) -> None:
+        """終わったジョブの実行時間を取り込む（Scheduler.add_finish_handler に渡す）。"""
+        started = job.timings.get("started")
+        finished = job.timings.get("finished")
+        if started is None or finished is None or finished < started:
+            return
+        per = (finished - started) / len(job.members())
+        self.per_image = per if self.per_image is None else (1 - self.alpha) * self.per_image + self.alpha * per
+
+    def batch_size(self) -> int:
+        if self.per_image is None:
+            return 1
+        if self.per_image <= 0:
+            return self.max_size
+        return max(1, min(self.max_size, int(self.target_seconds / self.per_image)))
+
+    def _signature(self, job: Job) -> str:
+        if job.signature is None:
+            job.signature = self.classify(job.path)
+        return job.signature
+
+    def _pack(self, group: List[Job]) -> Job:
+        self.prompts += 1
+        self.images += len(group)
+        if len(group) == 1:
+            return group[0]
+        head = group[0]
+        packed = Job(head.index, head.path)
+        packed.signature = head.signature
+        packed.lane = head.lane
+        packed.batch = group
+        return packed
+
+    def batch(self, jobs: Iterator[Optional[Job]]) -> Iterator[Optional[Job]]:
+        held: Optional[Job] = None
+        exhausted = False
+        while True:
+            if held is not None:
+                first: Optional[Job] = held
+                held = None
+            elif exhausted:
+                return
+            else:
+                item = next(jobs, _END)
+                if item is _END:
+                    return
+                first = item  # type: ignore[assignment]
+            if first is None:
+                yield None
+                continue
+            signature = self._signature(first)
+            group = [first]
+            size = self.batch_size()
+            # 今すぐ出せる入力だけでまとめる（足りないまま待つと GPU が空く）
+            while len(group) < size:
+                item = next(jobs, _END)
+                if item is _END:
+                    exhausted = True
+                    break
+                if item is None:
+                    break
+                job: Job = item  # type: ignore[assignment]
+                # 優先度レーンが違えば（front の有無が変わりうるので）まとめない
+                if self._signature(job) != signature or job.lane != first.lane:
+                    held = job
+                    break
+                group.append(job)
+            yield self._pack(group)
+
+    def report(self) -> str:
+        per = f"{self.per_image:.1f}s" if self.per_image is not None else "-"
+        avg = self.images / self.prompts if self.prompts else 0.0
+        return (
+            f"[batch] prompts={self.prompts} images={self.images} avg_size={avg:.1f} "
+            f"next_size={self.batch_size()} per_image={per}"
+        )
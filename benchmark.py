@@ -0,0 +1,246 @@
+"""ワークフロー変換のホットパスのベンチマーク。
+
+synthetic_workflow.py で生成したグラフに対して、次の処理ごとに実時間・確保メモリ・
+ピークメモリを測り、/prompt の本文を1件ずつ作ったときのスループット（prompts/s）も測る
+（end_to_end はエンコード済みテンプレートへの差し込み、end_to_end_dict は build_workflow + JSON化）。
+
+- remove_switches.remove_switch_nodes
+- loop.bypass_nodes
+- workflow_graph: グラフの構築（起動時に1回）と、同じ変換（バイパス + Switch除去）を差分で行う場合
+- loop.build_workflow（キャッシュなし / キャッシュあり）
+- loop.build_prompt_body（キャッシュあり）と、同じ本文を json.dumps で作る場合
+- extract_model_loader_groups.extract_model_loader_groups
+
+loop.py は import 時に config.json とワークフローを読むので、生成したグラフを置いた
+一時ディレクトリをカレントにして読み込み直す。
+
+  python benchmark.py --sizes 1000,10000,50000 --save-baseline out/bench_baseline.json
+  python benchmark.py --sizes 1000,10000,50000 --baseline out/bench_baseline.json
+
+--baseline を指定すると、保存済みの結果より tolerance を超えて遅くなった項目を
+[regression] として表示し、終了コード 1 で終わる。
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional
+
+import extract_model_loader_groups
+import remove_switches
+from synthetic_workflow import SyntheticWorkflow, generate_workflow
+from workflow_graph import WorkflowGraph
+
+
+def measure(fn: Callable[[], Any], repeat: int = 3) -> Dict[str, float]:
+    """fn を repeat 回実行した実時間（最小・中央値）と、1回分のメモリ（tracemalloc）。"""
+    times: List[float] = []
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    # tracemalloc は実行を遅くするので、時間計測とは別に1回だけ回す
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        snap_before = tracemalloc.take_snapshot()
+        result = fn()
+        snap_after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    diff = snap_after.compare_to(snap_before, "filename")
+    del result
+    return {
+        "wall_s": min(times),
+        "wall_median_s": statistics.median(times),
+        "retained_kib": max(0, current - before) / 1024,
+        "retained_blocks": float(sum(max(0, st.count_diff) for st in diff)),
+        "peak_kib": max(0, peak - before) / 1024,
+    }
+
+
+def load_loop(sw: SyntheticWorkflow, workdir: Path) -> ModuleType:
+    """生成したグラフを workdir に書き出し、そこをカレントにして loop を読み込み直す。"""
+    (workdir / "out").mkdir(parents=True, exist_ok=True)
+    (workdir / "input").mkdir(exist_ok=True)
+    (workdir / "workflow.json").write_text(json.dumps(sw.api), encoding="utf-8")
+    (workdir / "out" / "model_loader_groups.json").write_text(json.dumps(sw.groups), encoding="utf-8")
+    config = {"workflow": "workflow.json", "input_dir": str(workdir / "input"), "ledger_path": ""}
+    (workdir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+    # カレントを移すので、loop.py のあるディレクトリを明示的に import パスへ入れる
+    here = str(Path(__file__).resolve().parent)
+    if here not in sys.path:
+        sys.path.insert(0, here)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.modules.pop("loop", None)
+        loop = importlib.import_module("loop")
+    finally:
+        os.chdir(cwd)
+    # 通信はしないので HTTP クライアントのスレッドは止めておく
+    loop.HTTP.close()
+    return loop
+
+
+def bench_size(nodes: int, args: argparse.Namespace, workdir: Path) -> Dict[str, Dict[str, float]]:
+    sw = generate_workflow(
+        nodes=nodes,
+        switch_density=args.switch_density,
+        groups=args.groups,
+        nesting=args.nesting,
+        paths=args.prompts,
+        seed=args.seed,
+    )
+    loop = load_loop(sw, workdir)
+    sample_path = sw.paths[0]
+    skip = set(loop.collect_skip_node_ids_for_path(sample_path))
+    results: Dict[str, Dict[str, float]] = {}
+
+    def run(name: str, fn: Callable[[], Any]) -> None:
+        results[f"{nodes}/{name}"] = measure(fn, args.repeat)
+
+    run("remove_switch_nodes", lambda: remove_switches.remove_switch_nodes(loop.wf))
+    run("bypass_nodes", lambda: loop.bypass_nodes(loop.wf, skip))
+    run(
+        "dict_transform",
+        lambda: remove_switches.remove_switch_nodes(loop.bypass_nodes(loop.wf, skip), roots=loop.OUTPUT_ROOTS),
+    )
+    run("graph_build", lambda: WorkflowGraph.from_api(loop.wf))
+    graph = WorkflowGraph.from_api(loop.wf)
+
+    def graph_transform() -> Any:
+        assert graph is not None
+        edit = graph.edit()
+        edit.bypass(skip)
+        edit.remove_switches(roots=loop.OUTPUT_ROOTS)
+        return edit.to_api()
+
+    run("graph_transform", graph_transform)
+
+    def build_cold() -> Any:
+        loop.WORKFLOW_CACHE.clear()
+        return loop.build_workflow(0, sample_path)
+
+    run("build_workflow_cold", build_cold)
+    loop.build_workflow(0, sample_path)
+    run("build_workflow_cached", lambda: loop.build_workflow(0, sample_path))
+    # キャッシュ済みのグラフから /prompt の本文を作るだけの部分（テンプレート差し込みと JSON化）
+    loop.build_prompt_body(0, sample_path)
+    run("prompt_body_cached", lambda: loop.build_prompt_body(0, sample_path))
+    run(
+        "prompt_json_cached",
+        lambda: json.dumps({"prompt": loop.build_workflow(0, sample_path), "client_id": loop.CLIENT_ID}),
+    )
+    run("extract_model_loader_groups", lambda: extract_model_loader_groups.extract_model_loader_groups(sw.ui))
+
+    # 端から端まで: 入力パスごとに /prompt の本文を作る（submit と同じ経路と、従来の dict → JSON化）
+    def end_to_end(name: str, body: Callable[[int, Path], Any]) -> None:
+        loop.WORKFLOW_CACHE.clear()
+        misses = loop.WORKFLOW_CACHE.misses
+        t0 = time.perf_counter()
+        for i, path in enumerate(sw.paths):
+            body(i, path)
+        elapsed = time.perf_counter() - t0
+        results[f"{nodes}/{name}"] = {
+            "wall_s": elapsed,
+            "prompts_per_s": len(sw.paths) / elapsed if elapsed > 0 else 0.0,
+            "cache_misses": float(loop.WORKFLOW_CACHE.misses - misses),
+        }
+
+    end_to_end("end_to_end", loop.build_prompt_body)
+    end_to_end(
+        "end_to_end_dict",
+        lambda i, path: json.dumps({"prompt": loop.build_workflow(i, path), "client_id": loop.CLIENT_ID}),
+    )
+    return results
+
+
+def compare(current: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """baseline より (1 + tolerance) 倍を超えて悪化した項目の説明。"""
+    regressions: List[str] = []
+    for key, cur in current.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric, higher_is_worse in (("wall_s", True), ("peak_kib", True), ("prompts_per_s", False)):
+            if metric not in cur or metric not in base or not base[metric]:
+                continue
+            ratio = cur[metric] / base[metric]
+            worse = ratio > 1 + tolerance if higher_is_worse else ratio < 1 / (1 + tolerance)
+            if worse:
+                regressions.append(f"{key} {metric}: {base[metric]:.4g} -> {cur[metric]:.4g} (x{ratio:.2f})")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]]) -> None:
+    print(f"{'benchmark':<40} {'wall_ms':>10} {'peak_KiB':>10} {'retained_KiB':>13} {'prompts/s':>10} {'misses':>7}")
+    for key, r in results.items():
+        peak = f"{r['peak_kib']:.0f}" if "peak_kib" in r else "-"
+        retained = f"{r['retained_kib']:.0f}" if "retained_kib" in r else "-"
+        pps = f"{r['prompts_per_s']:.1f}" if "prompts_per_s" in r else "-"
+        misses = f"{r['cache_misses']:.0f}" if "cache_misses" in r else "-"
+        print(f"{key:<40} {r['wall_s'] * 1000:>10.2f} {peak:>10} {retained:>13} {pps:>10} {misses:>7}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="ワークフロー変換のベンチマーク")
+    parser.add_argument("--sizes", type=str, default="1000,5000,20000", help="ノード数（カンマ区切り）")
+    parser.add_argument("--switch-density", type=float, default=0.05)
+    parser.add_argument("--groups", type=int, default=16)
+    parser.add_argument("--nesting", type=int, default=1)
+    parser.add_argument("--prompts", type=int, default=256, help="end_to_end で流す入力パス数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", type=str, default="", help="比較する保存済み結果")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="許容する悪化率")
+    parser.add_argument("--save-baseline", type=str, default="", help="結果を書き出すパス")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory(prefix="comfy-bench-") as tmp:
+        for n in sizes:
+            print(f"[bench] nodes={n} ...")
+            results.update(bench_size(n, args, Path(tmp) / str(n)))
+    print_table(results)
+
+    if args.save_baseline:
+        payload = {
+            "meta": {
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "params": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline")},
+            },
+            "results": results,
+        }
+        out = Path(args.save_baseline)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+        print(f"[bench] saved {out}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")).get("results", {})
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"[regression] {line}")
+        if regressions:
+            return 1
+        print(f"[bench] no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""投入前の準備（入力の列挙・分類・ワークフロー変換）を先回りして進めるパイプライン。
+
+scheduler はメインスレッドで「空いたら次のジョブを取り出して /prompt へ送る」を繰り返す。
+取り出しのたびに列挙・並べ替え・分類・変換をしていると、そのぶんバックエンドを待たせる。
+ここでは各段を別スレッドに分け、上限付きのキューでつなぐ。
+
+    discover（iter_jobs → 台帳 → 並べ替え）
+      → [queue] → classify（スキップ集合の署名）
+      → [queue] → compile（署名ごとの /prompt テンプレート）
+      → [ready] → メインスレッドで まとめ → 先読みアップロード → scheduler が投入
+
+ready には投入順のまま最大 depth 件が並び、先頭のテンプレートができていれば取り出せる。
+テンプレートは取り出すときにメインスレッドで CompiledWorkflowCache へ登録するので、投入時の
+build_prompt_body はキャッシュから本文を作るだけになる。キューが詰まれば上流の段は止まる。
+
+変換は署名ごとに1回だけ行う。大きなワークフローではプロセスプール（CompilePool）で並行して
+作れる（グラフの変換は Python のコードなので、スレッドでは並行にならない）。
+まとめる枚数は完了したジョブの実行時間で、アップロード先は投入先のバックエンドで決まるので、
+この2段とステージングはメインスレッドの投入の直前に残す（テンプレートはまとめる枚数に依存しない）。
+"""
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+from image_upload import as_load_image
+from workflow_cache import PromptTemplate
+from workflow_graph import WorkflowGraph, compile_api
+
+_END = object()
+
+
+class StageStats:
+    """1段ぶんの処理件数と、処理に使った時間。"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.started: Optional[float] = None
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        if self.started is None:
+            self.started = time.time() - seconds
+        self.items += items
+        self.busy += seconds
+
+    def rate(self) -> float:
+        elapsed = time.time() - self.started if self.started is not None else 0.0
+        return self.items / elapsed if elapsed > 0 else 0.0
+
+    def utilization(self) -> float:
+        elapsed = time.time() - self.started if self.started is not None else 0.0
+        return min(1.0, self.busy / elapsed) if elapsed > 0 else 0.0
+
+
+class _Built:
+    """スレッド内で作り終えたテンプレート（プロセスプールの AsyncResult と同じ ready/get を持つ）。"""
+
+    def __init__(self, template: Optional[PromptTemplate] = None, error: Optional[BaseException] = None) -> None:
+        self.template = template
+        self.error = error
+
+    def ready(self) -> bool:
+        return True
+
+    def get(self) -> Optional[PromptTemplate]:
+        if self.error is not None:
+            raise self.error
+        return self.template
+
+
+# --- プロセスプールのワーカー側 ---
+_WORKER: Dict[str, Any] = {}
+
+
+def _init_worker(
+    wf: Dict[str, Any],
+    roots: List[str],
+    load_node_id: str,
+    load_image: bool,
+    client_id: str,
+    fields: Tuple[str, ...],
+) -> None:
+    _WORKER.update(
+        graph=WorkflowGraph.from_api(wf),
+        roots=roots,
+        load_node_id=load_node_id,
+        load_image=load_image,
+        client_id=client_id,
+        fields=fields,
+    )
+
+
+def _compile_worker(skip_ids: FrozenSet[str]) -> PromptTemplate:
+    graph = compile_api(_WORKER["graph"], skip_ids, _WORKER["roots"])
+    if _WORKER["load_image"]:
+        graph = as_load_image(graph, _WORKER["load_node_id"])
+    return PromptTemplate({"prompt": graph, "client_id": _WORKER["client_id"]}, _WORKER["load_node_id"], _WORKER["fields"])
+
+
+class CompilePool:
+    """スキップ集合 → PromptTemplate の変換を別プロセスで行う。
+
+    各ワーカーは起動時に wf から WorkflowGraph を一度だけ作る。WorkflowGraph で表せない
+    ワークフロー（from_api が None）には使えない。
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        wf: Dict[str, Any],
+        roots: Sequence[str],
+        load_node_id: str,
+        load_image: bool,
+        client_id: str,
+        fields: Sequence[str],
+    ) -> None:
+        self.processes = max(1, int(processes))
+        # fork はスレッド（HTTP のイベントループ等）を持つプロセスでは安全でないので spawn で起動する。
+        # spawn は子プロセスで __main__（loop.py）を読み直し、設定の読み込みや抽出まで走ってしまうため、
+        # 起動の間だけ __main__ を空のモジュールに差し替える（ワーカーはこのモジュールの関数しか使わない）
+        main = sys.modules.get("__main__")
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            self._pool = multiprocessing.get_context("spawn").Pool(
+                self.processes,
+                initializer=_init_worker,
+                initargs=(wf, list(roots), load_node_id, load_image, client_id, tuple(fields)),
+            )
+        finally:
+            if main is not None:
+                sys.modules["__main__"] = main
+
+    def submit(self, skip_ids: FrozenSet[str], done: Optional[Callable[[Any], None]] = None) -> Any:
+        """変換を始め、ready()/get() を持つ AsyncResult を返す。done は完了時（成功・失敗とも）に呼ぶ。"""
+        return self._pool.apply_async(_compile_worker, (frozenset(skip_ids),), callback=done, error_callback=done)
+
+    def close(self) -> None:
+        self._pool.terminate()
+        self._pool.join()
+
+
+class BuildPipeline:
+    """上流の Job 列を別スレッドで読み進め、テンプレートまで準備した Job を jobs() で順に返す。
+
+    classify: パス → (署名, スキップ集合)
+    is_built: 署名のテンプレートがキャッシュにあるか（別スレッドから呼ぶ。読み取りのみのこと）
+    build: スキップ集合 → PromptTemplate（pool が無いとき compile スレッドで呼ぶ）
+    install: (署名, テンプレート) をキャッシュへ登録する（メインスレッドで呼ぶ）
+    notify: ready が空で待っていたメインスレッドを起こす（scheduler.wake.set）
+    generation: 分類・変換に使う一式の世代（hot_reload）。分類した後で世代が変わった Job は、
+        取り出すときに分類し直し、古い一式で作ったテンプレートは登録しない
+    """
+
+    def __init__(
+        self,
+        upstream: Iterator[Optional[Any]],
+        classify: Callable[[Path], Tuple[str, FrozenSet[str]]],
+        is_built: Callable[[str], bool],
+        build: Callable[[FrozenSet[str]], PromptTemplate],
+        install: Callable[[str, PromptTemplate], None],
+        depth: int = 8,
+        pool: Optional[CompilePool] = None,
+        notify: Optional[Callable[[], None]] = None,
+        idle_wait: float = 0.1,
+        generation: Optional[Callable[[], int]] = None,
+    ) -> None:
+        self.upstream = upstream
+        self.classify = classify
+        self.is_built = is_built
+        self.build = build
+        self.install = install
+        self.depth = max(1, int(depth))
+        self.pool = pool
+        self.notify = notify
+        self.idle_wait = idle_wait
+        self.generation = generation or (lambda: 0)
+        self._classify_q: "queue.Queue[Any]" = queue.Queue(self.depth)
+        self._compile_q: "queue.Queue[Any]" = queue.Queue(self.depth)
+        self._ready: "queue.Queue[Any]" = queue.Queue(self.depth)
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        # 変換中・変換済みで未登録の (世代, 署名) → ready()/get() を持つ結果（同じ署名を二重に変換しない）
+        self._building: Dict[Tuple[int, str], Any] = {}
+        self._lock = threading.Lock()
+        # メインスレッドが ready の先頭を待って None を返したか
+        self._starved = False
+        self.stats: Dict[str, StageStats] = {
+            name: StageStats(name) for name in ("discover", "classify", "compile", "submit")
+        }
+        self.built = 0
+        self._threads = [
+            threading.Thread(target=self._discover_loop, name="build-discover", daemon=True),
+            threading.Thread(target=self._classify_loop, name="build-classify", daemon=True),
+            threading.Thread(target=self._compile_loop, name="build-compile", daemon=True),
+        ]
+
+    def start(self) -> "BuildPipeline":
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        if self.pool is not None:
+            self.pool.close()
+
+    def set_pool(self, pool: Optional[CompilePool]) -> None:
+        """プロセスプールを入れ替える（古いプールで変換中のものは失敗扱いで捨てられる）。"""
+        old, self.pool = self.pool, pool
+        if old is not None:
+            old.close()
+
+    # --- 各段のスレッド ---
+    def _put(self, q: "queue.Queue[Any]", item: Any) -> bool:
+        """下流が詰まっていれば空くまで待つ。止められたら False。"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=self.idle_wait)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: "queue.Queue[Any]") -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=self.idle_wait)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _discover_loop(self) -> None:
+        stats = self.stats["discover"]
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                job = next(self.upstream, _END)
+                if job is _END:
+                    break
+                if job is None:
+                    stats.record(time.perf_counter() - start, 0)
+                    self._stop.wait(self.idle_wait)
+                    continue
+                stats.record(time.perf_counter() - start)
+                if not self._put(self._classify_q, job):
+                    return
+        except Exception as e:
+            self._error = e
+        self._put(self._classify_q, _END)
+
+    def _classify_loop(self) -> None:
+        stats = self.stats["classify"]
+        while True:
+            job = self._get(self._classify_q)
+            if job is _END:
+                break
+            start = time.perf_counter()
+            # 一式が替わった直後でも古い世代に数えるだけなので、分類より先に読む
+            generation = self.generation()
+            try:
+                signature, skip_ids = self.classify(job.path)
+            except Exception as e:
+                self._error = e
+                break
+            job.signature = signature
+            stats.record(time.perf_counter() - start)
+            if not self._put(self._compile_q, (job, generation, signature, skip_ids)):
+                return
+        self._put(self._compile_q, _END)
+
+    def _compile_loop(self) -> None:
+        stats = self.stats["compile"]
+        while True:
+            item = self._get(self._compile_q)
+            if item is _END:
+                break
+            job, generation, signature, skip_ids = item
+            start = time.perf_counter()
+            key = (generation, signature)
+            with self._lock:
+                result = self._building.get(key)
+            if result is None and generation == self.generation() and not self.is_built(signature):
+                pool = self.pool
+                try:
+                    if pool is not None:
+                        result = pool.submit(skip_ids, lambda _: self._wake())
+                    else:
+                        result = _Built(self.build(skip_ids))
+                except Exception as e:
+                    # 投入時の build_prompt_body でもう一度作らせ、そこでエラーにする
+                    result = _Built(error=e)
+                self.built += 1
+                with self._lock:
+                    self._building[key] = result
+            stats.record(time.perf_counter() - start)
+            if not self._put(self._ready, (job, generation, signature, result)):
+                return
+            self._wake()
+        self._put(self._ready, _END)
+
+    def _wake(self) -> None:
+        if self._starved and self.notify is not None:
+            self._starved = False
+            self.notify()
+
+    # --- メインスレッド ---
+    def jobs(self) -> Iterator[Optional[Any]]:
+        """準備のできた Job を投入順に返す。先頭がまだなら None。"""
+        head: Any = None
+        while True:
+            # 確かめる前に立てておく（確かめた直後に積まれた場合も notify が届くように）
+            self._starved = True
+            if head is None:
+                try:
+                    head = self._ready.get_nowait()
+                except queue.Empty:
+                    yield None
+                    continue
+            if head is _END:
+                if self._error is not None:
+                    raise self._error
+                return
+            job, generation, signature, result = head
+            if generation != self.generation():
+                # 分類した後で一式が替わった。テンプレートは投入時に新しい一式で作る
+                job.signature = self.classify(job.path)[0]
+                result = None
+                with self._lock:
+                    self._building.pop((generation, signature), None)
+            if result is not None:
+                if not result.ready():
+                    yield None
+                    continue
+                try:
+                    template = result.get()
+                except Exception as e:
+                    print(f"[pipeline] 変換に失敗しました（投入時に作り直します）: {e}")
+                    template = None
+                if template is not None:
+                    self.install(signature, template)
+                with self._lock:
+                    if self._building.get((generation, signature)) is result:
+                        del self._building[(generation, signature)]
+            head = None
+            self._starved = False
+            yield job
+
+    def timed(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """fn（scheduler の submit_fn）の所要時間を submit 段として数える。"""
+        stats = self.stats["submit"]
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stats.record(time.perf_counter() - start)
+
+        return wrapper
+
+    def report(self) -> str:
+        depths = {
+            "discover": self._classify_q.qsize(),
+            "classify": self._compile_q.qsize(),
+            "compile": self._ready.qsize(),
+        }
+        parts = []
+        for name, stats in self.stats.items():
+            queued = f" out={depths[name]}/{self.depth}" if name in depths else ""
+            parts.append(f"{name} {stats.rate():.1f}/s busy={stats.utilization() * 100:.0f}%{queued}")
+        # 一番時間を使っている段が律速
+        bottleneck = max(self.stats.values(), key=lambda s: s.utilization())
+        mode = f"processes={self.pool.processes}" if self.pool is not None else "threads"
+        return (
+            f"[pipeline] {' | '.join(parts)} built={self.built} ({mode}) "
+            f"bottleneck={bottleneck.name if bottleneck.busy > 0 else '-'}"
+        )
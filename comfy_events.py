@@ -0,0 +1,163 @@
+"""ComfyUI の /ws?clientId=... を購読し、キューに空きが出た瞬間を通知する。
+
+websocket-client が無い・接続できない場合は connected が False のままとなり、
+呼び出し側は従来どおりのポーリングにフォールバックする。
+"""
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import websocket  # websocket-client
+except ImportError:  # 未インストールならポーリングのみで動作
+    websocket = None  # type: ignore[assignment]
+
+
+# 投入判断をやり直すべきイベント（キューの空きが変化した可能性があるもの）
+WAKE_EVENT_TYPES = {
+    "status",
+    "execution_start",
+    "execution_success",
+    "execution_error",
+    "execution_interrupted",
+}
+
+
+def ws_url_for(base_url: str, client_id: str) -> str:
+    """http(s)://host:port を ws(s)://host:port/ws?clientId=... に変換。"""
+    if base_url.startswith("https://"):
+        scheme, rest = "wss://", base_url[len("https://"):]
+    elif base_url.startswith("http://"):
+        scheme, rest = "ws://", base_url[len("http://"):]
+    else:
+        scheme, rest = "ws://", base_url
+    return f"{scheme}{rest.rstrip('/')}/ws?clientId={client_id}"
+
+
+class ComfyEventListener:
+    """バックグラウンドスレッドで websocket を受信し、空き発生時に wait() を起こす。"""
+
+    def __init__(
+        self,
+        base_url: str,
+        client_id: str,
+        reconnect_delay: float = 5.0,
+        wake: Optional[threading.Event] = None,
+    ) -> None:
+        self.base_url = base_url
+        self.ws_url = ws_url_for(base_url, client_id)
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        # status イベントの exec_info.queue_remaining（実行中 + 待機中）
+        self.queue_remaining: Optional[int] = None
+        self.running_prompt_id: Optional[str] = None
+        self._handlers: List[Callable[[str, Dict[str, Any]], None]] = []
+        # 複数バックエンドで1つの Event を共有すれば、どれかの空きで起きられる
+        self._wake = wake if wake is not None else threading.Event()
+        self._stop = threading.Event()
+        self._ws: Any = None
+        self._thread: Optional[threading.Thread] = None
+
+    def add_handler(self, handler: Callable[[str, Dict[str, Any]], None]) -> None:
+        """(event_type, data) を受け取るコールバックを登録。受信スレッドから呼ばれる。"""
+        self._handlers.append(handler)
+
+    def start(self) -> bool:
+        """受信スレッドを開始。websocket-client が無ければ False。"""
+        if websocket is None:
+            print("[ws] websocket-client が見つからないためポーリングで動作します")
+            return False
+        self._thread = threading.Thread(target=self._run, name="comfy-ws", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        self._wake.set()
+
+    def wait(self, timeout: float) -> bool:
+        """空きイベントが来るか timeout まで待つ。イベントで起きた場合 True。"""
+        woke = self._wake.wait(timeout)
+        self._wake.clear()
+        return woke
+
+    def _run(self) -> None:
+        attempts = 0
+        while not self._stop.is_set():
+            attempts += 1
+            try:
+                self._ws = websocket.create_connection(self.ws_url, timeout=10)
+                # recv はイベントが来るまで待つ。停止確認のため適度にタイムアウトさせる
+                self._ws.settimeout(30)
+                self.connected = True
+                attempts = 0
+                print(f"[ws] connected {self.ws_url}")
+                # 接続直後は状況が不明なので一度チェックさせる
+                self._wake.set()
+                while not self._stop.is_set():
+                    try:
+                        msg = self._ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if isinstance(msg, bytes):
+                        # プレビュー画像などのバイナリは無視
+                        continue
+                    if not msg:
+                        raise ConnectionError("websocket closed")
+                    self._dispatch(msg)
+            except Exception as e:
+                # 接続できないまま再試行している間は最初の1回だけ表示
+                if not self._stop.is_set() and (self.connected or attempts == 1):
+                    print(f"[ws] disconnected ({e}); polling fallback, retry in {self.reconnect_delay}s")
+            finally:
+                was_connected = self.connected
+                self.connected = False
+                if self._ws is not None:
+                    try:
+                        self._ws.close()
+                    except Exception:
+                        pass
+                    self._ws = None
+                if was_connected:
+                    # 待機中の呼び出し側をポーリングへ切り替えさせる
+                    self._wake.set()
+            self._stop.wait(self.reconnect_delay)
+
+    def _dispatch(self, text: str) -> None:
+        try:
+            msg = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(msg, dict):
+            return
+        ev_type = str(msg.get("type", ""))
+        data = msg.get("data") or {}
+        if not isinstance(data, dict):
+            data = {}
+
+        if ev_type == "status":
+            try:
+                self.queue_remaining = int(data["status"]["exec_info"]["queue_remaining"])
+            except (KeyError, TypeError, ValueError):
+                pass
+        elif ev_type == "execution_start":
+            self.running_prompt_id = data.get("prompt_id")
+        elif ev_type in ("execution_success", "execution_error", "execution_interrupted"):
+            self.running_prompt_id = None
+
+        for handler in self._handlers:
+            try:
+                handler(ev_type, data)
+            except Exception as e:
+                print(f"[ws] handler error: {e}")
+
+        # executing は node ごとに来るので、終了（node=None）のときだけ起こす
+        if ev_type in WAKE_EVENT_TYPES or (ev_type == "executing" and data.get("node") is None):
+            self._wake.set()
+
@@ -0,0 +1,298 @@
+"""ComfyUI への HTTP 呼び出しを一手に引き受ける非同期クライアント。
+
+- aiohttp のコネクションプール（keep-alive）を全バックエンドで共有
+- エンドポイントごとのタイムアウト
+- 指数バックオフ + ジッタでの再試行
+- 専用スレッドのイベントループで動かし、同期コードからは ComfyClient 経由で呼ぶ
+  （*_future 系は待たずに Future を返すので、複数リクエストを並行して投げられる）
+
+/prompt の POST は、サーバへ届いた後の失敗で再送すると同じジョブが二重に積まれるため、
+接続自体が確立できなかった場合と 503 のときだけ再試行する。
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import random
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+import aiohttp
+
+# エンドポイントごとの既定タイムアウト（秒）
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "prompt": 60.0,
+    "queue": 10.0,
+    "history": 30.0,
+    "upload": 120.0,
+    "view": 300.0,
+    "interrupt": 10.0,
+}
+
+
+class ComfyRequestError(Exception):
+    """ComfyUI への要求が（再試行の末に）失敗した。"""
+
+    def __init__(self, message: str, status: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class RetryPolicy:
+    """指数バックオフ（full jitter）。attempts は初回を含む試行回数。"""
+
+    def __init__(self, attempts: int = 4, base_delay: float = 0.5, max_delay: float = 10.0) -> None:
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class AsyncComfyClient:
+    """aiohttp ベースのクライアント本体。イベントループ内からのみ使う。"""
+
+    def __init__(
+        self,
+        max_connections: int = 64,
+        max_per_host: int = 16,
+        timeouts: Optional[Dict[str, float]] = None,
+        retry: Optional[RetryPolicy] = None,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.retry = retry or RetryPolicy()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_per_host,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def request(
+        self,
+        endpoint: str,
+        method: str,
+        url: str,
+        *,
+        json: Any = None,
+        data: Any = None,
+        data_factory: Optional[Callable[[], Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        params: Optional[Dict[str, str]] = None,
+        idempotent: bool = True,
+    ) -> Any:
+        """JSON 応答を返す。idempotent=False の要求は送信前の失敗と 503 のみ再試行する。"""
+        timeout = aiohttp.ClientTimeout(total=self.timeouts.get(endpoint, 60.0))
+        session = self._get_session()
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.retry.attempts):
+            if attempt:
+                await asyncio.sleep(self.retry.delay(attempt - 1))
+            body = data_factory() if data_factory is not None else data
+            try:
+                async with session.request(
+                    method, url, json=json, data=body, headers=headers, params=params, timeout=timeout
+                ) as resp:
+                    if resp.status >= 400:
+                        text = await resp.text()
+                        error = ComfyRequestError(f"{method} {url} -> {resp.status}: {text[:500]}", resp.status)
+                        retryable = resp.status == 503 or (idempotent and (resp.status >= 500 or resp.status == 429))
+                        if not retryable:
+                            raise error
+                        last_error = error
+                        continue
+                    return await resp.json(content_type=None)
+            except ComfyRequestError:
+                raise
+            except aiohttp.ClientConnectorError as e:
+                # 接続できていないので、どの要求でも再送して安全
+                last_error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                if not idempotent:
+                    break
+        raise ComfyRequestError(f"{method} {url} failed: {last_error!r}")
+
+    # --- エンドポイント ---
+    async def post_prompt(self, base: str, payload: Any, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """payload は dict（JSON化して送る）か、エンコード済みの bytes。"""
+        if isinstance(payload, (bytes, bytearray, memoryview)):
+            hdrs = {"Content-Type": "application/json"}
+            hdrs.update(headers or {})
+            return await self.request("prompt", "POST", f"{base}/prompt", data=payload, headers=hdrs, idempotent=False)
+        return await self.request("prompt", "POST", f"{base}/prompt", json=payload, headers=headers, idempotent=False)
+
+    async def get_queue(self, base: str) -> Dict[str, Any]:
+        return await self.request("queue", "GET", f"{base}/queue")
+
+    async def get_history(self, base: str, prompt_id: str) -> Dict[str, Any]:
+        return await self.request("history", "GET", f"{base}/history/{prompt_id}")
+
+    async def delete_queued(self, base: str, prompt_ids: List[str]) -> Any:
+        """待機中のプロンプトをキューから取り除く（実行中・完了済みのものには効かない）。"""
+        return await self.request("queue", "POST", f"{base}/queue", json={"delete": list(prompt_ids)})
+
+    async def interrupt(self, base: str, prompt_id: Optional[str] = None) -> Any:
+        """実行中のプロンプトを中断する。prompt_id を付けると、対応する ComfyUI ではそれが実行中のときだけ中断する。"""
+        body = {"prompt_id": prompt_id} if prompt_id else {}
+        return await self.request("interrupt", "POST", f"{base}/interrupt", json=body)
+
+    async def upload_image(
+        self, base: str, path: Path, name: Optional[str] = None, subfolder: str = "", overwrite: bool = False
+    ) -> Dict[str, Any]:
+        """/upload/image へ画像を送る。応答は {"name", "subfolder", "type"}。"""
+        file_path = Path(path)
+        content_type = mimetypes.guess_type(file_path.name)[0] or "image/png"
+
+        def _form() -> aiohttp.FormData:
+            form = aiohttp.FormData()
+            # 再試行ごとに開き直す（FormData は使い回せない）
+            form.add_field("image", file_path.read_bytes(), filename=name or file_path.name, content_type=content_type)
+            form.add_field("type", "input")
+            if subfolder:
+                form.add_field("subfolder", subfolder)
+            form.add_field("overwrite", "true" if overwrite else "false")
+            return form
+
+        return await self.request("upload", "POST", f"{base}/upload/image", data_factory=_form)
+
+    async def input_exists(self, base: str, name: str, subfolder: str = "") -> bool:
+        """入力フォルダに name があるか（/view への HEAD。本体は転送しない）。"""
+        params = {"filename": name, "type": "input"}
+        if subfolder:
+            params["subfolder"] = subfolder
+        timeout = aiohttp.ClientTimeout(total=self.timeouts.get("queue", 10.0))
+        try:
+            async with self._get_session().head(f"{base}/view", params=params, timeout=timeout) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # 確認できなければ「無い」とみなしてアップロードする
+            return False
+
+    async def download(
+        self,
+        base: str,
+        filename: str,
+        dest: Path,
+        subfolder: str = "",
+        folder_type: str = "output",
+        chunk_size: int = 1 << 20,
+    ) -> Tuple[int, str]:
+        """/view の内容を dest へ chunk_size ずつ書き出し、(バイト数, SHA-256) を返す。
+
+        全体をメモリに載せない。dest + ".part" に書いてから置き換えるので、途中で失敗しても
+        中途半端なファイルは dest に残らない。再試行は最初から取り直す。
+        """
+        params = {"filename": filename, "type": folder_type}
+        if subfolder:
+            params["subfolder"] = subfolder
+        # 大きな動画もあるので、全体ではなく受信の途切れに対してタイムアウトする
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10.0, sock_read=self.timeouts.get("view", 300.0))
+        part = Path(str(dest) + ".part")
+        loop = asyncio.get_running_loop()
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.retry.attempts):
+            if attempt:
+                await asyncio.sleep(self.retry.delay(attempt - 1))
+            try:
+                async with self._get_session().get(f"{base}/view", params=params, timeout=timeout) as resp:
+                    if resp.status >= 400:
+                        error = ComfyRequestError(f"GET {base}/view {filename} -> {resp.status}", resp.status)
+                        if resp.status < 500 and resp.status != 429:
+                            raise error
+                        last_error = error
+                        continue
+                    h = hashlib.sha256()
+                    size = 0
+                    f = await loop.run_in_executor(None, open, part, "wb")
+                    try:
+                        async for chunk in resp.content.iter_chunked(chunk_size):
+                            # ハッシュ計算と書き込みはループを止めないよう別スレッドで
+                            await loop.run_in_executor(None, _write_chunk, f, h, chunk)
+                            size += len(chunk)
+                    finally:
+                        await loop.run_in_executor(None, f.close)
+                    expected = resp.content_length
+                    if expected is not None and size != expected:
+                        last_error = ComfyRequestError(f"GET {base}/view {filename}: {size} of {expected} bytes")
+                        continue
+                await loop.run_in_executor(None, os.replace, part, dest)
+                return size, h.hexdigest()
+            except ComfyRequestError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                last_error = e
+        try:
+            part.unlink()
+        except OSError:
+            pass
+        raise ComfyRequestError(f"GET {base}/view {filename} failed: {last_error!r}")
+
+
+def _write_chunk(f: Any, h: "hashlib._Hash", chunk: bytes) -> None:
+    h.update(chunk)
+    f.write(chunk)
+
+
+class ComfyClient:
+    """AsyncComfyClient を専用スレッドのイベントループで動かす同期ファサード。"""
+
+    def __init__(self, **kwargs: Any) -> None:
+        self.aio = AsyncComfyClient(**kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="comfy-http", daemon=True)
+        self._thread.start()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def spawn(self, coro: Coroutine[Any, Any, Any]) -> "Future[Any]":
+        """コルーチンをループへ投げ、待たずに Future を返す。"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        return self.spawn(coro).result()
+
+    def post_prompt(self, base: str, payload: Any) -> Dict[str, Any]:
+        return self.call(self.aio.post_prompt(base, payload))
+
+    def get_queue(self, base: str) -> Dict[str, Any]:
+        return self.call(self.aio.get_queue(base))
+
+    def get_queue_future(self, base: str) -> "Future[Any]":
+        return self.spawn(self.aio.get_queue(base))
+
+    def get_history(self, base: str, prompt_id: str) -> Dict[str, Any]:
+        return self.call(self.aio.get_history(base, prompt_id))
+
+    def delete_queued(self, base: str, prompt_ids: List[str]) -> Any:
+        return self.call(self.aio.delete_queued(base, prompt_ids))
+
+    def interrupt(self, base: str, prompt_id: Optional[str] = None) -> Any:
+        return self.call(self.aio.interrupt(base, prompt_id))
+
+    def upload_image(self, base: str, path: Path, **kwargs: Any) -> Dict[str, Any]:
+        return self.call(self.aio.upload_image(base, path, **kwargs))
+
+    def close(self) -> None:
+        try:
+            self.call(self.aio.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
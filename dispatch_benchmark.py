@@ -0,0 +1,216 @@
+"""投入方式の端から端までのベンチマーク。
+
+fake_comfy_server のシミュレータを同じプロセス内に backends 台立て、loop.py をそのまま（別プロセスで）
+走らせて、投入方式（dispatch_mode・待ち数・並べ替え・まとめ投入など）ごとに次を比べる。
+
+- images/h: 成功した画像数 / 最初の投入から最後の完了までの時間
+- gpu_idle: 同じ時間のうち、シミュレータが何も実行していなかった割合（全バックエンドの平均）
+- model_switches: ローダーの組み合わせが変わって読み込み直しになった回数
+- client: loop.py 自身の [metrics] 行（images/h・gpu_idle）
+
+入力は synthetic_workflow.generate_dispatch_workflow の小さなワークフローと、トリガーのフォルダ名を
+持つ空の PNG。実行時間の分布・モデル切り替えの遅延・失敗の注入はシミュレータのオプションと同じ。
+
+  python dispatch_benchmark.py --images 200 --backends 2 --exec-time 0.05 --model-switch-time 0.1
+  python dispatch_benchmark.py --policies ws,ws-depth --exec-dist lognormal --fail-rate 0.02 --json out/dispatch.json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from fake_comfy_server import EXEC_DISTRIBUTIONS, SimProfile, make_server
+from synthetic_workflow import generate_dispatch_workflow
+
+# 投入方式: 名前 → config.json に重ねる設定
+POLICIES: Dict[str, Dict[str, Any]] = {
+    # 従来の動き: 定期ポーリングで、キューが空になってから1件ずつ
+    "poll": {"dispatch_mode": "poll", "queue_max_pending": 1, "affinity_window": 0},
+    # websocket のイベントで即時投入
+    "ws": {"dispatch_mode": "ws", "queue_max_pending": 1, "affinity_window": 0},
+    # 待ち数の自動調整
+    "ws-depth": {"dispatch_mode": "ws", "queue_max_pending": 4, "affinity_window": 0},
+    # 同じモデル構成の画像を続けて投入
+    "ws-depth-affinity": {"dispatch_mode": "ws", "queue_max_pending": 4, "affinity_window": 256},
+    # ジョブ専用ディレクトリに数枚ずつまとめて投入
+    "staged-batch": {
+        "dispatch_mode": "ws",
+        "queue_max_pending": 4,
+        "affinity_window": 256,
+        "input_mode": "staged",
+        "batch_max": 8,
+    },
+}
+
+# 1x1 の透明 PNG（シミュレータは中身を読まない）
+_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+_METRICS_RE = re.compile(r"^\[metrics\] done=(\d+) images/h=(\d+) .* gpu_idle=(\d+)%")
+
+
+def prepare(workdir: Path, args: argparse.Namespace) -> None:
+    """ワークフロー・グループ定義・入力画像を workdir に書き出す（方式ごとに使い回す）。"""
+    sw = generate_dispatch_workflow(
+        groups=args.groups, loaders_per_group=args.loaders_per_group, paths=args.images, seed=args.seed
+    )
+    (workdir / "out").mkdir(parents=True, exist_ok=True)
+    (workdir / "workflow.json").write_text(json.dumps(sw.api), encoding="utf-8")
+    (workdir / "out" / "model_loader_groups.json").write_text(json.dumps(sw.groups), encoding="utf-8")
+    for rel in sw.paths:
+        path = workdir / "input" / Path(*rel.parts[1:])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(_PNG)
+
+
+def run_policy(name: str, overlay: Dict[str, Any], workdir: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    """シミュレータを立てて loop.py を1回走らせ、結果をまとめる。"""
+    servers = []
+    for i in range(args.backends):
+        profile = SimProfile(
+            exec_time=args.exec_time,
+            exec_dist=args.exec_dist,
+            exec_spread=args.exec_spread,
+            model_switch_time=args.model_switch_time,
+            fail_rate=args.fail_rate,
+            lost_rate=args.lost_rate,
+            reject_rate=args.reject_rate,
+            http_error_rate=args.http_error_rate,
+            seed=args.seed * 1000 + i,
+        )
+        server = make_server("127.0.0.1", 0, args.exec_time, output_bytes=args.output_bytes, profile=profile)
+        threading.Thread(target=server.serve_forever, name=f"sim-{i}", daemon=True).start()
+        servers.append(server)
+    config: Dict[str, Any] = {
+        "workflow": "workflow.json",
+        "input_dir": str(workdir / "input"),
+        "backends": [f"http://127.0.0.1:{s.server_address[1]}" for s in servers],
+        "ledger_path": "",
+        "metrics_port": 0,
+        "auto_extract": False,
+        "poll_interval": args.poll_interval,
+        "staging_dir": str(workdir / f"staging_{name}"),
+        "batch_target_seconds": args.exec_time * 8,
+        "http_retries": 6,
+    }
+    config.update(overlay)
+    config.update(json.loads(args.config) if args.config else {})
+    (workdir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+
+    started = time.time()
+    try:
+        proc = subprocess.run(
+            [sys.executable, "-u", str(Path(__file__).resolve().parent / "loop.py")],
+            cwd=workdir,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            timeout=args.timeout,
+        )
+        output, timed_out, returncode = proc.stdout + proc.stderr, False, proc.returncode
+    except subprocess.TimeoutExpired as e:
+        output, timed_out, returncode = str(e.stdout or "") + str(e.stderr or ""), True, None
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.state.stop()
+            server.server_close()
+    if args.verbose:
+        print(output)
+    elif returncode:
+        # 途中で落ちた場合は原因が分かるよう末尾だけ出す
+        print("\n".join(output.splitlines()[-20:]))
+
+    states = [s.state for s in servers]
+    first = min((st.first_enqueued for st in states if st.first_enqueued is not None), default=started)
+    last = max((st.last_finished for st in states if st.last_finished is not None), default=first)
+    window = max(1e-9, last - first)
+    busy = sum(st.stats["busy_seconds"] for st in states)
+    images = sum(int(st.stats["images"]) for st in states)
+    result: Dict[str, Any] = {
+        "images": images,
+        "images_per_hour": images / window * 3600,
+        "gpu_idle": max(0.0, 1 - busy / (window * len(states))),
+        "wall_s": window,
+        "model_switches": int(sum(st.stats["model_switches"] for st in states)),
+        "failed": int(sum(st.stats["failed"] + st.stats["lost"] + st.stats["rejected"] for st in states)),
+        "timed_out": timed_out,
+        "returncode": returncode,
+        "client_images_per_hour": None,
+        "client_gpu_idle": None,
+    }
+    for line in output.splitlines():
+        m = _METRICS_RE.match(line)
+        if m:
+            result["client_images_per_hour"] = int(m.group(2))
+            result["client_gpu_idle"] = int(m.group(3)) / 100
+    return result
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'policy':<20} {'images':>7} {'images/h':>10} {'gpu_idle':>9} {'switches':>9} {'failed':>7} {'client img/h':>13}")
+    for name, r in results.items():
+        client = f"{r['client_images_per_hour']}" if r["client_images_per_hour"] is not None else "-"
+        flag = " (timeout)" if r["timed_out"] else (f" (exit {r['returncode']})" if r["returncode"] else "")
+        print(
+            f"{name:<20} {r['images']:>7} {r['images_per_hour']:>10.0f} {r['gpu_idle'] * 100:>8.1f}% "
+            f"{r['model_switches']:>9} {r['failed']:>7} {client:>13}{flag}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="投入方式の端から端までのベンチマーク")
+    parser.add_argument("--policies", type=str, default=",".join(POLICIES), help="比べる投入方式（カンマ区切り）")
+    parser.add_argument("--config", type=str, default="", help="すべての方式の config.json に重ねる JSON")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--loaders-per-group", type=int, default=2)
+    parser.add_argument("--exec-time", type=float, default=0.05, help="画像1枚あたりの平均実行秒数")
+    parser.add_argument("--exec-dist", choices=EXEC_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--exec-spread", type=float, default=0.3)
+    parser.add_argument("--model-switch-time", type=float, default=0.1)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--lost-rate", type=float, default=0.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--output-bytes", type=int, default=1024)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=600.0, help="1方式あたりの打ち切り秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=str, default="", help="結果を書き出す JSON ファイル")
+    parser.add_argument("--verbose", action="store_true", help="loop.py の出力を表示")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.policies.split(",") if n.strip()]
+    unknown = [n for n in names if n not in POLICIES]
+    if unknown:
+        parser.error(f"unknown policy: {', '.join(unknown)} (expected: {', '.join(POLICIES)})")
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory(prefix="comfy-dispatch-") as tmp:
+        workdir = Path(tmp)
+        prepare(workdir, args)
+        for name in names:
+            print(f"[bench] policy={name} ...", flush=True)
+            results[name] = run_policy(name, POLICIES[name], workdir, args)
+
+    print_table(results)
+    if args.json:
+        out = Path(args.json)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({"args": vars(args), "results": results}, indent=2), encoding="utf-8")
+    # 打ち切り・loop.py の異常終了があれば、数字が揃っていても失敗とする
+    return 1 if any(r["timed_out"] or r["returncode"] for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,19 @@
+import argparse
+import bisect
 import json
 import os
+import re
+import time
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 # 入力と出力のパス
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_JSON_PATH = os.path.join(ROOT_DIR, "00-I2v_ImageToVideo.json")
 OUTPUT_DIR = os.path.join(ROOT_DIR, "out")
 OUTPUT_JSON_PATH = os.path.join(OUTPUT_DIR, "model_loader_groups.json")
+# グループを抽出するサブグラフの名前（部分一致・大文字小文字を区別しない）
+LOADER_NAME_PATTERN = re.compile(r"ModelLoader", re.IGNORECASE)
 
 
 def safe_float(value: Any) -> Optional[float]:
@@ -85,114 +91,214 @@ def node_position(node: Dict[str, Any]) -> Optional[Tuple[float, float]]:
     return (pxf, pyf)
 
 
-def extract_model_loader_groups(data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    definitions = data.get("definitions") or {}
-    subgraphs = definitions.get("subgraphs") or []
+class _SweepIndex:
+    """ノード位置を x で整列した索引。矩形の x 範囲を二分探索で絞ってから y を判定する。"""
 
-    target: Optional[Dict[str, Any]] = None
-    for sg in subgraphs:
-        if isinstance(sg, dict) and sg.get("name") == "ModelLoader":
-            target = sg
-            break
+    def __init__(self, positions: List[Tuple[int, str, float, float]]) -> None:
+        # (x, 元の並び順, node_id, y)
+        self._items = sorted(((px, order, nid, py) for order, nid, px, py in positions), key=lambda it: it[0])
+        self._xs = [it[0] for it in self._items]
+
+    def query(self, rect: Tuple[float, float, float, float]) -> List[Tuple[int, str]]:
+        """矩形に含まれる (元の並び順, node_id)。境界上も含む（point_in_rect と同じ）。"""
+        x, y, w, h = rect
+        lo = bisect.bisect_left(self._xs, x)
+        hi = bisect.bisect_right(self._xs, x + w)
+        return [(order, nid) for _, order, nid, py in self._items[lo:hi] if y <= py <= y + h]
+
+
+def _node_key(nd: Dict[str, Any]) -> Optional[str]:
+    node_id = nd.get("id") or nd.get("node_id") or nd.get("uuid")
+    return None if node_id is None else str(node_id)
+
+
+def _trigger_folder_name(title: str) -> List[str]:
+    first_two = title.split(", ")[:2] if title else []
+    trigger_folder_name = [f.split(" ")[0].strip() for f in first_two]
+    if len(trigger_folder_name) < 2 and title:
+        trigger_folder_name = title.split(" ")[:2]
+    return trigger_folder_name
+
+
+def _leaf_keys(
+    subgraph_id: str, subgraphs: Dict[str, Dict[str, Any]], stack: Tuple[str, ...]
+) -> List[str]:
+    """サブグラフ内の全ノードのキー（入れ子のインスタンスは "<instance>:<id>" に展開）。"""
+    out: List[str] = []
+    for nd in subgraphs[subgraph_id].get("nodes") or []:
+        if not isinstance(nd, dict):
+            continue
+        key = _node_key(nd)
+        if key is None:
+            continue
+        sub_type = nd.get("type")
+        if isinstance(sub_type, str) and sub_type in subgraphs and sub_type not in stack:
+            out.extend(f"{key}:{leaf}" for leaf in _leaf_keys(sub_type, subgraphs, stack + (sub_type,)))
+        else:
+            out.append(key)
+    return out
 
-    if target is None:
-        return []
 
-    # ターゲットサブグラフのID
-    target_subgraph_id: Optional[str] = None
-    if isinstance(target.get("id"), (str, int)):
-        target_subgraph_id = str(target.get("id"))
-
-    # ルート nodes から、type がサブグラフIDのノードを特定（最初の一件）
-    root_nodes = data.get("nodes") or []
-    subgraph_node_id_str: Optional[str] = None
-    if target_subgraph_id is not None:
-        for nd in root_nodes:
-            if not isinstance(nd, dict):
-                continue
-            if nd.get("type") == target_subgraph_id:
-                nid = nd.get("id")
-                if isinstance(nid, (str, int)):
-                    subgraph_node_id_str = str(nid)
-                break
-
-    groups = target.get("groups") or []
-    nodes = target.get("nodes") or []
+def _subgraph_groups(
+    sg: Dict[str, Any], subgraphs: Dict[str, Dict[str, Any]]
+) -> List[Tuple[List[str], List[str]]]:
+    """サブグラフ定義1つ分のグループ → (trigger_folder_name, ノードキー) の一覧。"""
+    groups = sg.get("groups") or []
+    nodes = sg.get("nodes") or []
 
     # ノードID→ノード辞書、また位置
     id_to_node: Dict[str, Dict[str, Any]] = {}
-    node_positions: Dict[str, Tuple[float, float]] = {}
+    positions: List[Tuple[int, str, float, float]] = []
     for nd in nodes:
         if not isinstance(nd, dict):
             continue
-        node_id = nd.get("id") or nd.get("node_id") or nd.get("uuid")
-        if node_id is None:
+        key = _node_key(nd)
+        if key is None:
             continue
-        id_to_node[str(node_id)] = nd
+        id_to_node[key] = nd
         pos = node_position(nd)
         if pos is not None:
-            node_positions[str(node_id)] = pos
-
-    results: List[Dict[str, Any]] = []
-
+            positions.append((len(positions), key, pos[0], pos[1]))
+    # 同じ ID が重複していたら後の位置を使う（dict へ順に入れていた従来の挙動）
+    last_pos: Dict[str, Tuple[int, str, float, float]] = {}
+    first_order: Dict[str, int] = {}
+    for order, key, px, py in positions:
+        first_order.setdefault(key, order)
+        last_pos[key] = (first_order[key], key, px, py)
+    index = _SweepIndex(list(last_pos.values()))
+    stack = (str(sg.get("id")),)
+
+    def expand(key: str) -> List[str]:
+        # グループ内のサブグラフインスタンスは、その中の全ノードとして扱う
+        sub_type = id_to_node[key].get("type")
+        if isinstance(sub_type, str) and sub_type in subgraphs and sub_type not in stack:
+            return [f"{key}:{leaf}" for leaf in _leaf_keys(sub_type, subgraphs, stack + (sub_type,))]
+        return [key]
+
+    results: List[Tuple[List[str], List[str]]] = []
     for gp in groups:
         if not isinstance(gp, dict):
             continue
         title = gp.get("title") or gp.get("name") or gp.get("label") or ""
         rect = rect_from_any(gp)
 
-        # グループが直接 node IDs を持っている可能性
+        # 1) グループが直接 node IDs を持っていれば採用
         raw_nodes = gp.get("nodes")
-        listed_nodes: List[Any] = list(raw_nodes) if isinstance(raw_nodes, list) else []
-        listed_nodes_str: List[str] = [str(n) for n in listed_nodes]
-
-        contained_ids: List[str] = []
-
-        # 1) 明示的に列挙されている nodes を採用
-        for nid in listed_nodes_str:
+        contained: Dict[str, None] = {}
+        for nid in (str(n) for n in raw_nodes) if isinstance(raw_nodes, list) else []:
             if nid in id_to_node:
-                contained_ids.append(nid)
+                contained[nid] = None
 
-        # 2) 矩形があれば、位置で内包判定
+        # 2) 矩形があれば、位置で内包判定（元の並び順を保つ）
         if rect is not None:
-            for nid, pos in node_positions.items():
-                if nid in contained_ids:
-                    continue
-                px, py = pos
-                if point_in_rect(px, py, rect):
-                    contained_ids.append(nid)
-
-        # 3) ノードの中心やサイズでさらに厳密に見たい場合はここで拡張可能
-        first_two = title.split(", ")[:2] if title else []
-        trigger_folder_name = [f.split(" ")[0].strip() for f in first_two]
-        if len(trigger_folder_name) < 2 and title:
-            trigger_folder_name = title.split(" ")[:2]
-        results.append({
-            "subgraph_id": subgraph_node_id_str,
-            "trigger_folder_name": trigger_folder_name,
-            # "group_bounds": {
-            #     "x": rect[0],
-            #     "y": rect[1],
-            #     "w": rect[2],
-            #     "h": rect[3],
-            # } if rect is not None else None,
-            "node_ids": contained_ids,
-            # "nodes": [id_to_node[nid] for nid in contained_ids if nid in id_to_node],
-        })
+            for _, nid in sorted(index.query(rect)):
+                contained.setdefault(nid, None)
 
+        keys: List[str] = []
+        for nid in contained:
+            keys.extend(expand(nid))
+        results.append((_trigger_folder_name(title), keys))
     return results
 
 
-def main() -> None:
-    data = json.loads(Path(INPUT_JSON_PATH).read_text(encoding="utf-8"))
-    results = extract_model_loader_groups(data)
-    Path(OUTPUT_JSON_PATH).parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT_JSON_PATH, "w", encoding="utf-8") as f:
+def _iter_instances(
+    nodes: List[Any], subgraphs: Dict[str, Dict[str, Any]], path: Tuple[str, ...] = (), stack: Tuple[str, ...] = ()
+) -> Iterator[Tuple[Tuple[str, ...], str]]:
+    """ルートから辿れるサブグラフのインスタンス (インスタンスのIDパス, サブグラフID)。"""
+    for nd in nodes:
+        if not isinstance(nd, dict):
+            continue
+        sub_type = nd.get("type")
+        key = _node_key(nd)
+        if key is None or not isinstance(sub_type, str) or sub_type not in subgraphs or sub_type in stack:
+            continue
+        inst_path = path + (key,)
+        yield inst_path, sub_type
+        yield from _iter_instances(subgraphs[sub_type].get("nodes") or [], subgraphs, inst_path, stack + (sub_type,))
+
+
+def extract_model_loader_groups(
+    data: Dict[str, Any], name_pattern: "re.Pattern[str]" = LOADER_NAME_PATTERN
+) -> List[Dict[str, Any]]:
+    """名前が name_pattern に一致する全サブグラフの、全インスタンスのグループを返す。
+
+    subgraph_id はルートからのインスタンスIDを ":" で連結したもの（入れ子なら "<外側>:<内側>"）。
+    インスタンスが見つからないサブグラフは subgraph_id を None として1回だけ返す。
+    """
+    definitions = data.get("definitions") or {}
+    subgraphs: Dict[str, Dict[str, Any]] = {}
+    for sg in definitions.get("subgraphs") or []:
+        if isinstance(sg, dict) and isinstance(sg.get("id"), (str, int)):
+            subgraphs.setdefault(str(sg.get("id")), sg)
+
+    loader_ids = [
+        sid for sid, sg in subgraphs.items() if isinstance(sg.get("name"), str) and name_pattern.search(sg["name"])
+    ]
+    if not loader_ids:
+        return []
+    # グループの内包判定はサブグラフ定義ごとに1回だけ
+    per_definition = {sid: _subgraph_groups(subgraphs[sid], subgraphs) for sid in loader_ids}
+
+    results: List[Dict[str, Any]] = []
+    instantiated = set()
+    for inst_path, sid in _iter_instances(data.get("nodes") or [], subgraphs):
+        if sid not in per_definition:
+            continue
+        instantiated.add(sid)
+        for triggers, keys in per_definition[sid]:
+            results.append({"subgraph_id": ":".join(inst_path), "trigger_folder_name": triggers, "node_ids": list(keys)})
+    for sid in loader_ids:
+        if sid not in instantiated:
+            for triggers, keys in per_definition[sid]:
+                results.append({"subgraph_id": None, "trigger_folder_name": triggers, "node_ids": list(keys)})
+    return results
+
+
+def extract_to_files(
+    input_path: str = INPUT_JSON_PATH,
+    output_path: str = OUTPUT_JSON_PATH,
+    names_path: str = "trigger_folder_names.txt",
+    name_pattern: "re.Pattern[str]" = LOADER_NAME_PATTERN,
+) -> List[Dict[str, Any]]:
+    """UI形式のワークフローからグループを抽出し、model_loader_groups.json と一覧を書き出す。"""
+    data = json.loads(Path(input_path).read_text(encoding="utf-8"))
+    results = extract_model_loader_groups(data, name_pattern)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     trigger_folder_names = (", ".join(result["trigger_folder_name"]) for result in results)
-    Path("trigger_folder_names.txt").write_text("\n".join(trigger_folder_names), encoding="utf-8")
+    Path(names_path).write_text("\n".join(trigger_folder_names), encoding="utf-8")
+    return results
 
 
+def refresh_groups(
+    input_path: str,
+    output_path: str,
+    names_path: str = "trigger_folder_names.txt",
+    name_pattern: "re.Pattern[str]" = LOADER_NAME_PATTERN,
+) -> bool:
+    """出力が無いか入力より古ければ抽出し直す。抽出したら True。"""
+    src = Path(input_path)
+    out = Path(output_path)
+    if not src.exists():
+        return False
+    if out.exists() and out.stat().st_mtime >= src.stat().st_mtime:
+        return False
+    t0 = time.perf_counter()
+    results = extract_to_files(str(src), str(out), names_path, name_pattern)
+    print(f"[extract] {len(results)} group(s) from {src} -> {out} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+    return True
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ワークフローからモデルローダーグループを抽出する")
+    parser.add_argument("-i", "--input", type=str, default=INPUT_JSON_PATH, help="UI形式のワークフローJSON")
+    parser.add_argument("-o", "--output", type=str, default=OUTPUT_JSON_PATH)
+    parser.add_argument("--name-pattern", type=str, default=LOADER_NAME_PATTERN.pattern,
+                        help="対象サブグラフ名の正規表現（大文字小文字を区別しない）")
+    args = parser.parse_args()
+    extract_to_files(args.input, args.output, name_pattern=re.compile(args.name_pattern, re.IGNORECASE))
+
 
 if __name__ == "__main__":
     main()
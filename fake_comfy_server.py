@@ -0,0 +1,669 @@
+"""オフライン動作確認用の簡易 ComfyUI 互換サーバ（投入方式のベンチマーク用のシミュレータを兼ねる）。
+
+/prompt, /queue, /history, /ws, /upload/image, /view を実装し、投入されたプロンプトを
+画像1枚につき --exec-time 秒ずつ順番に「実行」して websocket イベントを送る（LoadImagesFromFolderKJ の
+image_load_cap で複数枚をまとめたプロンプトは、その枚数ぶん時間がかかる）。アップロードされた画像は
+メモリ上に保持し、LoadImage が存在しない画像を指していれば /prompt を 400 で拒否する。
+SaveImage / VHS_VideoCombine は画像1枚につき --output-bytes バイトの出力ファイルを作り、/history の
+outputs に載せて /view（type=output）で返す。
+/prompt の front: true は待ち行列の先頭へ積み、POST /queue の {"delete": [prompt_id, ...]} は待機中の
+プロンプトを取り消し、POST /interrupt（{"prompt_id"} を付ければそのプロンプトが実行中のときだけ）は
+実行中のプロンプトを中断する（履歴は ComfyUI と同じく error で、execution_interrupted を送る）。
+
+SimProfile で実行のされ方を変えられる:
+- 実行時間の分布（--exec-dist fixed / uniform / normal / lognormal、ばらつきは --exec-spread）
+- モデルローダーノード（class_type に "Loader" を含むノード）の組み合わせが直前のプロンプトと違えば、
+  読み込み直しとして --model-switch-time 秒を足す
+- 失敗の注入: 実行エラー（--fail-rate）、履歴を残さずに消える（--lost-rate）、/prompt を 500 で拒否
+  （--reject-rate）、/queue・/history・/view を 503 で返す（--http-error-rate）
+- /queue の応答の遅れ（--queue-delay。問い合わせが間に合わない場合の確認用）
+
+    python fake_comfy_server.py --port 8188 --exec-time 3
+    python fake_comfy_server.py --port 8188 --exec-time 3 --exec-dist lognormal --model-switch-time 8 --fail-rate 0.02
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+import os
+import queue
+import random
+import select
+import socket
+import struct
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_ws_text_frame(text: str) -> bytes:
+    """サーバ→クライアントのテキストフレーム（マスク無し）。"""
+    payload = text.encode("utf-8")
+    n = len(payload)
+    if n < 126:
+        header = struct.pack("!BB", 0x81, n)
+    elif n < 65536:
+        header = struct.pack("!BBH", 0x81, 126, n)
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, n)
+    return header + payload
+
+
+def read_ws_frame(sock: socket.socket) -> Optional[int]:
+    """クライアントからのフレームを1つ読み捨てて opcode を返す。切断なら None。"""
+
+    def _recv_exact(n: int) -> Optional[bytes]:
+        buf = b""
+        while len(buf) < n:
+            chunk = sock.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    head = _recv_exact(2)
+    if head is None:
+        return None
+    opcode = head[0] & 0x0F
+    masked = head[1] & 0x80
+    length = head[1] & 0x7F
+    if length == 126:
+        ext = _recv_exact(2)
+        if ext is None:
+            return None
+        length = struct.unpack("!H", ext)[0]
+    elif length == 127:
+        ext = _recv_exact(8)
+        if ext is None:
+            return None
+        length = struct.unpack("!Q", ext)[0]
+    if masked and _recv_exact(4) is None:
+        return None
+    if length and _recv_exact(length) is None:
+        return None
+    return opcode
+
+
+EXEC_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal")
+
+
+class SimProfile:
+    """実行時間の分布・モデル切り替えの遅延・失敗の注入。乱数は seed で再現できる。"""
+
+    def __init__(
+        self,
+        exec_time: float = 3.0,
+        exec_dist: str = "fixed",
+        exec_spread: float = 0.2,
+        model_switch_time: float = 0.0,
+        fail_rate: float = 0.0,
+        lost_rate: float = 0.0,
+        reject_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        queue_delay: float = 0.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        if exec_dist not in EXEC_DISTRIBUTIONS:
+            raise ValueError(f"unknown exec distribution: {exec_dist!r} (expected one of {', '.join(EXEC_DISTRIBUTIONS)})")
+        # exec_time は画像1枚あたりの平均秒数、exec_spread は標準偏差 / 平均（uniform は ±幅 / 平均）
+        self.exec_time = exec_time
+        self.exec_dist = exec_dist
+        self.exec_spread = max(0.0, exec_spread)
+        self.model_switch_time = model_switch_time
+        self.fail_rate = fail_rate
+        self.lost_rate = lost_rate
+        self.reject_rate = reject_rate
+        self.http_error_rate = http_error_rate
+        self.queue_delay = max(0.0, queue_delay)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def chance(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def exec_seconds(self, images: int) -> float:
+        """images 枚ぶんの実行秒数（1枚ずつ分布から引いて足す）。"""
+        mean = self.exec_time
+        spread = self.exec_spread
+        total = 0.0
+        with self._lock:
+            for _ in range(max(1, images)):
+                if self.exec_dist == "uniform":
+                    value = self._rng.uniform(mean * (1 - spread), mean * (1 + spread))
+                elif self.exec_dist == "normal":
+                    value = self._rng.gauss(mean, mean * spread)
+                elif self.exec_dist == "lognormal" and mean > 0:
+                    # 平均が mean、変動係数が spread になるように
+                    sigma2 = math.log(1 + spread * spread)
+                    value = self._rng.lognormvariate(math.log(mean) - sigma2 / 2, math.sqrt(sigma2))
+                else:
+                    value = mean
+                total += max(0.0, value)
+        return total
+
+
+def _loader_signature(prompt: Dict[str, Any]) -> Tuple[Any, ...]:
+    """プロンプト中のモデルローダーノードの組み合わせ（ノードIDと、読み込むファイル名などのリテラル入力）。"""
+    loaders = []
+    for node_id, node in prompt.items():
+        if not isinstance(node, dict) or "Loader" not in str(node.get("class_type", "")):
+            continue
+        literals = sorted(
+            (k, str(v)) for k, v in (node.get("inputs") or {}).items() if not isinstance(v, (list, dict))
+        )
+        loaders.append((str(node_id), str(node.get("class_type")), tuple(literals)))
+    return tuple(sorted(loaders))
+
+
+class FakeComfyState:
+    """キュー・履歴・websocket クライアントを保持し、ワーカーで順次実行する。"""
+
+    def __init__(self, exec_time: float, output_bytes: int = 65536, profile: Optional[SimProfile] = None) -> None:
+        self.profile = profile or SimProfile(exec_time=exec_time)
+        self.exec_time = self.profile.exec_time
+        self.output_bytes = output_bytes
+        self.lock = threading.Condition()
+        self.pending: List[List[Any]] = []
+        self.running: Optional[List[Any]] = None
+        self.history: Dict[str, Dict[str, Any]] = {}
+        self.number = 0
+        self.clients: Dict[str, "queue.Queue[str]"] = {}
+        # アップロードされた入力画像: (subfolder, name) -> 内容
+        self.inputs: Dict[Tuple[str, str], bytes] = {}
+        # 出力ファイル: (subfolder, name) -> 内容
+        self.outputs: Dict[Tuple[str, str], bytes] = {}
+        self.output_counter = 0
+        self.uploads = 0
+        # 集計（ベンチマーク用）: 実行していた秒数・最初の投入と最後の完了の時刻・結果ごとの件数
+        self.stats: Dict[str, float] = {
+            "prompts": 0,
+            "images": 0,
+            "failed": 0,
+            "lost": 0,
+            "rejected": 0,
+            "http_errors": 0,
+            "model_switches": 0,
+            "switch_seconds": 0.0,
+            "deleted": 0,
+            "interrupted": 0,
+            "busy_seconds": 0.0,
+        }
+        self.first_enqueued: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self._last_loaders: Optional[Tuple[Any, ...]] = None
+        self._stop = threading.Event()
+        # 実行中のプロンプトの中断要求（/interrupt）
+        self._interrupt = threading.Event()
+        self.worker = threading.Thread(target=self._work, name="fake-comfy-worker", daemon=True)
+
+    # --- websocket 配信 ---
+    def _queue_remaining(self) -> int:
+        return len(self.pending) + (1 if self.running is not None else 0)
+
+    def send(self, ev_type: str, data: Dict[str, Any], client_id: Optional[str] = None) -> None:
+        text = json.dumps({"type": ev_type, "data": data})
+        targets = [client_id] if client_id is not None else list(self.clients.keys())
+        for cid in targets:
+            q = self.clients.get(cid)
+            if q is not None:
+                q.put(text)
+
+    def status_data(self, sid: Optional[str] = None) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"status": {"exec_info": {"queue_remaining": self._queue_remaining()}}}
+        if sid is not None:
+            data["sid"] = sid
+        return data
+
+    def broadcast_status(self) -> None:
+        self.send("status", self.status_data())
+
+    # --- キュー操作 ---
+    def enqueue(self, prompt: Dict[str, Any], client_id: Optional[str], front: bool = False) -> Dict[str, Any]:
+        with self.lock:
+            prompt_id = str(uuid.uuid4())
+            number = self.number
+            self.number += 1
+            extra = {"client_id": client_id}
+            if front:
+                # ComfyUI と同じく負の番号で、待機中のどれよりも先に実行する
+                number = -number
+                self.pending.insert(0, [number, prompt_id, prompt, extra, []])
+            else:
+                self.pending.append([number, prompt_id, prompt, extra, []])
+            if self.first_enqueued is None:
+                self.first_enqueued = time.time()
+            self.lock.notify_all()
+        self.broadcast_status()
+        return {"prompt_id": prompt_id, "number": number, "node_errors": {}}
+
+    def missing_images(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
+        """LoadImage が指す画像のうち、アップロードされていないもの（ComfyUI の node_errors 形式）。"""
+        errors: Dict[str, Any] = {}
+        for node_id, node in prompt.items():
+            if not isinstance(node, dict) or node.get("class_type") != "LoadImage":
+                continue
+            image = str((node.get("inputs") or {}).get("image") or "")
+            sub, _, name = image.rpartition("/")
+            with self.lock:
+                found = (sub, name) in self.inputs
+            if not found:
+                errors[node_id] = {
+                    "errors": [{"type": "value_not_in_list", "message": f"Invalid image file: {image}"}],
+                    "class_type": "LoadImage",
+                }
+        return errors
+
+    def store_input(self, subfolder: str, name: str, data: bytes) -> None:
+        with self.lock:
+            self.inputs[(subfolder, name)] = data
+            self.uploads += 1
+
+    def make_outputs(self, prompt: Dict[str, Any]) -> Dict[str, Any]:
+        """出力ノードごとに画像の枚数ぶんのファイルを作り、/history の outputs の形で返す。"""
+        outputs: Dict[str, Any] = {}
+        images = _prompt_images(prompt)
+        for node_id, node in prompt.items():
+            class_type = node.get("class_type") if isinstance(node, dict) else None
+            if class_type not in _OUTPUT_KINDS:
+                continue
+            key, ext = _OUTPUT_KINDS[class_type]
+            items = []
+            for _ in range(images):
+                with self.lock:
+                    self.output_counter += 1
+                    name = f"ComfyUI_{self.output_counter:05d}_{ext}"
+                    self.outputs[("", name)] = os.urandom(self.output_bytes)
+                items.append({"filename": name, "subfolder": "", "type": "output"})
+            outputs[node_id] = {key: items}
+        return outputs
+
+    def delete_pending(self, prompt_ids: List[str]) -> int:
+        """待機中のプロンプトを取り消す（実行中・完了済みは対象外）。取り消した件数。"""
+        targets = {str(p) for p in prompt_ids}
+        with self.lock:
+            before = len(self.pending)
+            self.pending = [item for item in self.pending if item[1] not in targets]
+            deleted = before - len(self.pending)
+            self.stats["deleted"] += deleted
+        if deleted:
+            self.broadcast_status()
+        return deleted
+
+    def interrupt(self, prompt_id: Optional[str] = None) -> bool:
+        """実行中のプロンプト（prompt_id を指定したらそれが実行中のときだけ）を中断する。"""
+        with self.lock:
+            if self.running is None or (prompt_id is not None and self.running[1] != prompt_id):
+                return False
+            self._interrupt.set()
+            return True
+
+    def queue_snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            running = [self.running] if self.running is not None else []
+            return {"queue_running": list(running), "queue_pending": list(self.pending)}
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            with self.lock:
+                while not self.pending and not self._stop.is_set():
+                    self.lock.wait(0.5)
+                if self._stop.is_set():
+                    return
+                item = self.pending.pop(0)
+                self.running = item
+                self._interrupt.clear()
+            prompt_id = item[1]
+            client_id = item[3].get("client_id")
+            started = time.time()
+            self.broadcast_status()
+            self.send("execution_start", {"prompt_id": prompt_id, "timestamp": int(started * 1000)}, client_id)
+            first_node = next(iter(item[2].keys()), None)
+            self.send("executing", {"node": first_node, "display_node": first_node, "prompt_id": prompt_id}, client_id)
+            images = _prompt_images(item[2])
+            delay = self.profile.exec_seconds(images)
+            loaders = _loader_signature(item[2])
+            if self._last_loaders is not None and loaders != self._last_loaders:
+                # モデルの組み合わせが変わった: 読み込み直しの時間を足す
+                delay += self.profile.model_switch_time
+                self.stats["model_switches"] += 1
+                self.stats["switch_seconds"] += self.profile.model_switch_time
+            self._last_loaders = loaders
+            deadline = started + delay
+            while not self._stop.is_set() and not self._interrupt.is_set() and time.time() < deadline:
+                self._interrupt.wait(min(0.05, max(0.0, deadline - time.time())))
+            finished = time.time()
+            if self._interrupt.is_set():
+                outcome, outputs = "interrupted", {}
+            elif self.profile.chance(self.profile.lost_rate):
+                # 履歴を残さずに消える（サーバの再起動などでキューが失われた場合）
+                outcome, outputs = "lost", {}
+            elif self.profile.chance(self.profile.fail_rate):
+                outcome, outputs = "error", {}
+            else:
+                outcome, outputs = "success", self.make_outputs(item[2])
+            end_event = {"success": "execution_success", "interrupted": "execution_interrupted"}.get(outcome, "execution_error")
+            end_data: Dict[str, Any] = {"prompt_id": prompt_id, "timestamp": int(finished * 1000)}
+            if outcome == "interrupted":
+                end_data.update({"node_id": first_node, "executed": []})
+            elif outcome == "error":
+                end_data.update({"node_id": first_node, "exception_type": "SimulatedError", "exception_message": "injected failure"})
+            with self.lock:
+                if outcome != "lost":
+                    self.history[prompt_id] = {
+                        "prompt": item[:4],
+                        "outputs": outputs,
+                        "status": {
+                            "status_str": "success" if outcome == "success" else "error",
+                            "completed": outcome == "success",
+                            "messages": [
+                                ["execution_start", {"prompt_id": prompt_id, "timestamp": int(started * 1000)}],
+                                [end_event, end_data],
+                            ],
+                        },
+                    }
+                self.running = None
+                self.stats["prompts"] += 1
+                self.stats["busy_seconds"] += finished - started
+                if outcome == "success":
+                    self.stats["images"] += images
+                else:
+                    self.stats["failed" if outcome == "error" else outcome] += 1
+                self.last_finished = finished
+            self.send("executing", {"node": None, "prompt_id": prompt_id}, client_id)
+            if outcome != "lost":
+                self.send(end_event, end_data, client_id)
+            self.broadcast_status()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self.lock:
+            self.lock.notify_all()
+
+
+# 出力ファイルを作るノード: class_type → (/history の outputs のキー, ファイル名の末尾)
+_OUTPUT_KINDS: Dict[str, Tuple[str, str]] = {
+    "SaveImage": ("images", ".png"),
+    "VHS_VideoCombine": ("gifs", ".mp4"),
+}
+
+
+def _prompt_images(prompt: Dict[str, Any]) -> int:
+    """プロンプトが読み込む画像の枚数（フォルダ読み込みノードの image_load_cap、無ければ1）。"""
+    images = 0
+    for node in prompt.values():
+        if isinstance(node, dict) and node.get("class_type") == "LoadImagesFromFolderKJ":
+            cap = (node.get("inputs") or {}).get("image_load_cap")
+            images += cap if isinstance(cap, int) and cap > 0 else 1
+    return max(1, images)
+
+
+class FakeComfyHandler(BaseHTTPRequestHandler):
+    server_version = "FakeComfy/0.1"
+
+    @property
+    def state(self) -> FakeComfyState:
+        return self.server.state  # type: ignore[attr-defined]
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        # アクセスログは抑制（必要なら --verbose で表示）
+        if getattr(self.server, "verbose", False):
+            super().log_message(format, *args)
+
+    def _send_json(self, obj: Any, status: int = 200) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_http_error(self) -> bool:
+        """--http-error-rate の確率で 503 を返す（返したら True）。"""
+        if not self.state.profile.chance(self.state.profile.http_error_rate):
+            return False
+        with self.state.lock:
+            self.state.stats["http_errors"] += 1
+        self._send_json({"error": "simulated outage"}, status=503)
+        return True
+
+    def do_GET(self) -> None:  # noqa: N802
+        url = urlparse(self.path)
+        if url.path == "/ws":
+            self._handle_ws(parse_qs(url.query).get("clientId", [None])[0])
+            return
+        if url.path in ("/queue", "/view") or url.path.startswith("/history"):
+            if self._inject_http_error():
+                return
+        if url.path == "/queue":
+            # 遅れて届く応答は、問い合わせを受けた時点のキューを返す
+            snapshot = self.state.queue_snapshot()
+            if self.state.profile.queue_delay > 0:
+                time.sleep(self.state.profile.queue_delay)
+            self._send_json(snapshot)
+            return
+        if url.path == "/history":
+            with self.state.lock:
+                self._send_json(dict(self.state.history))
+            return
+        if url.path == "/view":
+            self._handle_view(parse_qs(url.query), send_body=True)
+            return
+        if url.path.startswith("/history/"):
+            prompt_id = url.path[len("/history/"):]
+            with self.state.lock:
+                entry = self.state.history.get(prompt_id)
+            self._send_json({prompt_id: entry} if entry is not None else {})
+            return
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self) -> None:  # noqa: N802
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if url.path == "/prompt":
+            try:
+                body = json.loads(raw.decode("utf-8") or "{}")
+            except ValueError:
+                self._send_json({"error": "invalid json"}, status=400)
+                return
+            prompt = body.get("prompt") if isinstance(body, dict) else None
+            if not isinstance(prompt, dict):
+                self._send_json({"error": {"type": "invalid_prompt", "message": "prompt must be a dict"}}, status=400)
+                return
+            if self.state.profile.chance(self.state.profile.reject_rate):
+                with self.state.lock:
+                    self.state.stats["rejected"] += 1
+                self._send_json({"error": {"type": "simulated", "message": "injected rejection"}}, status=500)
+                return
+            node_errors = self.state.missing_images(prompt)
+            if node_errors:
+                error = {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation"}
+                self._send_json({"error": error, "node_errors": node_errors}, status=400)
+                return
+            self._send_json(self.state.enqueue(prompt, body.get("client_id"), front=bool(body.get("front"))))
+            return
+        if url.path in ("/queue", "/interrupt"):
+            try:
+                body = json.loads(raw.decode("utf-8") or "{}")
+            except ValueError:
+                body = {}
+            body = body if isinstance(body, dict) else {}
+            if url.path == "/queue":
+                self.state.delete_pending([str(p) for p in body.get("delete") or []])
+            else:
+                self.state.interrupt(str(body["prompt_id"]) if body.get("prompt_id") else None)
+            self._send_json({})
+            return
+        if url.path == "/upload/image":
+            self._handle_upload(raw)
+            return
+        self._send_json({"error": "not found"}, status=404)
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        url = urlparse(self.path)
+        if url.path == "/view":
+            self._handle_view(parse_qs(url.query), send_body=False)
+            return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _handle_upload(self, raw: bytes) -> None:
+        """multipart/form-data の image（と subfolder, overwrite）を受け取る。"""
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1")
+        msg = BytesParser(policy=email_policy).parsebytes(header + raw)
+        fields: Dict[str, str] = {}
+        image: Optional[Tuple[str, bytes]] = None
+        for part in msg.iter_parts():
+            field = part.get_param("name", header="content-disposition")
+            data = part.get_payload(decode=True) or b""
+            if field == "image":
+                image = (part.get_filename() or "image.png", data)
+            elif field:
+                fields[str(field)] = data.decode("utf-8", "replace")
+        if image is None:
+            self._send_json({"error": "image is required"}, status=400)
+            return
+        subfolder = fields.get("subfolder", "").strip("/")
+        name = image[0]
+        if fields.get("overwrite", "false").lower() != "true":
+            # 同名で内容が違えば ComfyUI と同様に "name (1).ext" へ逃がす
+            stem, dot, ext = name.rpartition(".")
+            i = 1
+            while self.state.inputs.get((subfolder, name), image[1]) != image[1]:
+                name = f"{stem} ({i}).{ext}" if dot else f"{image[0]} ({i})"
+                i += 1
+        self.state.store_input(subfolder, name, image[1])
+        self._send_json({"name": name, "subfolder": subfolder, "type": "input"})
+
+    def _handle_view(self, params: Dict[str, List[str]], send_body: bool) -> None:
+        name = params.get("filename", [""])[0]
+        subfolder = params.get("subfolder", [""])[0].strip("/")
+        with self.state.lock:
+            folder = self.state.inputs if params.get("type", ["output"])[0] == "input" else self.state.outputs
+            data = folder.get((subfolder, name))
+        if data is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def _handle_ws(self, client_id: Optional[str]) -> None:
+        key = self.headers.get("Sec-WebSocket-Key")
+        if not key:
+            self._send_json({"error": "websocket upgrade required"}, status=400)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        sid = client_id or uuid.uuid4().hex
+        q: "queue.Queue[str]" = queue.Queue()
+        self.state.clients[sid] = q
+        sock = self.connection
+        try:
+            sock.sendall(encode_ws_text_frame(json.dumps({"type": "status", "data": self.state.status_data(sid)})))
+            while True:
+                try:
+                    text = q.get(timeout=0.5)
+                except queue.Empty:
+                    # クライアントからの close / 切断を確認
+                    readable, _, _ = select.select([sock], [], [], 0)
+                    if readable:
+                        opcode = read_ws_frame(sock)
+                        if opcode is None or opcode == 0x8:
+                            return
+                    continue
+                sock.sendall(encode_ws_text_frame(text))
+        except OSError:
+            return
+        finally:
+            if self.state.clients.get(sid) is q:
+                del self.state.clients[sid]
+
+
+def make_server(
+    host: str,
+    port: int,
+    exec_time: float,
+    verbose: bool = False,
+    output_bytes: int = 65536,
+    profile: Optional[SimProfile] = None,
+) -> ThreadingHTTPServer:
+    """サーバを生成してワーカーを起動する（serve_forever は呼び出し側で）。port 0 なら空いているポート。"""
+    server = ThreadingHTTPServer((host, port), FakeComfyHandler)
+    server.daemon_threads = True
+    server.state = FakeComfyState(exec_time, output_bytes, profile)  # type: ignore[attr-defined]
+    server.verbose = verbose  # type: ignore[attr-defined]
+    server.state.worker.start()  # type: ignore[attr-defined]
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server for offline testing")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--exec-time", type=float, default=3.0, help="画像1枚あたりの疑似実行秒数")
+    parser.add_argument("--exec-dist", choices=EXEC_DISTRIBUTIONS, default="fixed", help="実行時間の分布")
+    parser.add_argument("--exec-spread", type=float, default=0.2, help="実行時間のばらつき（標準偏差 / 平均）")
+    parser.add_argument("--model-switch-time", type=float, default=0.0, help="モデルローダーの組み合わせが変わったときに足す秒数")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="実行エラーにする割合")
+    parser.add_argument("--lost-rate", type=float, default=0.0, help="履歴を残さずに消す割合")
+    parser.add_argument("--reject-rate", type=float, default=0.0, help="/prompt を 500 で拒否する割合")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="/queue・/history・/view を 503 にする割合")
+    parser.add_argument("--queue-delay", type=float, default=0.0, help="/queue の応答を遅らせる秒数")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output-bytes", type=int, default=65536, help="出力ファイル1つの大きさ")
+    parser.add_argument("--verbose", action="store_true", help="アクセスログを表示")
+    args = parser.parse_args()
+
+    profile = SimProfile(
+        exec_time=args.exec_time,
+        exec_dist=args.exec_dist,
+        exec_spread=args.exec_spread,
+        model_switch_time=args.model_switch_time,
+        fail_rate=args.fail_rate,
+        lost_rate=args.lost_rate,
+        reject_rate=args.reject_rate,
+        http_error_rate=args.http_error_rate,
+        queue_delay=args.queue_delay,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, args.exec_time, args.verbose, args.output_bytes, profile)
+    print(
+        f"[fake-comfy] listening on http://{args.host}:{args.port} exec_time={args.exec_time}s "
+        f"dist={args.exec_dist} model_switch={args.model_switch_time}s"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.state.stop()  # type: ignore[attr-defined]
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""設定・ワークフロー・グループ定義の再読み込み（再起動せずに反映する）。
+
+config.json・ワークフロー（API形式）・UI形式のワークフロー・out/model_loader_groups.json の
+更新時刻とサイズを interval 秒ごとに確かめ、変わったものが落ち着いたら（2回続けて同じなら）
+別スレッドで読み直して検証・変換まで済ませる。できあがった一式はメインスレッドが投入の合間に
+take() で受け取ってまるごと差し替えるので、1件のプロンプトの中で新旧が混ざることはない。
+
+読み直しに失敗した場合（JSON の書きかけ、読み込みノードが無い等）は以前の一式のまま続け、
+ファイルがもう一度変わるまで読み直さない。
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+_END = object()
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """(更新時刻 ns, サイズ)。無ければ None。"""
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class WorkflowState:
+    """設定・ワークフロー・グループ定義から作った、投入に使う一式（差し替えの単位）。
+
+    generation は読み直すたびに1つ増える。sources は作ったときに見ていたファイルの file_signature。
+    """
+
+    def __init__(
+        self,
+        generation: int,
+        config: Dict[str, Any],
+        wf: Dict[str, Any],
+        load_node_id: str,
+        output_roots: List[str],
+        graph: Any,
+        groups: List[Dict[str, Any]],
+        matcher: Any,
+    ) -> None:
+        self.generation = generation
+        self.config = config
+        self.wf = wf
+        self.load_node_id = load_node_id
+        self.output_roots = output_roots
+        self.graph = graph
+        self.groups = groups
+        self.matcher = matcher
+        # 変換済みワークフローのキャッシュ（一式ごとに持つ。作る側で設定する）
+        self.cache: Any = None
+        self.sources: Dict[Path, Optional[Tuple[int, int]]] = {}
+
+
+class HotReloader:
+    """load(generation) で新しい一式を作り、paths(一式) のファイルの変化を監視する。
+
+    load は監視スレッドで呼ばれ、失敗したら例外を投げる。notify は新しい一式ができたときに
+    呼ぶ（scheduler.wake.set で、待機中のメインスレッドを起こす）。
+    """
+
+    def __init__(
+        self,
+        current: WorkflowState,
+        load: Callable[[int], WorkflowState],
+        paths: Callable[[WorkflowState], List[Path]],
+        interval: float = 2.0,
+        notify: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.load = load
+        self.paths = paths
+        self.interval = max(0.1, float(interval))
+        self.notify = notify
+        self._latest = current
+        self._loaded = self._snapshot(current)
+        current.sources = dict(self._loaded)
+        self._pending: Optional[WorkflowState] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hot-reload", daemon=True)
+        self.reloads = 0
+        self.failures = 0
+        self.last_ms = 0.0
+
+    def _snapshot(self, state: WorkflowState) -> Dict[Path, Optional[Tuple[int, int]]]:
+        return {p: file_signature(p) for p in self.paths(state)}
+
+    def start(self) -> "HotReloader":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        settling: Optional[Dict[Path, Optional[Tuple[int, int]]]] = None
+        while not self._stop.wait(self.interval):
+            current = self._snapshot(self._latest)
+            if current == self._loaded:
+                settling = None
+                continue
+            if current != settling:
+                # 書き込みの途中かもしれないので、次の確認でも同じなら読み直す
+                settling = current
+                continue
+            settling = None
+            changed = sorted(str(p) for p, sig in current.items() if self._loaded.get(p) != sig)
+            start = time.perf_counter()
+            try:
+                state = self.load(self._latest.generation + 1)
+            except Exception as e:
+                self.failures += 1
+                # 同じ内容で何度も失敗しないよう、次に変わるまで待つ
+                self._loaded = current
+                print(f"[reload error] {', '.join(changed)}: {e}（以前の設定のまま続けます）")
+                continue
+            self.last_ms = (time.perf_counter() - start) * 1000
+            # 読み直しの中でグループ定義を抽出し直した場合も、その結果を変化として数えない
+            self._loaded = self._snapshot(state)
+            state.sources = dict(self._loaded)
+            self._latest = state
+            with self._lock:
+                self._pending = state
+            print(f"[reload] {', '.join(changed)} を読み直しました（generation={state.generation}, {self.last_ms:.0f} ms）")
+            if self.notify is not None:
+                self.notify()
+
+    def take(self) -> Optional[WorkflowState]:
+        """読み直し済みで未適用の一式（無ければ None）。メインスレッドから呼ぶ。"""
+        with self._lock:
+            state, self._pending = self._pending, None
+        if state is not None:
+            self.reloads += 1
+        return state
+
+    def between(self, jobs: Iterator[Optional[Any]], swap: Callable[[WorkflowState], None]) -> Iterator[Optional[Any]]:
+        """jobs から取り出す前に、読み直した一式があれば swap で差し替える（投入と投入の合間）。"""
+        while True:
+            state = self.take()
+            if state is not None:
+                swap(state)
+            job = next(jobs, _END)
+            if job is _END:
+                return
+            yield job
+
+    def report(self) -> str:
+        return (
+            f"[reload] generation={self._latest.generation} applied={self.reloads} failed={self.failures} "
+            f"last={self.last_ms:.0f}ms"
+        )
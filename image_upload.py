@@ -0,0 +1,148 @@
+"""入力画像を /upload/image で各 ComfyUI へ送る（input_mode = "upload"）。
+
+サーバと同じフォルダを共有しなくても、LoadImage ノードに1枚ずつ渡せるようにする。
+
+- ファイル名は内容の SHA-256 から決める。同じ内容の画像は、同じバックエンドへ2回送らない
+  （同じ実行中は記録で、前回までに送った分は /view への HEAD で確認する）
+- prefetch() は投入より lookahead 件先まで読み進めて、ハッシュ計算とアップロードを先に始める。
+  バックエンドが複数ある場合は振り分け先が投入時まで決まらないので、先にやるのはハッシュ計算だけ
+
+非同期処理はすべて ComfyClient のイベントループ上で動き、状態もそのスレッドだけが触る。
+"""
+import asyncio
+import hashlib
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from comfy_http import ComfyClient
+
+_END = object()
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def as_load_image(graph: Dict[str, Any], node_id: str) -> Dict[str, Any]:
+    """node_id のフォルダ読み込みノードを LoadImage に置き換える（image は投入時に差し込む）。graph を書き換える。"""
+    if node_id in graph:
+        graph[node_id] = {
+            "class_type": "LoadImage",
+            "inputs": {"image": ""},
+            "_meta": dict(graph[node_id].get("_meta") or {"title": "LoadImage"}),
+        }
+    return graph
+
+
+class ImageUploader:
+    """内容ハッシュで重複を省きながら、画像をバックエンドの入力フォルダへ送る。"""
+
+    def __init__(self, http: ComfyClient, subfolder: str = "comfyui-client", probe: bool = True) -> None:
+        self.http = http
+        self.subfolder = subfolder.strip("/")
+        self.probe = probe
+        # イベントループのスレッドだけが触る
+        self._digests: Dict[str, "asyncio.Future[str]"] = {}
+        # (バックエンド, 内容ハッシュ) → (アップロード, その内容を求めたファイル)
+        self._uploads: Dict[Tuple[str, str], Tuple["asyncio.Future[str]", Set[str]]] = {}
+        self.uploaded = 0
+        self.reused = 0
+        self.uploaded_bytes = 0
+
+    # --- イベントループ側 ---
+    async def _digest(self, path: Path) -> str:
+        key = str(path)
+        fut = self._digests.get(key)
+        if fut is None:
+            loop = asyncio.get_running_loop()
+            fut = asyncio.ensure_future(loop.run_in_executor(None, file_sha256, path))
+            self._digests[key] = fut
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            self._digests.pop(key, None)
+            raise
+
+    async def _upload_once(self, base: str, path: Path, digest: str) -> str:
+        name = f"{digest[:32]}{path.suffix.lower()}"
+        if self.probe and await self.http.aio.input_exists(base, name, self.subfolder):
+            self.reused += 1
+            return f"{self.subfolder}/{name}" if self.subfolder else name
+        resp = await self.http.aio.upload_image(base, path, name=name, subfolder=self.subfolder, overwrite=True)
+        self.uploaded += 1
+        self.uploaded_bytes += path.stat().st_size
+        stored = str(resp.get("name") or name)
+        sub = str(resp.get("subfolder") or "")
+        return f"{sub}/{stored}" if sub else stored
+
+    async def _ensure(self, base: str, path: Path, release: bool = False) -> str:
+        digest = await self._digest(path)
+        key = (base, digest)
+        entry = self._uploads.get(key)
+        if entry is None:
+            entry = (asyncio.ensure_future(self._upload_once(base, path, digest)), {str(path)})
+            self._uploads[key] = entry
+        elif str(path) not in entry[1]:
+            # 別のファイルが同じ内容で、すでに送った（送っている）
+            entry[1].add(str(path))
+            self.reused += 1
+        fut = entry[0]
+        try:
+            value = await asyncio.shield(fut)
+        except Exception:
+            # 失敗したアップロードは次の要求でやり直す
+            if self._uploads.get(key) is entry:
+                del self._uploads[key]
+            raise
+        if release:
+            self._digests.pop(str(path), None)
+        return value
+
+    async def _prefetch(self, path: Path, backends: List[str]) -> None:
+        try:
+            await self._digest(path)
+            for base in backends:
+                await self._ensure(base, path)
+        except Exception as e:
+            # 投入時に ensure() がやり直し、そこで失敗が報告される
+            print(f"[upload prefetch error] {path}: {e}")
+
+    # --- 呼び出し側スレッド ---
+    def ensure(self, path: Path, base: str) -> str:
+        """base に path の画像があることを保証し、LoadImage の image 入力に渡す名前を返す。"""
+        return self.http.call(self._ensure(base, Path(path), release=True))
+
+    def prefetch(
+        self, jobs: Iterator[Optional[Any]], backends: List[str], lookahead: int = 8
+    ) -> Iterator[Optional[Any]]:
+        """Job 列を lookahead 件先まで読み、ハッシュ計算（単一バックエンドならアップロードも）を先に始める。"""
+        targets = list(backends) if len(backends) == 1 else []
+        buffered: Deque[Any] = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(buffered) < max(1, lookahead):
+                job = next(jobs, _END)
+                if job is _END:
+                    exhausted = True
+                    break
+                if job is None:
+                    break
+                self.http.spawn(self._prefetch(Path(job.path), targets))
+                buffered.append(job)
+            if buffered:
+                yield buffered.popleft()
+                continue
+            if exhausted:
+                return
+            yield None
+
+    def report(self) -> str:
+        return (
+            f"[upload] uploaded={self.uploaded} ({self.uploaded_bytes / 1048576:.1f} MiB) "
+            f"reused={self.reused}"
+        )
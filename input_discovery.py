@@ -0,0 +1,175 @@
+"""入力画像の逐次列挙と、新規ファイルの監視（watch モード）。
+
+走査はバックグラウンドスレッドで行い、見つけた順に有限長のキューへ流す。
+呼び出し側は走査の完了を待たずに投入を始められ、保持するパスはキューの長さ分だけ。
+watch モードでは watchdog で新規ファイルを検知し、サイズが落ち着いた（書き込みが
+終わった）ものだけを同じキューへ流す。
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # watch モードを使わなければ不要
+    FileSystemEventHandler = object  # type: ignore[assignment,misc]
+    Observer = None  # type: ignore[assignment,misc]
+
+_SCAN_DONE = object()
+
+
+class _NewFileHandler(FileSystemEventHandler):  # type: ignore[misc]
+    def __init__(self, discovery: "InputDiscovery") -> None:
+        super().__init__()
+        self.discovery = discovery
+
+    def on_created(self, event) -> None:  # type: ignore[no-untyped-def]
+        if not event.is_directory:
+            self.discovery._on_fs_event(Path(event.src_path), created=True)
+
+    def on_moved(self, event) -> None:  # type: ignore[no-untyped-def]
+        if not event.is_directory:
+            self.discovery._on_fs_event(Path(event.dest_path), created=True)
+
+    def on_modified(self, event) -> None:  # type: ignore[no-untyped-def]
+        if not event.is_directory:
+            self.discovery._on_fs_event(Path(event.src_path), created=False)
+
+
+class InputDiscovery:
+    """root 以下の pattern に一致するファイルを逐次返すイテレータ。
+
+    ファイルが来ていない間は None を返す（呼び出し側はブロックせずに他の処理へ戻れる）。
+    watch=False なら走査が終わった時点で反復も終わる。
+    """
+
+    def __init__(
+        self,
+        root: str,
+        pattern: str = "*.png",
+        watch: bool = False,
+        debounce: float = 2.0,
+        buffer_size: int = 1024,
+        notify: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.root = Path(root)
+        self.pattern = pattern
+        self.watch = watch
+        self.debounce = debounce
+        self.notify = notify
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize=max(1, buffer_size))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._scanning = True
+        # 走査中に watcher が見たパス（走査側では返さず、走査後に debounce 経由で返す）
+        self._seen_during_scan: Set[Path] = set()
+        # 書き込み完了待ち: path -> (最終イベント時刻, 直近のサイズ)
+        self._settling: Dict[Path, Tuple[float, int]] = {}
+        self._observer = None
+        self.scanned = 0
+
+    def start(self) -> "InputDiscovery":
+        if self.watch:
+            if Observer is None:
+                print("[watch] watchdog が見つからないため watch モードを無効化します")
+                self.watch = False
+            else:
+                # 走査中に追加されたファイルも取りこぼさないよう、先に監視を始める
+                self._observer = Observer()
+                self._observer.schedule(_NewFileHandler(self), str(self.root), recursive=True)
+                self._observer.start()
+                threading.Thread(target=self._settle_loop, name="input-settle", daemon=True).start()
+        threading.Thread(target=self._scan, name="input-scan", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _put(self, item: object) -> None:
+        was_empty = self._queue.empty()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        if was_empty and self.notify is not None:
+            self.notify()
+
+    def _scan(self) -> None:
+        try:
+            for path in self.root.rglob(self.pattern):
+                if self._stop.is_set():
+                    return
+                with self._lock:
+                    if path in self._seen_during_scan:
+                        continue
+                self.scanned += 1
+                self._put(path)
+        except OSError as e:
+            print(f"[scan error] {self.root}: {e}")
+        finally:
+            with self._lock:
+                self._scanning = False
+                now = time.time()
+                for path in self._seen_during_scan:
+                    self._settling.setdefault(path, (now, -1))
+                self._seen_during_scan.clear()
+            self._put(_SCAN_DONE)
+
+    def _on_fs_event(self, path: Path, created: bool) -> None:
+        if not path.match(self.pattern):
+            return
+        with self._lock:
+            if self._scanning:
+                if created:
+                    self._seen_during_scan.add(path)
+                return
+            if created or path in self._settling:
+                prev = self._settling.get(path)
+                self._settling[path] = (time.time(), prev[1] if prev else -1)
+
+    def _settle_loop(self) -> None:
+        """debounce 秒イベントが無く、サイズが変わらなくなったファイルを投入対象にする。"""
+        while not self._stop.wait(min(0.5, self.debounce)):
+            now = time.time()
+            ready = []
+            with self._lock:
+                for path, (last_event, last_size) in list(self._settling.items()):
+                    if now - last_event < self.debounce:
+                        continue
+                    try:
+                        size = path.stat().st_size
+                    except OSError:
+                        # 消えた・移動したファイルは諦める
+                        del self._settling[path]
+                        continue
+                    if size > 0 and size == last_size:
+                        del self._settling[path]
+                        ready.append(path)
+                    else:
+                        self._settling[path] = (now, size)
+            for path in ready:
+                print(f"[watch] new input {path}")
+                self._put(path)
+
+    def __iter__(self) -> Iterator[Optional[Path]]:
+        scan_done = False
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                if scan_done and not self.watch:
+                    return
+                yield None
+                continue
+            if item is _SCAN_DONE:
+                scan_done = True
+                print(f"[scan] {self.scanned} file(s) found under {self.root}")
+                continue
+            yield item  # type: ignore[misc]
@@ -0,0 +1,113 @@
+"""ジョブごとの入力ステージング（input_mode = "staged"）。
+
+folder モードでは毎回 input_dir 全体を LoadImagesFromFolderKJ に渡すため、ComfyUI は
+プロンプトのたびにフォルダツリー全体を列挙・ソートし直す（入力が増えるほど1件あたりの
+読み込みが重くなる）。staged モードではそのジョブの画像（まとめた場合は数枚）だけを置いた
+専用のディレクトリを作り、そこを folder に指定する。サーバ側の列挙は入力全体の量によらない。
+
+- 置き方は hardlink → symlink → コピー の順に試す（同じボリュームなら hardlink で容量を使わない）
+- ディレクトリ名は元のパス（の並び）のハッシュなので、再投入・再起動後も同じ場所を指す
+- ファイル名には並び順の番号を付ける（ComfyUI は名前順に読むので、まとめた順に処理される）
+- 完了を確認したジョブのディレクトリは release() で消す。前回の実行の残りは sweep() で消す
+"""
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+LINK_MODES = ("auto", "hardlink", "symlink", "copy")
+
+
+def stage_key(paths: Sequence[Path]) -> str:
+    joined = "\n".join(str(Path(p).resolve()) for p in paths)
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()[:16]
+
+
+class InputStager:
+    """画像をジョブ専用ディレクトリへ置き、そのディレクトリを返す。メインスレッドから使う。"""
+
+    def __init__(self, root: str, link: str = "auto") -> None:
+        if link not in LINK_MODES:
+            raise ValueError(f"unknown staging link mode: {link!r} (expected one of {', '.join(LINK_MODES)})")
+        self.root = Path(root).resolve()
+        self.link = link
+        # ステージ済み: ディレクトリ名 → ディレクトリ
+        self._staged: Dict[str, Path] = {}
+        self.staged = 0
+        self.released = 0
+        self.copied = 0
+
+    def _place(self, src: Path, dst: Path) -> None:
+        modes: List[str] = ["hardlink", "symlink", "copy"] if self.link == "auto" else [self.link]
+        last_error: Optional[OSError] = None
+        for mode in modes:
+            try:
+                if mode == "hardlink":
+                    os.link(src, dst)
+                elif mode == "symlink":
+                    os.symlink(src, dst)
+                else:
+                    shutil.copy2(src, dst)
+                    self.copied += 1
+                return
+            except OSError as e:
+                # 別ボリューム・権限不足（Windows の symlink など）なら次の方法へ
+                last_error = e
+        assert last_error is not None
+        raise last_error
+
+    def stage(self, paths: Sequence[Path]) -> str:
+        """paths の画像だけを置いたディレクトリを用意し、その絶対パスを返す。"""
+        key = stage_key(paths)
+        job_dir = self.root / key
+        job_dir.mkdir(parents=True, exist_ok=True)
+        for i, path in enumerate(paths):
+            src = Path(path).resolve()
+            dst = job_dir / f"{i:04d}_{src.name}"
+            if not dst.exists():
+                self._place(src, dst)
+        if key not in self._staged:
+            self._staged[key] = job_dir
+            self.staged += 1
+        return str(job_dir)
+
+    def _remove(self, job_dir: Path) -> None:
+        try:
+            for entry in job_dir.iterdir():
+                entry.unlink()
+            job_dir.rmdir()
+        except OSError as e:
+            print(f"[stage] {job_dir} を削除できません: {e}")
+
+    def release(self, paths: Sequence[Path]) -> None:
+        """完了したジョブのディレクトリを消す（元の画像は消さない）。"""
+        job_dir = self._staged.pop(stage_key(paths), None)
+        if job_dir is None:
+            return
+        self._remove(job_dir)
+        self.released += 1
+
+    def sweep(self, keep: Iterable[Sequence[Path]] = ()) -> int:
+        """keep（ジョブごとのパスの並び）以外のステージングディレクトリ（前回の実行の残り）を消す。
+        消した数を返す。"""
+        if not self.root.is_dir():
+            return 0
+        keep_keys = {stage_key(paths) for paths in keep}
+        removed = 0
+        for job_dir in self.root.iterdir():
+            if job_dir.is_dir() and job_dir.name not in keep_keys:
+                self._remove(job_dir)
+                removed += 1
+        for key in keep_keys:
+            if (self.root / key).is_dir():
+                self._staged[key] = self.root / key
+        if removed:
+            print(f"[stage] 前回の実行の残り {removed} 件を削除しました")
+        return removed
+
+    def report(self) -> str:
+        return (
+            f"[stage] staged={self.staged} released={self.released} "
+            f"active={len(self._staged)} copied={self.copied}"
+        )
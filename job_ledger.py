@@ -0,0 +1,212 @@
+"""投入ジョブの台帳（SQLite）。再起動時に完了済みを飛ばし、失敗・消失分を再投入する。
+
+1入力パスにつき1行を持ち、status は次のいずれか:
+- submitted: 投入済みで完了未確認
+- success:   /history で成功を確認
+- error:     /history で失敗を確認、または投入に失敗し続けた（次回起動時に再投入）
+- lost:      キューからも履歴からも消えた（再投入）
+- cancelled: 入力が消えた・差し替えられたので取り消した（次回起動時、入力があれば再投入）
+
+書き込みは専用スレッドがまとめてコミットするので、投入ループは待たされない。
+"""
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# 再起動時に投入し直さなくてよい状態
+SKIP_STATUSES = {"success", "submitted"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    job_index INTEGER,
+    prompt_id TEXT,
+    backend TEXT,
+    submitted_at REAL,
+    status TEXT NOT NULL,
+    finished_at REAL,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+_UPSERT_SUBMITTED = """
+INSERT INTO jobs (path, job_index, prompt_id, backend, submitted_at, status, finished_at, message, attempts)
+VALUES (?, ?, ?, ?, ?, 'submitted', NULL, NULL, 1)
+ON CONFLICT(path) DO UPDATE SET
+    job_index = excluded.job_index,
+    prompt_id = excluded.prompt_id,
+    backend = excluded.backend,
+    submitted_at = excluded.submitted_at,
+    status = 'submitted',
+    finished_at = NULL,
+    message = NULL,
+    attempts = jobs.attempts + 1
+"""
+
+_UPSERT_FAILED = """
+INSERT INTO jobs (path, job_index, prompt_id, backend, submitted_at, status, finished_at, message, attempts)
+VALUES (?, ?, NULL, NULL, NULL, 'error', ?, ?, 0)
+ON CONFLICT(path) DO UPDATE SET
+    job_index = excluded.job_index,
+    prompt_id = NULL,
+    backend = NULL,
+    status = 'error',
+    finished_at = excluded.finished_at,
+    message = excluded.message
+"""
+
+_UPDATE_FINISHED = """
+UPDATE jobs SET status = ?, finished_at = ?, message = ? WHERE path = ? AND prompt_id IS ?
+"""
+
+
+def history_status(entry: Optional[Dict[str, Any]]) -> Tuple[str, Optional[str]]:
+    """/history/{prompt_id} の1件から (status, message) を決める。entry が無ければ lost。"""
+    if not isinstance(entry, dict):
+        return "lost", None
+    status = entry.get("status") or {}
+    status_str = status.get("status_str") if isinstance(status, dict) else None
+    if status_str == "error":
+        message = None
+        for msg in status.get("messages") or []:
+            if isinstance(msg, list) and len(msg) == 2 and msg[0] == "execution_error" and isinstance(msg[1], dict):
+                message = str(msg[1].get("exception_message") or msg[1].get("exception_type") or "")
+        return "error", message
+    if status_str == "success" or status.get("completed") or entry.get("outputs"):
+        return "success", None
+    return "error", "not completed"
+
+
+class JobLedger:
+    """SQLite の台帳。record_* は非同期（キュー経由）、status() は未コミット分も考慮して返す。"""
+
+    def __init__(self, path: str, flush_interval: float = 0.5) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.flush_interval = flush_interval
+        self._reader = self._connect()
+        self._reader.execute(_SCHEMA)
+        self._reader.commit()
+        self._queue: "queue.Queue[Optional[Tuple[str, tuple]]]" = queue.Queue()
+        # まだコミットされていない最新状態（path -> status）
+        self._overlay: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self._writer = threading.Thread(target=self._write_loop, name="job-ledger", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # --- 書き込み（キュー経由） ---
+    def record_submitted(self, path: Path, index: int, prompt_id: str, backend: str) -> None:
+        key = str(path)
+        with self._lock:
+            self._overlay[key] = "submitted"
+        self._queue.put((_UPSERT_SUBMITTED, (key, index, prompt_id, backend, time.time())))
+
+    def record_finished(self, path: Path, prompt_id: Optional[str], status: str, message: Optional[str] = None) -> None:
+        key = str(path)
+        with self._lock:
+            self._overlay[key] = status
+        self._queue.put((_UPDATE_FINISHED, (status, time.time(), message, key, prompt_id)))
+
+    def record_failed(self, path: Path, index: int, message: str) -> None:
+        """投入できないまま諦めたジョブを error として記録する（prompt_id は持たない）。"""
+        key = str(path)
+        with self._lock:
+            self._overlay[key] = "error"
+        self._queue.put((_UPSERT_FAILED, (key, index, time.time(), message)))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stop = False
+        while not stop:
+            batch: List[Tuple[str, tuple]] = []
+            item = self._queue.get()
+            deadline = time.time() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(conn, batch)
+            # None（停止要求）も含め、取り出した件数分を完了扱いにする
+            for _ in range(len(batch) + (1 if stop else 0)):
+                self._queue.task_done()
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Tuple[str, tuple]]) -> None:
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[ledger error] {e}")
+            return
+        with self._lock:
+            for sql, params in batch:
+                # コミット済みの内容と一致していればオーバーレイから外す
+                if sql is _UPDATE_FINISHED:
+                    key, expected = params[3], params[0]
+                else:
+                    key, expected = params[0], ("submitted" if sql is _UPSERT_SUBMITTED else "error")
+                if self._overlay.get(key) == expected:
+                    del self._overlay[key]
+
+    def flush(self) -> None:
+        """ここまでに記録した内容のコミットを待つ。"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """未書き込み分をコミットしてから閉じる。"""
+        self._queue.put(None)
+        self._writer.join(timeout=30)
+        self._reader.close()
+
+    # --- 読み出し ---
+    def status(self, path: Path) -> Optional[str]:
+        key = str(path)
+        with self._lock:
+            pending = self._overlay.get(key)
+        if pending is not None:
+            return pending
+        row = self._reader.execute("SELECT status FROM jobs WHERE path = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def should_skip(self, path: Path) -> bool:
+        return self.status(path) in SKIP_STATUSES
+
+    def filter_jobs(self, jobs: Iterator[Any]) -> Iterator[Any]:
+        """完了済み・投入済みの入力を飛ばす（None はそのまま流す）。"""
+        for job in jobs:
+            if job is not None and self.should_skip(job.path):
+                self.skipped += 1
+                continue
+            yield job
+
+    def inflight_rows(self) -> List[Tuple[str, int, str, str]]:
+        """前回 submitted のまま終わった行 (path, index, prompt_id, backend)。"""
+        return list(
+            self._reader.execute(
+                "SELECT path, job_index, prompt_id, backend FROM jobs WHERE status = 'submitted'"
+            )
+        )
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            status: n
+            for status, n in self._reader.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        }
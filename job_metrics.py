@@ -0,0 +1,230 @@
+"""ジョブごとの所要時間の記録と、集計値を返す小さな HTTP エンドポイント。
+
+1ジョブの時刻（time.time()）:
+- build:    振り分け先が決まり、ワークフローの組み立てを始めた
+- submit:   組み立てが終わり /prompt へ送り始めた
+- queued:   /prompt が prompt_id を返した（ComfyUI のキューに入った）
+- started:  実行開始（websocket の execution_start、無ければ /queue で実行中を見た時刻）
+- finished: 実行終了（websocket の execution_success 等、無ければキューから消えたのを見た時刻）
+
+直近 window 秒に終わったジョブから p50/p95・images/hour・GPU のアイドル率を求め、
+/metrics（Prometheus テキスト形式）と /metrics.json で返す。
+"""
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+# 区間名 → (開始時刻のキー, 終了時刻のキー)
+STAGES: Dict[str, Tuple[str, str]] = {
+    "build": ("build", "submit"),
+    "submit": ("submit", "queued"),
+    "queue_wait": ("queued", "started"),
+    "exec": ("started", "finished"),
+    "total": ("build", "finished"),
+}
+QUANTILES = (0.5, 0.95)
+# 画像が得られた状態（"done" は /history を確認しない構成での完了）と、失敗として数える状態
+IMAGE_STATUSES = {"success", "done"}
+ERROR_STATUSES = {"error", "lost"}
+
+
+def history_exec_window(entry: Optional[Dict[str, Any]]) -> Optional[Tuple[float, float]]:
+    """/history の status.messages から (実行開始, 実行終了) の時刻（秒）を取り出す。"""
+    if not isinstance(entry, dict):
+        return None
+    status = entry.get("status") or {}
+    start: Optional[float] = None
+    end: Optional[float] = None
+    for msg in (status.get("messages") or []) if isinstance(status, dict) else []:
+        if not (isinstance(msg, list) and len(msg) == 2 and isinstance(msg[1], dict)):
+            continue
+        ts = msg[1].get("timestamp")
+        if not isinstance(ts, (int, float)):
+            continue
+        if msg[0] == "execution_start":
+            start = ts / 1000.0
+        elif msg[0] in ("execution_success", "execution_error", "execution_interrupted"):
+            end = ts / 1000.0
+    if start is None or end is None or end < start:
+        return None
+    return start, end
+
+
+def _quantile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _busy_seconds(intervals: Iterable[Tuple[float, float]], lo: float, hi: float) -> float:
+    """[lo, hi] に切り詰めた区間の和集合の長さ。"""
+    clipped = sorted((max(s, lo), min(e, hi)) for s, e in intervals if e > lo and s < hi)
+    total = 0.0
+    cur_s: Optional[float] = None
+    cur_e = 0.0
+    for s, e in clipped:
+        if cur_s is None or s > cur_e:
+            if cur_s is not None:
+                total += cur_e - cur_s
+            cur_s, cur_e = s, e
+        else:
+            cur_e = max(cur_e, e)
+    if cur_s is not None:
+        total += cur_e - cur_s
+    return total
+
+
+class JobMetrics:
+    """完了したジョブの時刻を保持し、直近 window 秒の集計を返す。複数スレッドから呼んでよい。"""
+
+    def __init__(self, window: float = 3600.0, max_samples: int = 20000) -> None:
+        self.window = window
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        # (finished, status, backend, timings)
+        self._samples: Deque[Tuple[float, str, str, Dict[str, float]]] = deque(maxlen=max_samples)
+        self._status_totals: Dict[str, int] = {}
+        self._errors: Dict[str, int] = {}
+        self._backends: List[str] = []
+
+    def set_backends(self, urls: Iterable[str]) -> None:
+        """アイドル率を出すバックエンド（ジョブが1件も無くても 100% アイドルとして出す）。"""
+        with self._lock:
+            self._backends = list(urls)
+
+    def record(self, status: str, backend: str, timings: Dict[str, float]) -> None:
+        """終わったジョブを1件記録する。"""
+        finished = timings.get("finished", time.time())
+        with self._lock:
+            self._samples.append((finished, status, backend, dict(timings)))
+            self._status_totals[status] = self._status_totals.get(status, 0) + 1
+            if status in ERROR_STATUSES:
+                self._errors[status] = self._errors.get(status, 0) + 1
+
+    def count_error(self, kind: str) -> None:
+        """ジョブの結果以外の失敗（submit / queue_check / history）を数える。"""
+        with self._lock:
+            self._errors[kind] = self._errors.get(kind, 0) + 1
+
+    def summary(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        lo = max(now - self.window, self.started_at)
+        span = max(now - lo, 1e-9)
+        with self._lock:
+            samples = [s for s in self._samples if s[0] >= lo]
+            status_totals = dict(self._status_totals)
+            errors = dict(self._errors)
+            backends = list(self._backends)
+
+        latencies: Dict[str, Dict[str, float]] = {}
+        for stage, (a, b) in STAGES.items():
+            # 実行がすぐ始まると /prompt の応答より execution_start が先に届くので 0 に丸める
+            values = sorted(max(0.0, t[b] - t[a]) for _, _, _, t in samples if a in t and b in t)
+            entry = {f"p{int(q * 100)}": _quantile(values, q) for q in QUANTILES}
+            entry["count"] = float(len(values))
+            entry["sum"] = sum(values)
+            latencies[stage] = entry
+
+        intervals: Dict[str, List[Tuple[float, float]]] = {url: [] for url in backends}
+        for _, _, backend, t in samples:
+            if "started" in t and "finished" in t:
+                intervals.setdefault(backend, []).append((t["started"], t["finished"]))
+        idle = {url: 1.0 - min(1.0, _busy_seconds(iv, lo, now) / span) for url, iv in intervals.items()}
+
+        success = sum(1 for _, status, _, _ in samples if status in IMAGE_STATUSES)
+        return {
+            "window_seconds": span,
+            "completed": len(samples),
+            "images_per_hour": success * 3600.0 / span,
+            "latency_seconds": latencies,
+            "gpu_idle_fraction": idle,
+            "jobs_total": status_totals,
+            "errors_total": errors,
+        }
+
+    def prometheus(self, now: Optional[float] = None) -> str:
+        s = self.summary(now)
+        lines = [
+            "# HELP comfy_job_latency_seconds Per-stage job latency over the rolling window.",
+            "# TYPE comfy_job_latency_seconds summary",
+        ]
+        for stage, entry in s["latency_seconds"].items():
+            for q in QUANTILES:
+                value = entry[f"p{int(q * 100)}"]
+                lines.append(f'comfy_job_latency_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'comfy_job_latency_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+            lines.append(f'comfy_job_latency_seconds_count{{stage="{stage}"}} {int(entry["count"])}')
+        lines += [
+            "# HELP comfy_images_per_hour Successful images per hour over the rolling window.",
+            "# TYPE comfy_images_per_hour gauge",
+            f"comfy_images_per_hour {s['images_per_hour']:.3f}",
+            "# HELP comfy_gpu_idle_fraction Fraction of the rolling window with no prompt executing.",
+            "# TYPE comfy_gpu_idle_fraction gauge",
+        ]
+        for url, idle in s["gpu_idle_fraction"].items():
+            lines.append(f'comfy_gpu_idle_fraction{{backend="{url}"}} {idle:.4f}')
+        lines += ["# HELP comfy_jobs_total Finished jobs by status.", "# TYPE comfy_jobs_total counter"]
+        for status, n in sorted(s["jobs_total"].items()):
+            lines.append(f'comfy_jobs_total{{status="{status}"}} {n}')
+        lines += ["# HELP comfy_errors_total Failed jobs and request errors by kind.", "# TYPE comfy_errors_total counter"]
+        for kind, n in sorted(s["errors_total"].items()):
+            lines.append(f'comfy_errors_total{{kind="{kind}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> str:
+        """Scheduler.report() 用の1行。"""
+        s = self.summary()
+        lat = s["latency_seconds"]
+        idle = s["gpu_idle_fraction"]
+        idle_txt = f"{sum(idle.values()) / len(idle) * 100:.0f}%" if idle else "-"
+        errors = sum(s["errors_total"].values())
+        return (
+            f"[metrics] done={s['completed']} images/h={s['images_per_hour']:.0f} "
+            f"queue_wait p50/p95={lat['queue_wait']['p50']:.1f}/{lat['queue_wait']['p95']:.1f}s "
+            f"exec p50/p95={lat['exec']['p50']:.1f}/{lat['exec']['p95']:.1f}s "
+            f"gpu_idle={idle_txt} errors={errors}"
+        )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics: JobMetrics
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def do_GET(self) -> None:  # noqa: N802
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            body = self.metrics.prometheus().encode("utf-8")
+            ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif path in ("/metrics.json", "/summary"):
+            body = json.dumps(self.metrics.summary(), ensure_ascii=False).encode("utf-8")
+            ctype = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(metrics: JobMetrics, host: str = "127.0.0.1", port: int = 9188) -> Optional[ThreadingHTTPServer]:
+    """バックグラウンドで /metrics と /metrics.json を返す。ポートが使えなければ None。"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"[metrics] {host}:{port} を開けないため無効化します: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[metrics] http://{host}:{port}/metrics (Prometheus), /metrics.json")
+    return server
@@ -1,11 +1,28 @@
-# pip install watchdog requests
+# pip install -r requirements.txt
 from pathlib import Path
 import json
-import uuid
 import time
-import requests
+import uuid
 import remove_switches
-from typing import Dict, Any, List, Set
+from batch_planner import AdaptiveBatcher, AffinityPlanner
+from build_pipeline import BuildPipeline, CompilePool
+from comfy_http import ComfyClient, RetryPolicy
+from extract_model_loader_groups import refresh_groups
+from hot_reload import HotReloader, WorkflowState
+from image_upload import ImageUploader, as_load_image
+from input_discovery import InputDiscovery
+from input_staging import InputStager
+from job_ledger import JobLedger
+from job_metrics import JobMetrics, start_metrics_server
+from priority_lanes import LaneScheduler
+from queue_depth import QueueDepthController
+from result_collector import ResultCollector
+from scheduler import Scheduler, iter_jobs
+from stale_jobs import StaleJobCanceller
+from trigger_matcher import TriggerMatcher
+from workflow_cache import CompiledWorkflowCache, PromptTemplate, patch_node_inputs
+from workflow_graph import WorkflowGraph, compile_api
+from typing import Dict, Any, List, Optional, Set
 
 COMFY = "http://127.0.0.1:8188"
 CLIENT_ID = str(uuid.uuid4())
@@ -13,95 +30,186 @@ CLIENT_ID = str(uuid.uuid4())
 CONFIG = json.loads(Path("config.json").read_text(encoding="utf-8"))
 WORKFLOW_JSON = CONFIG["workflow"]
 INPUT_DIR = CONFIG["input_dir"]
+# "ws": websocket のイベントで即時投入（切断中はポーリング） / "poll": 従来の定期ポーリングのみ
+DISPATCH_MODE = str(CONFIG.get("dispatch_mode", "ws"))
+POLL_INTERVAL = float(CONFIG.get("poll_interval", 10))
+# 複数の ComfyUI に振り分ける場合は "backends": ["http://host:8188", ...] を指定
+BACKENDS: List[str] = [str(u).rstrip("/") for u in (CONFIG.get("backends") or [COMFY])]
+# true なら走査後も input_dir を監視し、追加された PNG を投入する
+WATCH = bool(CONFIG.get("watch", False))
+WATCH_DEBOUNCE = float(CONFIG.get("watch_debounce", 2.0))
+# 同じモデル構成の画像を続けて投入するための先読み件数（0 で無効）と、連続投入の上限
+AFFINITY_WINDOW = int(CONFIG.get("affinity_window", 256))
+AFFINITY_MAX_RUN = int(CONFIG.get("affinity_max_run", 32))
+# 投入・完了の台帳。再起動時は完了済みを飛ばし、失敗・消失分だけを再投入する（"" で無効）
+LEDGER_PATH = str(CONFIG.get("ledger_path", "out/job_ledger.sqlite3"))
+# ジョブごとの所要時間の集計を返す HTTP エンドポイント（0 で無効）と、集計する直近の秒数
+METRICS_HOST = str(CONFIG.get("metrics_host", "127.0.0.1"))
+METRICS_PORT = int(CONFIG.get("metrics_port", 9188))
+METRICS_WINDOW = float(CONFIG.get("metrics_window", 3600))
+# ComfyUI のキューに積んでおく待ち数の上限（1 で従来どおり待ちが空になってから投入）と、
+# 積んだ仕事の見込み秒数の上限。この範囲で送信時間・実行時間・GPU の空きから待ち数を調整する
+QUEUE_MAX_PENDING = int(CONFIG.get("queue_max_pending", 4))
+QUEUE_MAX_SECONDS = float(CONFIG.get("queue_max_seconds", 120))
+# 入力画像の渡し方: "folder"（input_dir を共有し start_index で指定） / "upload"（/upload/image で送り LoadImage で読む）
+# / "staged"（画像1枚だけのジョブ専用ディレクトリを作り、そこを folder に指定する）
+INPUT_MODE = str(CONFIG.get("input_mode", "folder"))
+# folder モードの start_index は起動時に数えた input_dir の並び順なので、後から画像が増えるとずれる
+if WATCH and INPUT_MODE == "folder":
+    raise ValueError('watch は input_mode が "upload" か "staged" のときだけ使えます（folder では追加した画像で start_index がずれます）')
+# staged モードのディレクトリ（ComfyUI から見える場所。input_dir の外に置く）と置き方
+STAGING_DIR = str(CONFIG.get("staging_dir") or Path(INPUT_DIR).with_name(Path(INPUT_DIR).name + "_staging"))
+STAGING_LINK = str(CONFIG.get("staging_link", "auto"))
+# 同じモデル構成の画像を1プロンプトに最大 batch_max 枚まとめる（staged モードのみ。1 で無効）。
+# まとめる枚数は、1プロンプトの実行時間が batch_target_seconds 程度になるよう実行時間から決める
+BATCH_MAX = int(CONFIG.get("batch_max", 1))
+BATCH_TARGET_SECONDS = float(CONFIG.get("batch_target_seconds", 30))
+# 完了したプロンプトの出力を /view からダウンロードして置くディレクトリ（"" で回収しない）。
+# 入力画像と同じ相対パスで置く。同時ダウンロード数と、回収する出力の種類（temp はプレビュー）
+OUTPUT_DIR = str(CONFIG.get("output_dir", ""))
+COLLECT_CONCURRENCY = int(CONFIG.get("collect_concurrency", 4))
+COLLECT_TYPES = [str(t) for t in (CONFIG.get("collect_types") or ["output"])]
+COLLECT_VERIFY = bool(CONFIG.get("collect_verify", True))
+UPLOAD_SUBFOLDER = str(CONFIG.get("upload_subfolder", "comfyui-client"))
+UPLOAD_LOOKAHEAD = int(CONFIG.get("upload_lookahead", 8))
+# 投入前の準備（列挙・分類・変換）を別スレッドで何件先まで進めておくか（0 で投入時にその場で行う）
+BUILD_AHEAD = int(CONFIG.get("build_ahead", 8))
+# ノード数が build_process_min_nodes 以上のワークフローは、変換を build_processes 個のプロセスで並行して行う
+BUILD_PROCESSES = int(CONFIG.get("build_processes", 2))
+BUILD_PROCESS_MIN_NODES = int(CONFIG.get("build_process_min_nodes", 5000))
+# true なら config.json・ワークフロー・グループ定義の変更を reload_interval 秒ごとに確かめ、再起動せずに反映する
+RELOAD = bool(CONFIG.get("reload", False))
+RELOAD_INTERVAL = float(CONFIG.get("reload_interval", 2.0))
+# フォルダ名・トリガーのキーワードで振り分ける優先度レーン（[{"name", "match", "weight", "front"}, ...]。空なら振り分けない）
+PRIORITY_LANES: List[Dict[str, Any]] = list(CONFIG.get("priority_lanes") or [])
+LANE_WINDOW = int(CONFIG.get("lane_window", 4096))
+# 完了待ちのジョブの入力が消えた・差し替えられたら cancel_check_interval 秒以内に取り消す（差し替えは投入し直す）
+CANCEL_STALE = bool(CONFIG.get("cancel_stale", True))
+CANCEL_CHECK_INTERVAL = float(CONFIG.get("cancel_check_interval", 5.0))
+CANCEL_REQUEUE = bool(CONFIG.get("cancel_requeue", True))
+# HTTP はすべて共有のコネクションプール経由（エンドポイント別タイムアウト・指数バックオフ再試行）
+HTTP = ComfyClient(
+    max_connections=int(CONFIG.get("http_max_connections", 64)),
+    timeouts=CONFIG.get("http_timeouts") or {},
+    retry=RetryPolicy(attempts=int(CONFIG.get("http_retries", 4))),
+)
 # 置換ポイント：あなたのWFのノード/フィールド位置
-LOAD_NODE_ID = "1100"  # LoadImage ノードID
+DEFAULT_LOAD_NODE_ID = "1100"  # LoadImage ノードID（LoadImagesFromFolderKJ が見つからないとき）
 SAVE_PREFIX_POS = 0  # filename_prefix がある位置（配列index）
-wf = json.loads(Path(WORKFLOW_JSON).read_text(encoding="utf-8"))
-for idx, node in wf.items():
-    if (
-        node["class_type"] == "LoadImagesFromFolderKJ"
-        and node["_meta"]["title"] == "LoadImage"
-    ):
-        LOAD_NODE_ID = idx
-        break
-wf[LOAD_NODE_ID]["inputs"]["folder"] = INPUT_DIR
-# サブフォルダも探索できるよう既定を true に（存在すれば上書き）
-try:
-    wf[LOAD_NODE_ID]["inputs"]["include_subfolders"] = True
-except Exception:
-    pass
-
-# モデルローダーグループ（トリガー → ノードID群）を読み込み
-GROUPS_PATH = Path("out/model_loader_groups.json")
-GROUPS: List[Dict[str, Any]] = []
-if GROUPS_PATH.exists():
-    try:
-        GROUPS = json.loads(GROUPS_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        GROUPS = []
 
+# upload モードでは画像を内容ハッシュ名で送り、LoadImagesFromFolderKJ を LoadImage に置き換える
+UPLOADER: Optional[ImageUploader] = None
+if INPUT_MODE == "upload":
+    UPLOADER = ImageUploader(HTTP, subfolder=UPLOAD_SUBFOLDER, probe=bool(CONFIG.get("upload_probe", True)))
 
-def _path_contains_any_keyword(path: Path, keywords: List[str]) -> bool:
-    p = str(path).lower()
-    for kw in keywords:
-        try:
-            if kw and str(kw).lower() in p:
-                return True
-        except Exception:
-            continue
-    return False
+# staged モードではジョブごとのディレクトリ（画像1枚）を folder に指定するので、サブフォルダの探索は不要
+STAGER: Optional[InputStager] = None
+if INPUT_MODE == "staged":
+    STAGER = InputStager(STAGING_DIR, link=STAGING_LINK)
+    if STAGER.root == Path(INPUT_DIR).resolve() or Path(INPUT_DIR).resolve() in STAGER.root.parents:
+        print(f"[stage] 警告: staging_dir が input_dir の中にあります（ステージした画像も入力として見つかります）: {STAGER.root}")
+COLLECTOR: Optional[ResultCollector] = None
+if OUTPUT_DIR:
+    COLLECTOR = ResultCollector(
+        HTTP, OUTPUT_DIR, INPUT_DIR, concurrency=COLLECT_CONCURRENCY, types=COLLECT_TYPES, verify=COLLECT_VERIFY
+    )
+    if COLLECTOR.root == Path(INPUT_DIR).resolve() or Path(INPUT_DIR).resolve() in COLLECTOR.root.parents:
+        print(f"[collect] 警告: output_dir が input_dir の中にあります（回収した画像も入力として見つかります）: {COLLECTOR.root}")
+LANES: Optional[LaneScheduler] = None
+if PRIORITY_LANES:
+    LANES = LaneScheduler(PRIORITY_LANES, INPUT_DIR, window=LANE_WINDOW)
+CANCELLER: Optional[StaleJobCanceller] = None
+if CANCEL_STALE:
+    CANCELLER = StaleJobCanceller(HTTP, requeue=CANCEL_REQUEUE)
+if BATCH_MAX > 1 and STAGER is None:
+    print("[batch] 画像をまとめる batch_max は input_mode が \"staged\" のときだけ有効です")
+    BATCH_MAX = 1
+
+# モデルローダーグループ（トリガー → ノードID群）の置き場所
+GROUPS_PATH = Path("out/model_loader_groups.json")
 
 
 def collect_skip_node_ids_for_path(target_path: Path) -> Set[str]:
     """各グループについて、パスにトリガーが含まれなければそのグループの node_ids をスキップ対象に追加。"""
-    skip: Set[str] = set()
-    for grp in GROUPS:
-        sub_id = grp.get("subgraph_id")
-        triggers = grp.get("trigger_folder_name") or []
-        node_ids = grp.get("node_ids") or []
-        if not _path_contains_any_keyword(target_path, [str(t) for t in triggers]):
-            for nid in node_ids:
-                nid_str = str(nid)
-                if sub_id:
-                    skip.add(f"{str(sub_id)}:{nid_str}")
-                else:
-                    skip.add(nid_str)
-    return skip
-
-
-def _drop_all_references(graph: Dict[str, Any], target_node_id: str) -> None:
+    return set(MATCHER.skip_ids_for_path(target_path))
+
+
+def _drop_all_references(
+    graph: Dict[str, Any], target_node_id: str, index: Optional[remove_switches.ConsumerIndex] = None
+) -> None:
     """graph 内の inputs から target_node_id 参照を取り除く。"""
-    for node_id, node in graph.items():
+    if index is None:
+        index = remove_switches.ConsumerIndex(graph)
+    for node_id, key in index.consumers(target_node_id):
+        node = graph.get(node_id)
         if not isinstance(node, dict):
             continue
         inputs: Dict[str, Any] = node.get("inputs", {}) or {}
-        for key in list(inputs.keys()):
-            val = inputs[key]
-            # 直接参照 ["id", idx]
-            if (
-                isinstance(val, list)
-                and len(val) == 2
-                and isinstance(val[0], (str, int))
-                and str(val[0]) == str(target_node_id)
-            ):
-                del inputs[key]
-                continue
-            # 配列内参照を簡易に除去
-            if isinstance(val, list) and len(val) > 0:
-                new_list: List[Any] = []
-                changed = False
-                for inner in val:
-                    if (
-                        isinstance(inner, list)
-                        and len(inner) == 2
-                        and isinstance(inner[0], (str, int))
-                        and str(inner[0]) == str(target_node_id)
-                    ):
-                        changed = True
-                        continue
-                    new_list.append(inner)
-                if changed:
-                    inputs[key] = new_list
+        if key not in inputs:
+            continue
+        val = inputs[key]
+        before = remove_switches._value_refs(val)
+        # 直接参照 ["id", idx]
+        if (
+            isinstance(val, list)
+            and len(val) == 2
+            and isinstance(val[0], (str, int))
+            and str(val[0]) == str(target_node_id)
+        ):
+            del inputs[key]
+            index.update_input(node_id, key, before, None)
+            continue
+        # 配列内参照を簡易に除去
+        if isinstance(val, list) and len(val) > 0:
+            new_list: List[Any] = []
+            changed = False
+            for inner in val:
+                if (
+                    isinstance(inner, list)
+                    and len(inner) == 2
+                    and isinstance(inner[0], (str, int))
+                    and str(inner[0]) == str(target_node_id)
+                ):
+                    changed = True
+                    continue
+                new_list.append(inner)
+            if changed:
+                inputs[key] = new_list
+                index.update_input(node_id, key, before, new_list)
+
+
+def _resolve_target_keys(
+    g: Dict[str, Any], raw_ids: Set[str], index: remove_switches.ConsumerIndex
+) -> List[str]:
+    """スキップ指定IDをグラフのキーへ解決する。
+    サブグラフ対応: キーが "<subgraph_id>:<node_id>" の形式を想定し、":<node_id>" 末尾一致で対象キーを解決
+    """
+    keys: List[str] = []
+    seen: Set[str] = set()
+    # 1) subgraph_id:id 形式は厳密一致で採用
+    colon_ids = [rid for rid in raw_ids if ":" in str(rid)]
+    for rid in colon_ids:
+        rid_str = str(rid)
+        if rid_str in g and rid_str not in seen:
+            keys.append(rid_str)
+            seen.add(rid_str)
+
+    # 2) 非コロンIDはサブグラフ末尾一致（":<id>"）を優先（グラフ上の順で採用）
+    plain_ids = [rid for rid in raw_ids if ":" not in str(rid)]
+    suffix_hits: List[str] = []
+    for rid in plain_ids:
+        suffix_hits.extend(k for k in index.keys_with_suffix(str(rid)) if k not in seen)
+    for key in sorted(set(suffix_hits), key=index.position):
+        keys.append(key)
+        seen.add(key)
+
+    # 3) それでも見つからないものは通常キー完全一致
+    for rid in plain_ids:
+        rid_str = str(rid)
+        if rid_str in g and rid_str not in seen:
+            keys.append(rid_str)
+            seen.add(rid_str)
+    return keys
 
 
 def bypass_nodes(graph: Dict[str, Any], node_ids_to_skip: Set[str]) -> Dict[str, Any]:
@@ -110,33 +218,9 @@ def bypass_nodes(graph: Dict[str, Any], node_ids_to_skip: Set[str]) -> Dict[str,
     - なければ参照を除去してから削除
     """
     new_graph: Dict[str, Any] = json.loads(json.dumps(graph))
-    # サブグラフ対応: キーが "<subgraph_id>:<node_id>" の形式を想定し、":<node_id>" 末尾一致で対象キーを解決
-    def _resolve_target_keys(g: Dict[str, Any], raw_ids: Set[str]) -> List[str]:
-        keys: List[str] = []
-        # 1) subgraph_id:id 形式は厳密一致で採用
-        colon_ids = [rid for rid in raw_ids if ":" in str(rid)]
-        for rid in colon_ids:
-            rid_str = str(rid)
-            if rid_str in g and rid_str not in keys:
-                keys.append(rid_str)
-
-        # 2) 非コロンIDはサブグラフ末尾一致（":<id>"）を優先
-        plain_ids = [rid for rid in raw_ids if ":" not in str(rid)]
-        for key in g.keys():
-            if ":" in key:
-                for rid in plain_ids:
-                    if key.endswith(f":{str(rid)}") and key not in keys:
-                        keys.append(key)
-                        break
-
-        # 3) それでも見つからないものは通常キー完全一致
-        for rid in plain_ids:
-            rid_str = str(rid)
-            if rid_str in g and rid_str not in keys:
-                keys.append(rid_str)
-        return keys
-
-    target_keys: List[str] = _resolve_target_keys(new_graph, node_ids_to_skip)
+    # 参照の逆引きとサブグラフ末尾IDの索引は1回だけ構築する
+    index = remove_switches.ConsumerIndex(new_graph)
+    target_keys: List[str] = _resolve_target_keys(new_graph, node_ids_to_skip, index)
     for nid in list(target_keys):
         if str(nid) not in new_graph:
             continue
@@ -151,73 +235,385 @@ def bypass_nodes(graph: Dict[str, Any], node_ids_to_skip: Set[str]) -> Dict[str,
             # 先頭の接続にバイパス
             upstream = conns[0][1]
             try:
-                remove_switches._replace_all_references(new_graph, str(nid), [upstream[0], int(upstream[1])])  # type: ignore[attr-defined]
+                remove_switches._replace_all_references(new_graph, str(nid), [upstream[0], int(upstream[1])], index)  # type: ignore[attr-defined]
             except Exception:
                 # 失敗時は参照を全削除
-                _drop_all_references(new_graph, str(nid))
+                _drop_all_references(new_graph, str(nid), index)
         else:
             # 接続が無ければ参照を全削除
-            _drop_all_references(new_graph, str(nid))
+            _drop_all_references(new_graph, str(nid), index)
 
         # ノード本体を削除
         if str(nid) in new_graph:
             try:
+                index.remove_node(str(nid))
                 del new_graph[str(nid)]
             except Exception:
                 pass
     return new_graph
 
 
-def build_workflow(idx: int, path_for_decision: Path):
-    wf[LOAD_NODE_ID]["inputs"]["start_index"] = idx
-    # パスに応じてスキップ対象ノードを決定し、グラフに反映
-    skip_ids = collect_skip_node_ids_for_path(path_for_decision) if GROUPS else set()
-    graph = wf
-    if skip_ids:
-        graph = bypass_nodes(graph, skip_ids)
-    # 最後に Switch ノードの除去最適化
-    return remove_switches.remove_switch_nodes(graph)
+def compile_workflow(skip_ids: Set[str], state: Optional[WorkflowState] = None) -> Dict[str, Any]:
+    """スキップ集合だけで決まる変換（バイパス + Switch除去 + 不要ノード削除）を wf に適用する。
 
+    state を省略すると現在の一式（STATE）を使う。
+    """
+    state = state or STATE
+    if state.graph is not None:
+        graph = compile_api(state.graph, skip_ids, state.output_roots)
+    else:
+        graph = state.wf
+        if skip_ids:
+            graph = bypass_nodes(graph, set(skip_ids))
+        # 最後に Switch ノードの除去・定数畳み込みと、出力へ繋がらないノードの削除
+        graph = remove_switches.remove_switch_nodes(graph, roots=state.output_roots)
+    if INPUT_MODE == "upload":
+        # フォルダ走査の代わりに、アップロード済みの1枚を読む
+        graph = as_load_image(graph, state.load_node_id)
+    return graph
 
-def submit(idx: int, path_for_decision: Path):
-    payload = {"prompt": build_workflow(idx, path_for_decision), "client_id": CLIENT_ID}
-    r = requests.post(f"{COMFY}/prompt", json=payload, timeout=60)
-    r.raise_for_status()
-    print(f"[queued] index={idx} file={path_for_decision} prompt_id={r.json()['prompt_id']}")
 
+# 再読み込みで反映できる設定（それ以外の変更は再起動後に反映）
+RELOADABLE_KEYS = {"workflow", "ui_workflow", "auto_extract", "workflow_cache_size"}
 
-def get_queue_status():
-    r = requests.get(f"{COMFY}/queue", timeout=30)
-    r.raise_for_status()
-    return r.json()
 
+def load_workflow_state(generation: int = 0, config: Optional[Dict[str, Any]] = None) -> WorkflowState:
+    """設定・ワークフロー・グループ定義を読み、投入に使う一式を作る（起動時と再読み込み時）。
 
-def main_loop():
-    # 入力PNGを再帰列挙し、順番に空き時のみ投入
-    input_paths = list(Path(INPUT_DIR).rglob("*.png"))
-    i = 0
-    while i < len(input_paths):
-        try:
-            q = get_queue_status()
-        except requests.RequestException as e:
-            print(f"[queue check error] {e}")
-            time.sleep(10)
-            continue
+    config を省略すると config.json を読み直す。壊れた入力は例外にする（再読み込みでは以前の一式のまま続く）。
+    """
+    if config is None:
+        config = json.loads(Path("config.json").read_text(encoding="utf-8"))
+        changed = sorted(k for k in set(config) | set(CONFIG) if k not in RELOADABLE_KEYS and config.get(k) != CONFIG.get(k))
+        if changed:
+            print(f"[reload] 次の設定の変更は再起動後に反映されます: {', '.join(changed)}")
+    wf = json.loads(Path(config["workflow"]).read_text(encoding="utf-8"))
+    load_node_id = DEFAULT_LOAD_NODE_ID
+    for idx, node in wf.items():
+        if (
+            node["class_type"] == "LoadImagesFromFolderKJ"
+            and node["_meta"]["title"] == "LoadImage"
+        ):
+            load_node_id = idx
+            break
+    if load_node_id not in wf:
+        raise ValueError(f"{config['workflow']}: 読み込みノード（LoadImagesFromFolderKJ）が見つかりません")
+    wf[load_node_id]["inputs"]["folder"] = INPUT_DIR
+    # サブフォルダも探索できるよう既定を true に（存在すれば上書き）
+    # staged モードではジョブごとのディレクトリ（画像1枚）を folder に指定するので、サブフォルダの探索は不要
+    wf[load_node_id]["inputs"]["include_subfolders"] = INPUT_MODE != "staged"
+    if INPUT_MODE == "upload":
+        # LoadImage の出力は IMAGE(0) と MASK(1) だけなので、count / image_path を使うノードは動かない
+        extra_slots = sorted(
+            {
+                f"{nid}.{key}"
+                for nid, node in wf.items()
+                for key, val in (node.get("inputs") or {}).items()
+                if isinstance(val, list) and len(val) == 2 and str(val[0]) == load_node_id and val[1] not in (0, 1)
+            }
+        )
+        if extra_slots:
+            print(f"[upload] 警告: {load_node_id} の count/image_path 出力を使う入力があります: {', '.join(extra_slots)}")
 
-        pending = 0
+    # UI形式のワークフローがあり、グループ定義が無いか古ければ抽出し直す
+    ui_workflow = str(config.get("ui_workflow", "00-I2v_ImageToVideo.json"))
+    if bool(config.get("auto_extract", True)):
         try:
-            # ComfyUI /queue の想定レスポンスに準拠
-            pending = len(q.get("queue_pending", []))
-        except (TypeError, ValueError, KeyError):
-            pending = 0
+            refresh_groups(ui_workflow, str(GROUPS_PATH))
+        except Exception as e:
+            print(f"[extract error] {ui_workflow}: {e}")
+    groups: List[Dict[str, Any]] = []
+    if GROUPS_PATH.exists():
+        try:
+            groups = json.loads(GROUPS_PATH.read_text(encoding="utf-8"))
+        except Exception:
+            if generation:
+                raise
+            groups = []
+
+    # 到達性の起点（出力ノード）はバイパス前の wf で決める。バイパスで参照を失ったノードを
+    # 起点と誤認しないため
+    output_roots = remove_switches.find_output_nodes(wf)
+    # 変換用のコンパクトなグラフは一度だけ作る（表せない入力を含むなら None で、dict のまま変換する）
+    graph = WorkflowGraph.from_api(wf)
+    if graph is None:
+        print("[workflow] 配列の中の参照などを含むため、dict のグラフで変換します")
+    state = WorkflowState(generation, config, wf, load_node_id, output_roots, graph, groups, TriggerMatcher(groups))
+    # スキップ集合の種類は少ないので、変換結果を使い回す
+    state.cache = CompiledWorkflowCache(
+        lambda skip_ids: compile_workflow(skip_ids, state), maxsize=int(config.get("workflow_cache_size", 16))
+    )
+    if generation:
+        # 差し替える前に、どのグループも一致しない画像（全グループをスキップ）の本文まで作れることを確かめる
+        signature, skip_ids = state.matcher.classify(Path(INPUT_DIR))
+        state.cache.get_template(skip_ids, CLIENT_ID, load_node_id, LOAD_FIELDS, signature=signature)
+    return state
+
+
+def watched_paths(state: WorkflowState) -> List[Path]:
+    """再読み込みのために監視するファイル。"""
+    return [
+        Path("config.json"),
+        Path(state.config["workflow"]),
+        Path(str(state.config.get("ui_workflow", "00-I2v_ImageToVideo.json"))),
+        GROUPS_PATH,
+    ]
+
+
+def set_workflow_state(state: WorkflowState) -> None:
+    """state を現在の一式にする（メインスレッドから、投入と投入の合間に呼ぶ）。"""
+    global STATE, wf, LOAD_NODE_ID, GROUPS, MATCHER, OUTPUT_ROOTS, WF_GRAPH, WORKFLOW_CACHE
+    wf = state.wf
+    LOAD_NODE_ID = state.load_node_id
+    GROUPS = state.groups
+    MATCHER = state.matcher
+    OUTPUT_ROOTS = state.output_roots
+    WF_GRAPH = state.graph
+    WORKFLOW_CACHE = state.cache
+    # 別スレッド（build_pipeline）は STATE だけを見るので、最後に1回の代入で切り替える
+    STATE = state
 
-        if pending == 0:
-            submit(i, input_paths[i])
-            # 次の投入まで10秒待機（完了監視はしない）
-            i += 1
-        time.sleep(10)
+
+# 画像ごとに変わる読み込みノードの入力（upload モードでは image、staged モードでは folder と枚数）
+if INPUT_MODE == "upload":
+    LOAD_FIELDS = ("image",)
+elif INPUT_MODE == "staged":
+    LOAD_FIELDS = ("folder", "start_index", "image_load_cap")
+else:
+    LOAD_FIELDS = ("start_index",)
+
+# 起動時の一式（reload が true なら、ファイルの変更を監視して投入の合間に差し替える）
+# wf・LOAD_NODE_ID などは STATE の中身を指す別名（set_workflow_state でまとめて差し替える）
+wf: Dict[str, Any]
+LOAD_NODE_ID: str
+GROUPS: List[Dict[str, Any]]
+MATCHER: TriggerMatcher
+OUTPUT_ROOTS: List[str]
+WF_GRAPH: Optional[WorkflowGraph]
+WORKFLOW_CACHE: CompiledWorkflowCache
+STATE: WorkflowState
+set_workflow_state(load_workflow_state(0, CONFIG))
+
+
+def _load_inputs(idx: int, image: Optional[str], folder: Optional[str], count: int) -> Dict[str, Any]:
+    if image is not None:
+        return {"image": image}
+    if folder is not None:
+        return {"folder": folder, "start_index": 0, "image_load_cap": count}
+    return {"start_index": idx}
+
+
+def build_workflow(
+    idx: int, path_for_decision: Path, image: Optional[str] = None, folder: Optional[str] = None, count: int = 1
+):
+    # パスに応じてスキップ対象ノードを決定し、変換済みグラフを取得
+    signature, skip_ids = MATCHER.classify(path_for_decision)
+    compiled = WORKFLOW_CACHE.get(skip_ids, signature=signature)
+    # 画像ごとに変わる入力だけを差し替える（wf・キャッシュは変更しない）
+    return patch_node_inputs(compiled, LOAD_NODE_ID, _load_inputs(idx, image, folder, count))
+
+
+def build_prompt_body(
+    idx: int,
+    path_for_decision: Path,
+    image: Optional[str] = None,
+    folder: Optional[str] = None,
+    count: int = 1,
+    front: bool = False,
+) -> bytes:
+    """/prompt の本文（{"prompt": build_workflow(...), "client_id": CLIENT_ID} の JSON）を bytes で返す。
+
+    グラフはスキップ集合ごとにエンコード済みのテンプレートを使い、可変フィールドだけを差し込む。
+    front なら "front": true を付け、ComfyUI の待ち行列の先頭に積ませる。
+    """
+    signature, skip_ids = MATCHER.classify(path_for_decision)
+    template = WORKFLOW_CACHE.get_template(skip_ids, CLIENT_ID, LOAD_NODE_ID, LOAD_FIELDS, signature=signature)
+    return template.render(_load_inputs(idx, image, folder, count), {"front": True} if front else None)
+
+
+def submit(
+    idx: int,
+    path_for_decision: Path,
+    base: str = COMFY,
+    timings: Optional[Dict[str, float]] = None,
+    batch: Optional[List[Path]] = None,
+) -> str:
+    # batch: 1プロンプトにまとめた画像（先頭は path_for_decision。同じスキップ集合のものだけ）
+    paths = batch or [path_for_decision]
+    image = UPLOADER.ensure(path_for_decision, base) if UPLOADER is not None else None
+    folder = STAGER.stage(paths) if STAGER is not None else None
+    front = LANES is not None and LANES.is_front(path_for_decision)
+    payload = build_prompt_body(idx, path_for_decision, image, folder, len(paths), front=front)
+    if timings is not None:
+        timings["submit"] = time.time()
+    prompt_id = HTTP.post_prompt(base, payload)["prompt_id"]
+    if CANCELLER is not None:
+        CANCELLER.stamp(prompt_id, paths)
+    extra = f" (+{len(paths) - 1} more)" if len(paths) > 1 else ""
+    extra += " front" if front else ""
+    print(f"[queued] index={idx} file={path_for_decision}{extra} backend={base} prompt_id={prompt_id}")
+    return prompt_id
+
+
+def start_compile_pool(state: WorkflowState) -> Optional[CompilePool]:
+    """ノード数の多いワークフローなら、変換用のプロセスプールを起動する。"""
+    if BUILD_PROCESSES <= 0 or state.graph is None or len(state.wf) < BUILD_PROCESS_MIN_NODES:
+        return None
+    return CompilePool(
+        BUILD_PROCESSES,
+        state.wf,
+        state.output_roots,
+        state.load_node_id,
+        INPUT_MODE == "upload",
+        CLIENT_ID,
+        LOAD_FIELDS,
+    )
+
+
+def _build_template(skip_ids: frozenset) -> PromptTemplate:
+    state = STATE
+    graph = compile_workflow(set(skip_ids), state)
+    return PromptTemplate({"prompt": graph, "client_id": CLIENT_ID}, state.load_node_id, LOAD_FIELDS)
+
+
+def start_build_pipeline(jobs, notify) -> BuildPipeline:
+    """jobs の後ろに、分類とテンプレート作成を先回りする段を付けて動かし始める。
+
+    別スレッドからは STATE だけを読み、再読み込みで一式が替わる前に作ったものは generation で見分けて捨てる。
+    """
+    return BuildPipeline(
+        jobs,
+        lambda path: STATE.matcher.classify(path),
+        is_built=lambda sig: STATE.cache.has_template(sig, CLIENT_ID, STATE.load_node_id, LOAD_FIELDS),
+        build=_build_template,
+        install=lambda sig, template: WORKFLOW_CACHE.put_template(sig, CLIENT_ID, LOAD_NODE_ID, LOAD_FIELDS, template),
+        depth=BUILD_AHEAD,
+        pool=start_compile_pool(STATE),
+        notify=notify,
+        generation=lambda: STATE.generation,
+    ).start()
+
+
+def get_queue_status(base: str = COMFY):
+    return HTTP.get_queue(base)
+
+
+def get_history(base: str, prompt_id: str):
+    return HTTP.get_history(base, prompt_id)
+
+
+def main_loop():
+    ledger = JobLedger(LEDGER_PATH) if LEDGER_PATH else None
+    metrics = JobMetrics(window=METRICS_WINDOW)
+    metrics_server = start_metrics_server(metrics, METRICS_HOST, METRICS_PORT) if METRICS_PORT > 0 else None
+    depth = (
+        QueueDepthController(max_pending=QUEUE_MAX_PENDING, max_queued_seconds=QUEUE_MAX_SECONDS)
+        if QUEUE_MAX_PENDING > 1
+        else None
+    )
+    scheduler = Scheduler(
+        BACKENDS,
+        submit,
+        # 全バックエンドの /queue を並行して問い合わせる
+        HTTP.get_queue_future,
+        CLIENT_ID,
+        use_websocket=(DISPATCH_MODE == "ws"),
+        history_fn=get_history,
+        ledger=ledger,
+        metrics=metrics,
+        depth=depth,
+    )
+    scheduler.add_reporter(metrics.report)
+    if depth is not None:
+        scheduler.add_reporter(depth.report)
+    if COLLECTOR is not None:
+        # resume() で見つかる、前回の実行中に終わっていたプロンプトの出力も回収する
+        scheduler.add_result_handler(COLLECTOR.collect)
+        scheduler.add_reporter(COLLECTOR.report)
+    scheduler.resume()
+    if STAGER is not None:
+        # 前回から実行中のジョブのディレクトリだけ残し、完了したジョブのディレクトリは消していく
+        STAGER.sweep(keep=[[m.path for m in job.members()] for be in scheduler.backends for job in be.inflight.values()])
+        scheduler.add_finish_handler(lambda job: STAGER.release([m.path for m in job.members()]))
+        scheduler.add_reporter(STAGER.report)
+    # 入力PNGを再帰列挙しながら（走査完了を待たずに）空いているバックエンドへ順番に投入
+    discovery = InputDiscovery(
+        INPUT_DIR, watch=WATCH, debounce=WATCH_DEBOUNCE, notify=scheduler.wake.set
+    ).start()
+    jobs = iter_jobs(discovery)
+    if ledger is not None:
+        jobs = ledger.filter_jobs(jobs)
+    if AFFINITY_WINDOW > 0 and GROUPS:
+        planner = AffinityPlanner(
+            lambda p: MATCHER.classify(p)[0], window=AFFINITY_WINDOW, max_run=AFFINITY_MAX_RUN
+        )
+        jobs = planner.plan(jobs)
+        scheduler.add_reporter(planner.report)
+    if LANES is not None:
+        # 並べ替えた後で、急ぎのレーンの画像を先の画像より前に出す（先回りの準備より前なので、追い越しは build_ahead 件以内で効く）
+        jobs = LANES.schedule(jobs)
+        scheduler.add_reporter(LANES.report)
+    pipeline: Optional[BuildPipeline] = None
+    if BUILD_AHEAD > 0:
+        # ここまでの段と分類・テンプレート作成を別スレッドで先に進め、投入時は本文を作って送るだけにする。
+        # まとめ（実行時間の実績で枚数を決める）と先読みアップロード（投入先で決まる）は投入の直前のまま
+        pipeline = start_build_pipeline(jobs, scheduler.wake.set)
+        jobs = pipeline.jobs()
+        scheduler.submit_fn = pipeline.timed(submit)
+        scheduler.add_reporter(pipeline.report)
+    if BATCH_MAX > 1:
+        # 並べ替えで続いた同じモデル構成の画像を、実行時間に応じた枚数ずつ1プロンプトにまとめる
+        batcher = AdaptiveBatcher(
+            lambda p: MATCHER.classify(p)[0], max_size=BATCH_MAX, target_seconds=BATCH_TARGET_SECONDS
+        )
+        jobs = batcher.batch(jobs)
+        scheduler.add_finish_handler(batcher.observe)
+        scheduler.add_reporter(batcher.report)
+    if CANCELLER is not None:
+        # 投入前に入力が消えたもの・投入済みの入力と同じものを飛ばし、投入後は入力の変化を定期的に確かめる
+        jobs = CANCELLER.filter(jobs)
+        scheduler.add_finish_handler(CANCELLER.forget)
+        scheduler.add_periodic(lambda: CANCELLER.check(scheduler), CANCEL_CHECK_INTERVAL)
+        scheduler.add_reporter(CANCELLER.report)
+    if UPLOADER is not None:
+        # 投入順が決まった後で、先の画像のハッシュ計算・アップロードを始めておく
+        jobs = UPLOADER.prefetch(jobs, BACKENDS, lookahead=UPLOAD_LOOKAHEAD)
+        scheduler.add_reporter(UPLOADER.report)
+    reloader: Optional[HotReloader] = None
+    if RELOAD:
+        reloader = HotReloader(
+            STATE, load_workflow_state, watched_paths, interval=RELOAD_INTERVAL, notify=scheduler.wake.set
+        ).start()
+
+        def swap(state: WorkflowState) -> None:
+            set_workflow_state(state)
+            if pipeline is not None:
+                # プロセスのワーカーは起動時のワークフローを持っているので作り直す
+                pipeline.set_pool(start_compile_pool(state))
+
+        # 投入の直前（まとめ・先読みの後）で差し替える
+        jobs = reloader.between(jobs, swap)
+        scheduler.add_reporter(reloader.report)
+    try:
+        # 次のチェックまで待機（ws 接続中は空きイベントで即座に起きる）
+        scheduler.run(jobs, POLL_INTERVAL)
+    finally:
+        if reloader is not None:
+            reloader.stop()
+        if pipeline is not None:
+            pipeline.stop()
+        discovery.stop()
+        if COLLECTOR is not None:
+            if not COLLECTOR.drain(0):
+                print(f"[collect] 残り {COLLECTOR.backlog} 件のダウンロードを待っています")
+                COLLECTOR.drain()
+                print(COLLECTOR.report())
+        if ledger is not None:
+            ledger.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        HTTP.close()
 
 
 if __name__ == "__main__":
-    # watchdog を使用しない運用に切替
     main_loop()
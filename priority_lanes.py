@@ -0,0 +1,120 @@
+"""フォルダ名・トリガーのキーワードで入力を優先度レーンに振り分け、重みに応じて交互に流す段。
+
+config.json の priority_lanes で、レーンごとに
+  {"name": "urgent", "match": ["urgent", "rush"], "weight": 8, "front": true}
+のように指定する。match のどれかが input_dir からのフォルダのパス（小文字、ファイル名は含めない）に
+含まれる画像がそのレーンに入る（上から順に判定）。どれにも当たらない画像は "default" レーン
+（重み 1。同じ名前のレーンを書けば重みを変えられる）に入る。
+
+最大 window 件まで先読みしてレーンごとに溜め、溜まっているレーンの間で重み付きの
+ラウンドロビン（smooth weighted round-robin）で次の1件を選ぶ。重み 8 と 1 なら、両方に
+入力がある間は 8:1 の割合で流れ、重みの小さいレーンも止まらない。front が true のレーンの
+プロンプトは /prompt の front で ComfyUI の待ち行列の先頭に積む。
+"""
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from scheduler import Job
+
+_END = object()
+DEFAULT_LANE = "default"
+
+
+class Lane:
+    """1つのレーンの設定と、振り分けられて流れ待ちの Job。"""
+
+    def __init__(self, name: str, match: List[str], weight: float = 1.0, front: bool = False) -> None:
+        self.name = name
+        self.match = [str(m).lower() for m in match if str(m)]
+        self.weight = max(0.001, float(weight))
+        self.front = front
+        self.queue: Deque[Job] = deque()
+        # smooth weighted round-robin の現在値
+        self.current = 0.0
+        self.emitted = 0
+
+
+class LaneScheduler:
+    """Job 列をレーンごとに溜め直すイテレータ。None（今は入力が無い）は素通しする。"""
+
+    def __init__(self, lanes: List[Dict[str, Any]], input_dir: str, window: int = 4096) -> None:
+        self.root = Path(input_dir).resolve()
+        self.window = max(1, int(window))
+        self.lanes: List[Lane] = []
+        default: Optional[Lane] = None
+        for spec in lanes:
+            if not isinstance(spec, dict) or not spec.get("name"):
+                continue
+            lane = Lane(str(spec["name"]), list(spec.get("match") or []), spec.get("weight", 1), bool(spec.get("front", False)))
+            if lane.name == DEFAULT_LANE:
+                default = lane
+            self.lanes.append(lane)
+        if default is None:
+            default = Lane(DEFAULT_LANE, [])
+            self.lanes.append(default)
+        self.default = default
+        self._buffered = 0
+
+    def lane_for(self, path: Path) -> Lane:
+        """path が入るレーン（キーワードはフォルダのパスだけで照合する）。"""
+        resolved = Path(path).resolve()
+        try:
+            folder = resolved.relative_to(self.root).parent
+        except ValueError:
+            folder = resolved.parent
+        text = folder.as_posix().lower()
+        for lane in self.lanes:
+            if lane is not self.default and any(m in text for m in lane.match):
+                return lane
+        return self.default
+
+    def is_front(self, path: Path) -> bool:
+        return self.lane_for(path).front
+
+    def _accept(self, job: Job) -> None:
+        lane = self.lane_for(job.path)
+        job.lane = lane.name
+        lane.queue.append(job)
+        self._buffered += 1
+
+    def _emit(self) -> Optional[Job]:
+        active = [lane for lane in self.lanes if lane.queue]
+        if not active:
+            return None
+        total = sum(lane.weight for lane in active)
+        for lane in active:
+            lane.current += lane.weight
+        chosen = max(active, key=lambda lane: lane.current)
+        chosen.current -= total
+        chosen.emitted += 1
+        self._buffered -= 1
+        job = chosen.queue.popleft()
+        if not chosen.queue:
+            # 空になったレーンは次に入力が来たとき、前の貸し借りを持ち越さない
+            chosen.current = 0.0
+        return job
+
+    def schedule(self, jobs: Iterator[Optional[Job]]) -> Iterator[Optional[Job]]:
+        exhausted = False
+        while True:
+            # 今すぐ読める入力を window まで溜める（先の画像に急ぎのものがあれば追い越せるように）
+            while not exhausted and self._buffered < self.window:
+                item = next(jobs, _END)
+                if item is _END:
+                    exhausted = True
+                    break
+                if item is None:
+                    break
+                self._accept(item)  # type: ignore[arg-type]
+            job = self._emit()
+            if job is None:
+                if exhausted:
+                    return
+                yield None
+                continue
+            yield job
+
+    def report(self) -> str:
+        lanes = " ".join(f"{lane.name}={lane.emitted}(+{len(lane.queue)})" for lane in self.lanes)
+        return f"[lanes] {lanes} buffered={self._buffered}"
@@ -0,0 +1,107 @@
+"""バックエンドごとに ComfyUI のキューへ積んでおく待ち数を決める制御器。
+
+待ち数が 1 だと、短いワークフローでは実行中のプロンプトが終わるまでに次の組み立て・送信・
+検証が間に合わず GPU が空く。逆に積みすぎると、投入済みのプロンプトは取り消しや順番の
+入れ替えができない。そこで、観測した送信時間（組み立て開始から /prompt の応答まで）と
+実行時間から「1件送る間に終わる件数 + 1」を基本の待ち数とし、連続するジョブの間に
+GPU の空き（前のジョブの終了から次のジョブの開始まで）を見つけたら1つずつ増やす。
+空きが出ない状態が続けば1つずつ戻す。待ち数は max_pending 件と、積んだ仕事の見込み
+秒数 max_queued_seconds の両方で頭打ちにする。
+"""
+import math
+from typing import Dict, Optional
+
+from scheduler import Job
+
+
+class _BackendDepth:
+    def __init__(self) -> None:
+        self.submit_ema: Optional[float] = None
+        self.last_finished: Optional[float] = None
+        self.bonus = 0
+        self.clean_run = 0
+        self.gaps = 0
+        self.gap_seconds = 0.0
+        self.target = 1
+
+
+class QueueDepthController:
+    """Scheduler に渡すと、投入のたびに Backend.max_pending を target() に合わせる。"""
+
+    def __init__(
+        self,
+        max_pending: int = 4,
+        max_queued_seconds: float = 120.0,
+        gap_threshold: float = 0.05,
+        relax_after: int = 20,
+        alpha: float = 0.3,
+    ) -> None:
+        self.max_pending = max(1, int(max_pending))
+        self.max_queued_seconds = float(max_queued_seconds)
+        # これより短い空きはイベント受信の揺らぎとみなす
+        self.gap_threshold = gap_threshold
+        # 空きが出ないジョブがこれだけ続いたら、上乗せした待ち数を1つ戻す
+        self.relax_after = max(1, int(relax_after))
+        self.alpha = alpha
+        self._backends: Dict[str, _BackendDepth] = {}
+
+    def _state(self, url: str) -> _BackendDepth:
+        state = self._backends.get(url)
+        if state is None:
+            state = self._backends[url] = _BackendDepth()
+        return state
+
+    def observe_submit(self, url: str, seconds: float) -> None:
+        """組み立て開始から /prompt が prompt_id を返すまでの秒数を取り込む。"""
+        state = self._state(url)
+        seconds = max(0.0, seconds)
+        state.submit_ema = seconds if state.submit_ema is None else (1 - self.alpha) * state.submit_ema + self.alpha * seconds
+
+    def observe_finish(self, job: Job) -> None:
+        """終わったジョブから直前のジョブとの空きを調べる（Scheduler.add_finish_handler に渡す）。"""
+        if job.backend is None:
+            return
+        state = self._state(job.backend)
+        started = job.timings.get("started")
+        finished = job.timings.get("finished")
+        if started is None or finished is None:
+            return
+        previous = state.last_finished
+        if previous is None or finished > previous:
+            state.last_finished = finished
+        if previous is None:
+            return
+        gap = started - previous
+        if gap > self.gap_threshold:
+            state.gaps += 1
+            state.gap_seconds += gap
+            state.clean_run = 0
+            state.bonus += 1
+            return
+        state.clean_run += 1
+        if state.clean_run >= self.relax_after and state.bonus > 0:
+            state.bonus -= 1
+            state.clean_run = 0
+
+    def target(self, url: str, exec_ema: Optional[float]) -> int:
+        """url のバックエンドに積んでおく待ち数（queue_pending の上限）。"""
+        state = self._state(url)
+        if exec_ema is None or exec_ema <= 0:
+            # 実行時間が分かるまでは従来どおり1件ずつ
+            state.target = 1
+            return 1
+        base = 1
+        if state.submit_ema is not None:
+            base += math.ceil(state.submit_ema / exec_ema)
+        # 上乗せが上限を超えて膨らみ続けないよう、ここで抑える
+        state.bonus = min(state.bonus, self.max_pending)
+        cap = min(self.max_pending, max(1, int(self.max_queued_seconds / exec_ema)))
+        state.target = max(1, min(cap, base + state.bonus))
+        return state.target
+
+    def report(self) -> str:
+        parts = []
+        for url, s in self._backends.items():
+            submit = f"{s.submit_ema:.2f}s" if s.submit_ema is not None else "-"
+            parts.append(f"{url} target={s.target} submit={submit} gaps={s.gaps} ({s.gap_seconds:.1f}s idle)")
+        return "[depth] " + ("; ".join(parts) if parts else "-")
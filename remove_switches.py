@@ -1,9 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import ast
 import copy
+import glob
+import hashlib
 import json
-from typing import Any, Dict, List, Tuple, Optional, Set
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Tuple, Optional, Set
 
 
 # 制御入力キー（データ入力ではない可能性が高い）
@@ -44,34 +52,146 @@ def _choose_upstream_connection_generic(node_obj: Dict[str, Any]) -> Optional[Li
     return [chosen[0], int(chosen[1])]
 
 
+def _is_loose_reference(value: Any) -> bool:
+    """["<node_id>", <何か>] の2要素リスト（参照除去で使う緩い判定）。"""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], (str, int))
+
+
+def _value_refs(value: Any) -> Set[Tuple[str, Any]]:
+    """入力値に含まれる (参照先ノードID, 出力スロット) の集合。配列内の参照も1段だけ見る。"""
+    refs: Set[Tuple[str, Any]] = set()
+    if not isinstance(value, list):
+        return refs
+    if _is_loose_reference(value):
+        slot = value[1] if isinstance(value[1], (int, str)) else None
+        refs.add((str(value[0]), slot))
+    for inner in value:
+        if _is_loose_reference(inner):
+            slot = inner[1] if isinstance(inner[1], (int, str)) else None
+            refs.add((str(inner[0]), slot))
+    return refs
+
+
+class ConsumerIndex:
+    """(ノードID, 出力スロット) → [(参照しているノードID, 入力キー)] の逆引き索引。
+
+    グラフごとに1回だけ構築し、参照の置換・除去のたびに差分更新する。
+    あわせて "<subgraph_id>:<node_id>" 形式のキーを末尾の node_id から引ける索引も持つ。
+    索引の内容は候補であり、実際の置換時には入力値を見て判定し直す。
+    """
+
+    def __init__(self, graph: Dict[str, Any]) -> None:
+        self.graph = graph
+        self._consumers: Dict[str, Dict[Any, Dict[Tuple[str, str], None]]] = {}
+        self._suffix: Dict[str, List[str]] = {}
+        self._order: Dict[str, int] = {}
+        for pos, (node_id, node) in enumerate(graph.items()):
+            key = str(node_id)
+            self._order[key] = pos
+            if ":" in key:
+                self._suffix.setdefault(key.rsplit(":", 1)[1], []).append(key)
+            if not isinstance(node, dict):
+                continue
+            inputs = node.get("inputs", {})
+            if not isinstance(inputs, dict):
+                continue
+            for input_key, val in inputs.items():
+                for src, slot in _value_refs(val):
+                    self._add(src, slot, key, input_key)
+
+    def _add(self, src: str, slot: Any, consumer: str, input_key: str) -> None:
+        self._consumers.setdefault(src, {}).setdefault(slot, {})[(consumer, input_key)] = None
+
+    def _discard(self, src: str, slot: Any, consumer: str, input_key: str) -> None:
+        slots = self._consumers.get(src)
+        if not slots or slot not in slots:
+            return
+        slots[slot].pop((consumer, input_key), None)
+        if not slots[slot]:
+            del slots[slot]
+
+    def consumers(self, node_id: str, slot: Any = None) -> List[Tuple[str, str]]:
+        """node_id（slot 指定時はその出力のみ）を参照している (ノードID, 入力キー) のスナップショット。"""
+        slots = self._consumers.get(str(node_id)) or {}
+        if slot is not None:
+            return list(slots.get(slot, {}))
+        seen: Dict[Tuple[str, str], None] = {}
+        for entries in slots.values():
+            for entry in entries:
+                seen[entry] = None
+        return list(seen)
+
+    def update_input(self, consumer: str, input_key: str, before: Set[Tuple[str, Any]], after_value: Any) -> None:
+        """入力値の書き換え後に呼ぶ。before は書き換え前の _value_refs。"""
+        after = _value_refs(after_value)
+        for src, slot in before - after:
+            self._discard(src, slot, consumer, input_key)
+        for src, slot in after - before:
+            self._add(src, slot, consumer, input_key)
+
+    def remove_node(self, node_id: str) -> None:
+        """ノード削除時に、そのノードの入力が張っていた辺を索引から外す。"""
+        key = str(node_id)
+        node = self.graph.get(key)
+        if isinstance(node, dict) and isinstance(node.get("inputs"), dict):
+            for input_key, val in node["inputs"].items():
+                for src, slot in _value_refs(val):
+                    self._discard(src, slot, key, input_key)
+        self._consumers.pop(key, None)
+        if ":" in key:
+            keys = self._suffix.get(key.rsplit(":", 1)[1])
+            if keys and key in keys:
+                keys.remove(key)
+
+    def keys_with_suffix(self, plain_id: str) -> List[str]:
+        """":<plain_id>" で終わるサブグラフ内ノードのキー（グラフ上の順）。"""
+        return list(self._suffix.get(str(plain_id), []))
+
+    def position(self, node_id: str) -> int:
+        return self._order.get(str(node_id), len(self._order))
+
+    def _inputs_of(self, consumer: str) -> Optional[Dict[str, Any]]:
+        node = self.graph.get(consumer)
+        if not isinstance(node, dict):
+            return None
+        inputs = node.get("inputs", {})
+        return inputs if isinstance(inputs, dict) else None
+
+
 def _replace_all_references(
-    graph: Dict[str, Any], target_node_id: str, replacement: List[Any]
+    graph: Dict[str, Any],
+    target_node_id: str,
+    replacement: List[Any],
+    index: Optional[ConsumerIndex] = None,
 ) -> None:
     """全ノードのinputs内で target_node_id 参照を replacement に置換する。"""
-    for node_id, node in graph.items():
-        if not isinstance(node, dict):
+    if index is None:
+        index = ConsumerIndex(graph)
+    for consumer, key in index.consumers(target_node_id):
+        inputs = index._inputs_of(consumer)
+        if inputs is None or key not in inputs:
             continue
-        inputs: Dict[str, Any] = node.get("inputs", {})
-        if not isinstance(inputs, dict):
+        val = inputs[key]
+        before = _value_refs(val)
+
+        # パターン1: 直接参照 ["id", idx]
+        if _is_connection(val) and str(val[0]) == str(target_node_id):
+            inputs[key] = [replacement[0], int(replacement[1])]
+            index.update_input(consumer, key, before, inputs[key])
             continue
 
-        for key, val in list(inputs.items()):
-            # パターン1: 直接参照 ["id", idx]
-            if _is_connection(val) and str(val[0]) == str(target_node_id):
-                inputs[key] = [replacement[0], int(replacement[1])]
+        # パターン2: 配列の中に参照が含まれることは基本ないが、念のため軽く走査
+        if isinstance(val, list):
+            if len(val) == 0:
                 continue
-
-            # パターン2: 配列の中に参照が含まれることは基本ないが、念のため軽く走査
-            if isinstance(val, list):
-                if len(val) == 0:
-                    continue
-                # ネストが更にあるケースは想定薄なので最小限の対応
-                # 例: [ ["id", 0], ["id", 1] ] のような構造は通常現れない
-                # 見つけても最初の一致だけ置換
-                for i, inner in enumerate(val):
-                    if _is_connection(inner) and str(inner[0]) == str(target_node_id):
-                        val[i] = [replacement[0], int(replacement[1])]
-                        break
+            # ネストが更にあるケースは想定薄なので最小限の対応
+            # 例: [ ["id", 0], ["id", 1] ] のような構造は通常現れない
+            # 見つけても最初の一致だけ置換
+            for i, inner in enumerate(val):
+                if _is_connection(inner) and str(inner[0]) == str(target_node_id):
+                    val[i] = [replacement[0], int(replacement[1])]
+                    break
+            index.update_input(consumer, key, before, val)
 
 
 def _replace_references_selective(
@@ -80,49 +200,195 @@ def _replace_references_selective(
     chosen_output_index: int,
     replacement: List[Any],
     drop_other_refs: bool = False,
+    index: Optional[ConsumerIndex] = None,
 ) -> None:
     """target_node_id の出力 chosen_output_index 参照のみ置換。
     drop_other_refs=True の場合、非選択出力の参照は削除する。
     """
-    for node_id, node in graph.items():
-        if not isinstance(node, dict):
+    if index is None:
+        index = ConsumerIndex(graph)
+    for consumer, key in index.consumers(target_node_id):
+        inputs = index._inputs_of(consumer)
+        if inputs is None or key not in inputs:
             continue
-        inputs: Dict[str, Any] = node.get("inputs", {})
-        if not isinstance(inputs, dict):
+        val = inputs[key]
+        before = _value_refs(val)
+        if _is_connection(val) and str(val[0]) == str(target_node_id):
+            if int(val[1]) == int(chosen_output_index):
+                inputs[key] = [replacement[0], int(replacement[1])]
+                index.update_input(consumer, key, before, inputs[key])
+            elif drop_other_refs:
+                del inputs[key]
+                index.update_input(consumer, key, before, None)
             continue
-        for key in list(inputs.keys()):
-            val = inputs[key]
-            if _is_connection(val) and str(val[0]) == str(target_node_id):
-                if int(val[1]) == int(chosen_output_index):
-                    inputs[key] = [replacement[0], int(replacement[1])]
-                elif drop_other_refs:
-                    del inputs[key]
-                continue
-            if isinstance(val, list) and len(val) > 0:
-                new_list = []
-                changed = False
-                for inner in val:
-                    if _is_connection(inner) and str(inner[0]) == str(target_node_id):
-                        if int(inner[1]) == int(chosen_output_index):
-                            new_list.append([replacement[0], int(replacement[1])])
-                            changed = True
-                        elif not drop_other_refs:
-                            new_list.append(inner)
-                    else:
+        if isinstance(val, list) and len(val) > 0:
+            new_list = []
+            changed = False
+            for inner in val:
+                if _is_connection(inner) and str(inner[0]) == str(target_node_id):
+                    if int(inner[1]) == int(chosen_output_index):
+                        new_list.append([replacement[0], int(replacement[1])])
+                        changed = True
+                    elif not drop_other_refs:
                         new_list.append(inner)
-                if changed:
-                    inputs[key] = new_list
+                else:
+                    new_list.append(inner)
+            if changed:
+                inputs[key] = new_list
+                index.update_input(consumer, key, before, new_list)
+
+
+# --- 定数畳み込みの登録表（利用者が register_* で追加できる） ---
+# class_type → 定数値を持つ入力キーの候補（先に見つかったものを使う）。値が接続ならさらに上流を解決する
+CONSTANT_NODE_INPUTS: Dict[str, Tuple[str, ...]] = {
+    "SimpleMathInt+": ("value",),
+    "SimpleMathFloat+": ("value",),
+    "SimpleMathBoolean+": ("value",),
+    "StringConstant": ("string", "value"),
+    "StringConstantMultiline": ("string", "value"),
+    "PrimitiveStringMultiline": ("string", "value"),
+    "PrimitiveInt": ("value",),
+    "PrimitiveFloat": ("value",),
+    "PrimitiveBoolean": ("value",),
+    "PrimitiveString": ("value",),
+    "INTConstant": ("value",),
+    "FloatConstant": ("value",),
+    "ImpactInt": ("value",),
+    "ImpactFloat": ("value",),
+    "Int Literal": ("int",),
+    "Float Literal": ("float",),
+    "mxSlider": ("Xi",),
+}
+
+# 入力キーだけでは表せないノード用: class_type → rule(inputs, output_index, resolve)
+# resolve は入力値（リテラルまたは接続）を定数へ解決する関数。解決できなければ None を返す
+ConstantRule = Callable[[Dict[str, Any], int, Callable[[Any], Any]], Optional[Any]]
+CONSTANT_NODE_RULES: Dict[str, ConstantRule] = {}
+
+# 入力をそのまま出力0へ流すノード: class_type → 入力キー（None なら名前順で最初のデータ入力）
+PASSTHROUGH_NODE_TYPES: Dict[str, Optional[str]] = {
+    "Reroute": None,
+}
+
+# 到達性の起点にする出力ノード。元グラフで誰からも参照されていないノードも起点に含める
+OUTPUT_NODE_TYPES: Set[str] = {
+    "SaveImage",
+    "PreviewImage",
+    "SaveAnimatedWEBP",
+    "SaveAnimatedPNG",
+    "SaveLatent",
+    "VHS_VideoCombine",
+}
+
+
+def register_constant_node(
+    class_type: str, input_keys: Optional[Tuple[str, ...]] = None, rule: Optional[ConstantRule] = None
+) -> None:
+    """定数を出力するノード種別を登録する。input_keys か rule のどちらかを指定する。"""
+    if rule is not None:
+        CONSTANT_NODE_RULES[class_type] = rule
+    elif input_keys:
+        CONSTANT_NODE_INPUTS[class_type] = tuple(input_keys)
+    else:
+        raise ValueError("input_keys か rule を指定してください")
+
+
+def register_passthrough_node(class_type: str, input_key: Optional[str] = None) -> None:
+    """入力をそのまま出力0へ流すノード種別を登録する。"""
+    PASSTHROUGH_NODE_TYPES[class_type] = input_key
+
+
+def register_output_node(class_type: str) -> None:
+    """到達性の起点にする出力ノード種別を登録する。"""
+    OUTPUT_NODE_TYPES.add(class_type)
+
+
+# 式の整数の累乗で許す結果のビット数（"9**9**9" のような式で変換が止まらないように）
+_MATH_POW_MAX_BITS = 4096
+
+
+def _bounded_pow(a: Any, b: Any) -> Any:
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and (abs(a).bit_length() - 1) * b > _MATH_POW_MAX_BITS:
+        raise ValueError(f"too large: {a}**{b}")
+    return a ** b
+
+
+_MATH_BINOPS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.FloorDiv: lambda a, b: a // b,
+    ast.Mod: lambda a, b: a % b,
+    ast.Pow: _bounded_pow,
+}
+
+
+def _eval_math(expr: str, names: Dict[str, Callable[[], Any]]) -> Optional[Any]:
+    """四則演算だけの式を評価する。変数は必要になった時点で names から解決する。
+
+    巨大な整数になる累乗は評価せず None を返す（select は定数で確定できない扱いになる）。
+    """
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError:
+        return None
+
+    def ev(n: ast.AST) -> Any:
+        if isinstance(n, ast.Expression):
+            return ev(n.body)
+        if isinstance(n, ast.Constant) and isinstance(n.value, (int, float)):
+            return n.value
+        if isinstance(n, ast.Name) and n.id in names:
+            val = names[n.id]()
+            if not isinstance(val, (int, float)):
+                raise ValueError(n.id)
+            return val
+        if isinstance(n, ast.BinOp) and type(n.op) in _MATH_BINOPS:
+            return _MATH_BINOPS[type(n.op)](ev(n.left), ev(n.right))
+        if isinstance(n, ast.UnaryOp) and isinstance(n.op, (ast.USub, ast.UAdd)):
+            val = ev(n.operand)
+            return -val if isinstance(n.op, ast.USub) else val
+        raise ValueError(ast.dump(n))
+
+    try:
+        return ev(tree)
+    except (ValueError, ArithmeticError):
+        return None
+
+
+def _simple_math_rule(inputs: Dict[str, Any], output_index: int, resolve: Callable[[Any], Any]) -> Optional[Any]:
+    """SimpleMath+（式 value と a/b/c）。出力0は round した INT、出力1は FLOAT。"""
+    expr = resolve(inputs.get("value"))
+    if not isinstance(expr, str):
+        return None
+    names = {k: (lambda k=k: resolve(inputs.get(k))) for k in ("a", "b", "c")}
+    result = _eval_math(expr, names)
+    if result is None:
+        return None
+    return round(result) if output_index == 0 else float(result)
+
+
+CONSTANT_NODE_RULES["SimpleMath+"] = _simple_math_rule
+
+
+def _resolve_input_value(graph: Dict[str, Any], value: Any, visited: FrozenSet[str] = frozenset()) -> Optional[Any]:
+    """入力値を定数へ解決する。リテラルはそのまま、接続なら上流を辿る。"""
+    if _is_connection(value):
+        return _resolve_constant_value(graph, str(value[0]), int(value[1]), visited)
+    return value
 
 
 def _resolve_constant_value(
-    graph: Dict[str, Any], node_id: str, output_index: int = 0, visited: Optional[Set[str]] = None
+    graph: Dict[str, Any], node_id: str, output_index: int = 0, visited: Optional[FrozenSet[str]] = None
 ) -> Optional[Any]:
-    """上流に遡って定数値を解決。簡易対応のみ。"""
+    """上流に遡って定数値を解決する（登録表の定数・素通しノードと、選択が決まる Switch を辿る）。"""
     if visited is None:
-        visited = set()
+        visited = frozenset()
     if node_id in visited:
         return None
-    visited.add(node_id)
+    # 経路ごとの訪問集合（a と b が同じノードを参照する場合も解決できるように）
+    visited = visited | {node_id}
 
     node = graph.get(str(node_id))
     if not isinstance(node, dict):
@@ -130,42 +396,171 @@ def _resolve_constant_value(
     class_type = node.get("class_type", "")
     inputs: Dict[str, Any] = node.get("inputs", {}) or {}
 
-    # 典型的な定数ホルダ
-    if class_type in {"SimpleMathInt+", "SimpleMathFloat+", "SimpleMathBoolean+"}:
-        if isinstance(inputs.get("value"), (int, float, bool)):
-            return inputs["value"]
-    if class_type in {"StringConstant", "StringConstantMultiline", "PrimitiveStringMultiline"}:
-        val = inputs.get("string", inputs.get("value"))
-        return val
-    if class_type == "mxSlider":
-        xi = inputs.get("Xi")
-        if isinstance(xi, (int, float)):
-            return xi
-
-    # Any Switch は単純に最初のデータ入力へ遡る
-    if "Any Switch" in class_type:
-        conns = _list_connection_inputs(node)
-        if conns:
-            upstream = conns[0][1]
-            return _resolve_constant_value(graph, str(upstream[0]), int(upstream[1]), visited)
-
+    def resolve(value: Any) -> Optional[Any]:
+        return _resolve_input_value(graph, value, visited)
+
+    rule = CONSTANT_NODE_RULES.get(class_type)
+    if rule is not None:
+        return rule(inputs, output_index, resolve)
+    keys = CONSTANT_NODE_INPUTS.get(class_type)
+    if keys:
+        for key in keys:
+            if key in inputs:
+                return resolve(inputs[key])
+        return None
+    if class_type in PASSTHROUGH_NODE_TYPES:
+        upstream = _passthrough_upstream(node)
+        return resolve(upstream) if upstream is not None and output_index == 0 else None
+    if isinstance(class_type, str) and "Switch" in class_type:
+        chosen, resolved = _choose_switch_upstream(graph, node, output_index, visited)
+        if chosen is not None and resolved:
+            return _resolve_constant_value(graph, str(chosen[0]), int(chosen[1]), visited)
     return None
 
 
-def remove_switch_nodes(graph: Dict[str, Any]) -> Dict[str, Any]:
-    """Switch系ノードをバイパスして削除したJSONを返す（汎用検出 + 選択出力考慮）。"""
+def _passthrough_upstream(node_obj: Dict[str, Any]) -> Optional[List[Any]]:
+    """素通しノードの入力接続。"""
+    key = PASSTHROUGH_NODE_TYPES.get(node_obj.get("class_type", ""))
+    if key is not None:
+        conn = (node_obj.get("inputs") or {}).get(key)
+        return [conn[0], int(conn[1])] if _is_connection(conn) else None
+    return _choose_upstream_connection_generic(node_obj)
+
+
+def _inversed_switch_output(sel_val: Any) -> Optional[int]:
+    """ImpactInversedSwitch の select から、入力が流れる出力（0/1）を決める。"""
+    if not isinstance(sel_val, (int, float)):
+        return None
+    idx = int(round(sel_val))
+    # 1/2 指定を 0/1 に補正
+    if idx in (1, 2):
+        idx -= 1
+    return min(max(idx, 0), 1)
+
+
+def _choose_switch_upstream(
+    graph: Dict[str, Any], node_obj: Dict[str, Any], output_index: int = 0, visited: FrozenSet[str] = frozenset()
+) -> Tuple[Optional[List[Any]], bool]:
+    """Switch の output_index に流れる上流接続と、それが select から確定したかどうか。
+
+    select が定数に解決できない場合は最初のデータ入力を返し、確定扱いにしない。
+    """
+    class_type = node_obj.get("class_type", "")
+    inputs: Dict[str, Any] = node_obj.get("inputs", {}) or {}
+    data_conns = _list_connection_inputs(node_obj)
+
+    if "ImpactInversedSwitch" in class_type and data_conns:
+        out = _inversed_switch_output(_resolve_input_value(graph, inputs.get("select"), visited))
+        if out is not None:
+            return (data_conns[0][1] if out == output_index else None), True
+
+    # select を持つSwitch（ImpactSwitchなど）: 定数が取れたらそのインデックス、無ければ最初
+    if "select" in inputs:
+        if not data_conns:
+            return None, False
+        sel_val = _resolve_input_value(graph, inputs.get("select"), visited)
+        if not isinstance(sel_val, (int, float)):
+            return data_conns[0][1], False
+        idx = int(round(sel_val))
+        named = inputs.get(f"input{idx}")
+        if _is_connection(named):
+            chosen = named
+        elif idx >= 1 and idx - 1 < len(data_conns):
+            chosen = data_conns[idx - 1][1]
+        else:
+            idx0 = idx if 0 <= idx < len(data_conns) else 0
+            chosen = data_conns[idx0][1]
+        return [chosen[0], int(chosen[1])], True
+
+    # それ以外は最初のデータ入力（Any Switch は「最初の有効な入力」なので確定扱い）
+    return _choose_upstream_connection_generic(node_obj), "Any Switch" in class_type
+
+
+def find_output_nodes(graph: Dict[str, Any], index: Optional["ConsumerIndex"] = None) -> List[str]:
+    """到達性の起点: 出力ノード種別のノードと、誰からも参照されていないノード。"""
+    if index is None:
+        index = ConsumerIndex(graph)
+    roots: List[str] = []
+    for node_id, node_obj in graph.items():
+        if not isinstance(node_obj, dict):
+            continue
+        if node_obj.get("class_type") in OUTPUT_NODE_TYPES or not index.consumers(str(node_id)):
+            roots.append(str(node_id))
+    return roots
+
+
+def prune_unreachable(
+    graph: Dict[str, Any], roots: Iterable[str], index: Optional["ConsumerIndex"] = None
+) -> List[str]:
+    """roots から入力を遡って到達できないノードをその場で削除し、削除したIDを返す。"""
+    stack = [str(r) for r in roots if str(r) in graph]
+    if not stack:
+        # 起点が1つも残っていなければ何も消さない
+        return []
+    reachable: Set[str] = set(stack)
+    while stack:
+        node_obj = graph.get(stack.pop())
+        if not isinstance(node_obj, dict):
+            continue
+        for value in (node_obj.get("inputs") or {}).values():
+            for src, _slot in _value_refs(value):
+                if src in graph and src not in reachable:
+                    reachable.add(src)
+                    stack.append(src)
+    removed = [node_id for node_id in graph if node_id not in reachable]
+    for node_id in removed:
+        if index is not None:
+            index.remove_node(node_id)
+        del graph[node_id]
+    return removed
+
+
+def remove_blocked_nodes(graph: Dict[str, Any], node_ids: Iterable[str], index: "ConsumerIndex") -> List[str]:
+    """node_ids と、その出力を参照しているノードを下流へ辿ってその場で削除し、削除したIDを返す。"""
+    stack = [str(n) for n in node_ids]
+    removed: List[str] = []
+    while stack:
+        node_id = stack.pop()
+        if node_id not in graph:
+            continue
+        stack.extend(consumer for consumer, _ in index.consumers(node_id))
+        index.remove_node(node_id)
+        del graph[node_id]
+        removed.append(node_id)
+    return removed
+
+
+def remove_switch_nodes(
+    graph: Dict[str, Any], prune: bool = True, roots: Optional[Iterable[str]] = None
+) -> Dict[str, Any]:
+    """Switch系ノードをバイパスして削除したJSONを返す（汎用検出 + 選択出力考慮）。
+
+    select は登録表に従って定数畳み込みして解決する。素通しノードも上流へ繋ぎ替える。
+    ImpactInversedSwitch の選ばれなかった出力を使うノードは、下流ごと削除する。
+    prune=True なら、最後に出力ノード（roots。省略時は入力グラフから求める）へ
+    繋がらなくなったノードを削除する。
+    """
     new_graph: Dict[str, Any] = copy.deepcopy(graph)
+    # 参照の逆引きは1回だけ構築し、置換のたびに差分更新する
+    index = ConsumerIndex(new_graph)
+    root_ids = list(roots) if roots is not None else find_output_nodes(new_graph, index)
 
     # 対象ノード一覧を抽出
     switch_ids: List[str] = []
+    passthrough_ids: List[str] = []
     for node_id, node_obj in new_graph.items():
         if not isinstance(node_obj, dict):
             continue
         class_type = node_obj.get("class_type", "")
         if isinstance(class_type, str) and "Switch" in class_type:
             switch_ids.append(str(node_id))
+        elif class_type in PASSTHROUGH_NODE_TYPES:
+            passthrough_ids.append(str(node_id))
 
     # 置換と削除
+    unresolved: List[str] = []
+    # 選択で片方の出力だけを付け替えた ImpactInversedSwitch（残る参照は選ばれなかった出力のもの）
+    inversed_ids: List[str] = []
     for sid in switch_ids:
         node_obj = new_graph.get(sid)
         if not isinstance(node_obj, dict):
@@ -174,89 +569,235 @@ def remove_switch_nodes(graph: Dict[str, Any]) -> Dict[str, Any]:
         class_type = node_obj.get("class_type", "")
         inputs: Dict[str, Any] = node_obj.get("inputs", {}) or {}
 
-        # ImpactInversedSwitch: select 上流が定数なら、その値で 0/1 出力を決定して選択出力のみ置換
+        # ImpactInversedSwitch: select が定数なら、その値で 0/1 出力を決定して選択出力のみ置換
         if "ImpactInversedSwitch" in class_type:
-            sel_conn = inputs.get("select")
             data_conns = _list_connection_inputs(node_obj)
             inp_conn = data_conns[0][1] if data_conns else None
-
-            sel_val: Optional[Any] = None
-            if _is_connection(sel_conn):
-                sel_val = _resolve_constant_value(new_graph, str(sel_conn[0]), int(sel_conn[1]))
-
-            if inp_conn is not None and isinstance(sel_val, (int, float)):
-                idx = int(round(sel_val))
-                # 1/2 指定を 0/1 に補正
-                if idx in (1, 2):
-                    idx -= 1
-                if idx < 0:
-                    idx = 0
-                if idx > 1:
-                    idx = 1
-                _replace_references_selective(new_graph, sid, idx, [inp_conn[0], int(inp_conn[1])])
-                continue
-
-        # select を持つSwitch（ImpactSwitchなど）: 定数が取れたらそのインデックス、無ければ最初
-        if "select" in inputs:
-            data_conns = _list_connection_inputs(node_obj)
-            if data_conns:
-                sel_conn = inputs.get("select")
-                sel_val: Optional[Any] = None
-                if _is_connection(sel_conn):
-                    sel_val = _resolve_constant_value(new_graph, str(sel_conn[0]), int(sel_conn[1]))
-                if isinstance(sel_val, (int, float)):
-                    idx = int(round(sel_val))
-                    if idx >= 1 and idx - 1 < len(data_conns):
-                        chosen = data_conns[idx - 1][1]
-                    else:
-                        idx0 = idx if 0 <= idx < len(data_conns) else 0
-                        chosen = data_conns[idx0][1]
-                else:
-                    chosen = data_conns[0][1]
-                _replace_all_references(new_graph, sid, [chosen[0], int(chosen[1])])
+            out = _inversed_switch_output(_resolve_input_value(new_graph, inputs.get("select")))
+            if inp_conn is not None and out is not None:
+                _replace_references_selective(new_graph, sid, out, [inp_conn[0], int(inp_conn[1])], index=index)
+                inversed_ids.append(sid)
                 continue
 
-        # それ以外は汎用的に最初のデータ入力へバイパス
-        replacement = _choose_upstream_connection_generic(node_obj)
+        replacement, resolved = _choose_switch_upstream(new_graph, node_obj)
         if replacement is None:
             continue
-        _replace_all_references(new_graph, sid, replacement)
+        if not resolved:
+            unresolved.append(sid)
+        _replace_all_references(new_graph, sid, replacement, index)
+
+    # 素通しノードは出力0の参照を上流へ繋ぎ替える（ノード自体は到達性の掃除で消える）
+    for pid in passthrough_ids:
+        node_obj = new_graph.get(pid)
+        if not isinstance(node_obj, dict):
+            continue
+        upstream = _passthrough_upstream(node_obj)
+        if upstream is not None and upstream[0] != pid:
+            _replace_references_selective(new_graph, pid, 0, upstream, index=index)
+
+    # ImpactInversedSwitch の選ばれなかった出力は ComfyUI では実行を止める値になるので、
+    # それを参照しているノードは下流ごと削除する（削除した Switch への参照を残さない）
+    # 上流を決められなかった Switch への参照はそのまま残す（ワークフローの誤りとして ComfyUI 側で見える）
+    remove_blocked_nodes(new_graph, [c for sid in inversed_ids for c, _ in index.consumers(sid)], index)
 
     # 参照置換が終わってから削除（未参照でも削除）
     for sid in switch_ids:
         if sid in new_graph:
+            index.remove_node(sid)
             del new_graph[sid]
 
+    if prune:
+        prune_unreachable(new_graph, root_ids, index)
+
+    if unresolved:
+        print(
+            f"[remove_switches] 選択を定数で確定できず最初の入力を使用: {', '.join(unresolved)}",
+            file=sys.stderr,
+        )
     return new_graph
 
 
-def transform_json_text(json_text: str) -> str:
-    """JSON文字列を受け取り、Switchノードを除去したJSON文字列を返す。"""
+def transform_json_text(json_text: str, prune: bool = True, indent: Optional[int] = 2) -> str:
+    """JSON文字列を受け取り、Switchノードを除去したJSON文字列を返す。indent=None なら空白なしで出力。"""
     obj = json.loads(json_text)
     if not isinstance(obj, dict):
         raise ValueError("root JSON はオブジェクト(dict)である必要があります")
-    transformed = remove_switch_nodes(obj)
-    return json.dumps(transformed, ensure_ascii=False, indent=2)
+    return _dump_json(remove_switch_nodes(obj, prune=prune), indent)
+
+
+def _dump_json(obj: Any, indent: Optional[int]) -> str:
+    if indent is None:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(obj, ensure_ascii=False, indent=indent)
+
+
+# --- 複数ファイルの一括変換 ---
+MANIFEST_NAME = ".remove_switches_manifest.json"
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def transform_file(src: str, dst: str, prune: bool = True, indent: Optional[int] = 2) -> Tuple[int, int, float]:
+    """src を変換して dst へ書く。(変換前のノード数, 変換後のノード数, 秒) を返す。"""
+    t0 = time.perf_counter()
+    with open(src, "r", encoding="utf-8") as f:
+        obj = json.load(f)
+    if not isinstance(obj, dict):
+        raise ValueError("root JSON はオブジェクト(dict)である必要があります")
+    before = len(obj)
+    transformed = remove_switch_nodes(obj, prune=prune)
+    text = _dump_json(transformed, indent)
+    Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    # 途中で止まっても壊れたファイルを残さないよう、書き終えてから置き換える
+    tmp = f"{dst}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, dst)
+    return before, len(transformed), time.perf_counter() - t0
+
+
+def collect_inputs(patterns: List[str], exclude: Optional[Path] = None) -> List[Tuple[Path, Path]]:
+    """ディレクトリ（配下の *.json）か glob パターンから (入力ファイル, 出力の相対パス) を集める。"""
+    found: Dict[Path, Path] = {}
+    for pattern in patterns:
+        root = Path(pattern)
+        if root.is_dir():
+            matches = [(p, p.relative_to(root)) for p in root.rglob("*.json")]
+        else:
+            base = _glob_base(pattern) if glob.has_magic(pattern) else Path(pattern).parent
+            matches = [(Path(p), Path(p).relative_to(base)) for p in glob.glob(pattern, recursive=True)]
+        for path, rel in matches:
+            if not path.is_file():
+                continue
+            if exclude is not None and exclude.resolve() in path.resolve().parents:
+                continue
+            found.setdefault(path.resolve(), rel)
+    return sorted(((p, rel) for p, rel in found.items()), key=lambda item: str(item[1]))
+
+
+def _glob_base(pattern: str) -> Path:
+    """glob パターンのうち、ワイルドカードを含まない先頭部分（出力の相対パスの基準）。"""
+    parts: List[str] = []
+    for part in Path(pattern).parts:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts) if parts else Path(".")
+
+
+def transform_many(
+    inputs: List[Tuple[Path, Path]],
+    out_dir: Path,
+    prune: bool = True,
+    indent: Optional[int] = 2,
+    jobs: Optional[int] = None,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """inputs をプロセスプールで変換して out_dir へ書く。
+
+    前回と入力の内容（SHA-256）・オプションが同じで出力が残っているファイルは飛ばす。
+    記録は out_dir の MANIFEST_NAME に残す。ファイルごとの結果と集計を返す。
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = out_dir / MANIFEST_NAME
+    try:
+        manifest: Dict[str, Dict[str, str]] = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+    options = f"prune={prune},indent={indent}"
+
+    results: List[Dict[str, Any]] = []
+    todo: List[Tuple[Path, Path, str]] = []
+    for src, rel in inputs:
+        digest = _file_sha256(src)
+        dst = out_dir / rel
+        prev = manifest.get(str(rel))
+        if not force and prev == {"sha256": digest, "options": options} and dst.exists():
+            results.append({"file": str(rel), "status": "unchanged"})
+            continue
+        todo.append((src, dst, digest))
+
+    t0 = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {
+                pool.submit(transform_file, str(src), str(dst), prune, indent): (src, dst, digest)
+                for src, dst, digest in todo
+            }
+            for fut in as_completed(futures):
+                src, dst, digest = futures[fut]
+                rel = str(dst.relative_to(out_dir))
+                try:
+                    before, after, seconds = fut.result()
+                except Exception as e:
+                    results.append({"file": rel, "status": "error", "error": f"{type(e).__name__}: {e}"})
+                    manifest.pop(rel, None)
+                    continue
+                manifest[rel] = {"sha256": digest, "options": options}
+                results.append({"file": rel, "status": "ok", "seconds": seconds, "nodes": [before, after]})
+    manifest_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+
+    counts: Dict[str, int] = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    results.sort(key=lambda r: r["file"])
+    return {"files": results, "counts": counts, "wall_seconds": time.perf_counter() - t0}
+
+
+def _print_summary(summary: Dict[str, Any]) -> None:
+    for r in summary["files"]:
+        if r["status"] == "ok":
+            before, after = r["nodes"]
+            print(f"[remove_switches] {r['file']}  {r['seconds'] * 1000:.1f} ms  nodes {before} -> {after}", file=sys.stderr)
+        elif r["status"] == "error":
+            print(f"[remove_switches] {r['file']}  失敗: {r['error']}", file=sys.stderr)
+    counts = summary["counts"]
+    cpu = sum(r.get("seconds", 0.0) for r in summary["files"])
+    print(
+        f"[remove_switches] 変換 {counts.get('ok', 0)} / 変更なし {counts.get('unchanged', 0)} / "
+        f"失敗 {counts.get('error', 0)}  ({summary['wall_seconds']:.2f} s, 変換時間の合計 {cpu:.2f} s)",
+        file=sys.stderr,
+    )
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Remove/bypass Switch nodes in ComfyUI-style JSON")
-    parser.add_argument("-i", "--input", type=str, default="-", help="入力JSONファイルパス。'-' でstdin")
-    parser.add_argument("-o", "--output", type=str, default="-", help="出力JSONファイルパス。'-' でstdout")
+    parser.add_argument("-i", "--input", type=str, default="-", help="入力JSONファイルパス。'-' でstdin。ディレクトリなら配下の *.json をまとめて変換")
+    parser.add_argument("-o", "--output", type=str, default="-", help="出力JSONファイルパス。'-' でstdout。一括変換では出力先ディレクトリ")
+    parser.add_argument("--glob", action="append", default=[], help="まとめて変換する入力の glob パターン（複数指定可、** 可）")
+    parser.add_argument("--no-prune", action="store_true", help="出力へ繋がらなくなったノードを削除しない")
+    parser.add_argument("--compact", action="store_true", help="空白なしの1行で出力する（既定は indent=2）")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="一括変換の並列プロセス数（既定: CPU数）")
+    parser.add_argument("--force", action="store_true", help="一括変換で、前回から変わっていないファイルも変換し直す")
     args = parser.parse_args()
+    indent: Optional[int] = None if args.compact else 2
+
+    if args.glob or (args.input != "-" and Path(args.input).is_dir()):
+        if args.output == "-":
+            parser.error("一括変換では -o に出力先ディレクトリを指定してください")
+        out_dir = Path(args.output)
+        patterns = list(args.glob) + ([args.input] if args.input != "-" else [])
+        inputs = collect_inputs(patterns, exclude=out_dir)
+        summary = transform_many(inputs, out_dir, prune=not args.no_prune, indent=indent, jobs=args.jobs, force=args.force)
+        _print_summary(summary)
+        sys.exit(1 if summary["counts"].get("error") else 0)
 
     # 入力読み込み
     if args.input == "-":
         in_text = input() if False else None  # type: ignore[unreachable]
         # 上記は型チェック回避のためのダミー。実際は下でstdin全体を読む。
-        import sys
-
         in_text = sys.stdin.read()
     else:
         with open(args.input, "r", encoding="utf-8") as f:
             in_text = f.read()
 
-    out_text = transform_json_text(in_text)
+    out_text = transform_json_text(in_text, prune=not args.no_prune, indent=indent)
 
     if args.output == "-":
         print(out_text)
@@ -267,5 +808,3 @@ def main() -> None:
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,223 @@
+"""完了したプロンプトの出力（画像・動画）を /view から回収する。
+
+ComfyUI の出力フォルダはサーバ側にあり、GPU マシンが別なら手元から見えない。/history の
+outputs に載ったファイルを /view でダウンロードし、output_dir の下に入力画像と同じ相対パスで置く
+（input_dir/realistic/r1.png の出力は output_dir/realistic/r1.png、複数あれば r1_01.png, r1_02.mp4 …）。
+
+- ダウンロードは ComfyClient のイベントループ上で、同時に concurrency 件まで
+- 本体は chunk_size ずつファイルへ書き、動画でも全体をメモリに載せない
+- 受信しながら SHA-256 を計算し、書き終えたファイルを読み直して一致を確かめる
+- 回収したファイルは output_dir/collected.jsonl に1行ずつ記録し、再起動後は記録済みのものを取り直さない
+
+複数の画像をまとめたプロンプトは、出力ノードごとのファイル数が画像数で割り切れれば先頭から
+画像の順に割り当てる（割り切れなければ先頭の画像の出力として置く）。
+"""
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from comfy_http import ComfyClient
+from image_upload import file_sha256
+from scheduler import Job
+
+MANIFEST_NAME = "collected.jsonl"
+
+
+def history_files(entry: Optional[Dict[str, Any]], types: Sequence[str] = ("output",)) -> List[Tuple[str, Dict[str, Any]]]:
+    """/history の outputs から (出力ノードID, {"filename", "subfolder", "type"}) を出力ノード順に列挙する。
+
+    SaveImage の images、VHS_VideoCombine の gifs など、filename を持つ項目の配列をすべて拾う。
+    """
+    files: List[Tuple[str, Dict[str, Any]]] = []
+    outputs = (entry or {}).get("outputs") or {}
+    if not isinstance(outputs, dict):
+        return files
+    for node_id, node_out in outputs.items():
+        if not isinstance(node_out, dict):
+            continue
+        for items in node_out.values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                if isinstance(item, dict) and item.get("filename") and item.get("type", "output") in types:
+                    files.append((str(node_id), item))
+    return files
+
+
+class ResultCollector:
+    """Scheduler.add_result_handler に collect を渡して使う。"""
+
+    def __init__(
+        self,
+        http: ComfyClient,
+        output_dir: str,
+        input_dir: str,
+        concurrency: int = 4,
+        types: Sequence[str] = ("output",),
+        verify: bool = True,
+        chunk_size: int = 1 << 20,
+    ) -> None:
+        self.http = http
+        self.root = Path(output_dir).resolve()
+        self.input_dir = Path(input_dir).resolve()
+        self.concurrency = max(1, int(concurrency))
+        self.types = tuple(types)
+        self.verify = verify
+        self.chunk_size = chunk_size
+        self.manifest_path = self.root / MANIFEST_NAME
+        # 回収済み: (prompt_id, サーバ上の subfolder/filename)
+        self._done: Set[Tuple[str, str]] = set()
+        self._load_manifest()
+        # 以下はイベントループのスレッドだけが触る（集計値の読み取りは report から）
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._claimed: Set[Path] = set()
+        self._lock = threading.Lock()
+        self.backlog = 0
+        self.active = 0
+        self.files = 0
+        self.bytes = 0
+        self.failed = 0
+        self.skipped = 0
+        # ダウンロードが1件以上動いていた時間（スループットの分母）
+        self.busy_time = 0.0
+        self._busy_since: Optional[float] = None
+        self._idle = threading.Event()
+        self._idle.set()
+
+    def _load_manifest(self) -> None:
+        if not self.manifest_path.exists():
+            return
+        with open(self.manifest_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    self._done.add((str(row["prompt_id"]), str(row["source"])))
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    # --- 呼び出し側スレッド ---
+    def _member_dir(self, path: Path) -> Tuple[Path, str]:
+        """入力画像に対応する出力先ディレクトリと、ファイル名の元になる stem。"""
+        resolved = Path(path).resolve()
+        try:
+            rel = resolved.relative_to(self.input_dir)
+        except ValueError:
+            rel = Path(resolved.name)
+        return self.root / rel.parent, rel.stem
+
+    def _assign(self, job: Job, files: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[Job, List[Dict[str, Any]]]]:
+        members = job.members()
+        per_member: List[List[Dict[str, Any]]] = [[] for _ in members]
+        by_node: Dict[str, List[Dict[str, Any]]] = {}
+        for node_id, item in files:
+            by_node.setdefault(node_id, []).append(item)
+        for items in by_node.values():
+            if len(members) > 1 and len(items) % len(members) == 0:
+                step = len(items) // len(members)
+                for i in range(len(members)):
+                    per_member[i].extend(items[i * step:(i + 1) * step])
+            else:
+                per_member[0].extend(items)
+        return [(m, items) for m, items in zip(members, per_member) if items]
+
+    def collect(self, job: Job, status: str, entry: Optional[Dict[str, Any]]) -> None:
+        """成功したプロンプトの出力のダウンロードを始める（待たない）。"""
+        if status != "success" or job.backend is None or job.prompt_id is None:
+            return
+        files = history_files(entry, self.types)
+        for member, items in self._assign(job, files):
+            out_dir, stem = self._member_dir(member.path)
+            for n, item in enumerate(items, start=1):
+                source = f"{item.get('subfolder') or ''}/{item['filename']}".lstrip("/")
+                if (job.prompt_id, source) in self._done:
+                    self.skipped += 1
+                    continue
+                suffix = Path(str(item["filename"])).suffix
+                name = f"{stem}{suffix}" if len(items) == 1 else f"{stem}_{n:02d}{suffix}"
+                with self._lock:
+                    self.backlog += 1
+                    self._idle.clear()
+                self.http.spawn(self._download(job.backend, job.prompt_id, member.path, item, source, out_dir / name))
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """始めたダウンロードがすべて終わるまで待つ。終わっていれば True。"""
+        return self._idle.wait(timeout)
+
+    # --- イベントループ側 ---
+    def _unique(self, dest: Path) -> Path:
+        """同じ実行中に別のプロンプトが同じ入力の出力を置いた場合（再投入など）は番号を付けて避ける。"""
+        candidate = dest
+        i = 1
+        while candidate in self._claimed:
+            candidate = dest.with_name(f"{dest.stem}~{i}{dest.suffix}")
+            i += 1
+        self._claimed.add(candidate)
+        return candidate
+
+    async def _download(
+        self, base: str, prompt_id: str, input_path: Path, item: Dict[str, Any], source: str, dest: Path
+    ) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        dest = self._unique(dest)
+        try:
+            async with self._semaphore:
+                if self.active == 0:
+                    self._busy_since = time.time()
+                self.active += 1
+                try:
+                    await loop.run_in_executor(None, lambda: dest.parent.mkdir(parents=True, exist_ok=True))
+                    size, digest = await self.http.aio.download(
+                        base,
+                        str(item["filename"]),
+                        dest,
+                        subfolder=str(item.get("subfolder") or ""),
+                        folder_type=str(item.get("type") or "output"),
+                        chunk_size=self.chunk_size,
+                    )
+                    if self.verify:
+                        on_disk = await loop.run_in_executor(None, file_sha256, dest, self.chunk_size)
+                        if on_disk != digest:
+                            raise OSError(f"checksum mismatch: received {digest[:12]}, on disk {on_disk[:12]}")
+                finally:
+                    self.active -= 1
+                    if self.active == 0 and self._busy_since is not None:
+                        self.busy_time += time.time() - self._busy_since
+                        self._busy_since = None
+            row = {
+                "prompt_id": prompt_id,
+                "source": source,
+                "input": str(input_path),
+                "path": str(dest),
+                "bytes": size,
+                "sha256": digest,
+            }
+            await loop.run_in_executor(None, self._append_manifest, row)
+            self._done.add((prompt_id, source))
+            self.files += 1
+            self.bytes += size
+        except Exception as e:
+            self.failed += 1
+            print(f"[collect error] {base} prompt_id={prompt_id} {source}: {e}")
+        finally:
+            with self._lock:
+                self.backlog -= 1
+                if self.backlog == 0:
+                    self._idle.set()
+
+    def _append_manifest(self, row: Dict[str, Any]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def report(self) -> str:
+        busy = self.busy_time + (time.time() - self._busy_since if self._busy_since is not None else 0.0)
+        rate = self.bytes / busy / 1048576 if busy > 0 else 0.0
+        return (
+            f"[collect] files={self.files} ({self.bytes / 1048576:.1f} MiB, {rate:.1f} MiB/s) "
+            f"backlog={self.backlog} active={self.active} skipped={self.skipped} failed={self.failed}"
+        )
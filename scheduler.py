@@ -0,0 +1,643 @@
+"""複数の ComfyUI バックエンドへジョブを振り分けるスケジューラ。
+
+各バックエンドの /queue を見て空きがあるものへ投入する。振り分け先は
+観測した実行時間（EMA）と待ち数から「次のジョブが終わるまでの見込み時間」が
+最小のものを選ぶ。/queue に連続して失敗したバックエンドは停止扱いとし、
+そこへ投入済みで未完了のジョブは別のバックエンドへ再投入する。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import wait as wait_futures
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set
+
+from comfy_events import ComfyEventListener
+from job_ledger import JobLedger, history_status
+from job_metrics import JobMetrics, history_exec_window
+
+if TYPE_CHECKING:
+    from queue_depth import QueueDepthController
+
+_END = object()
+
+
+class Job:
+    """投入単位。index は LoadImagesFromFolderKJ の start_index。
+
+    複数の画像を1つのプロンプトにまとめた場合は batch にまとめた Job 群（先頭は index/path と同じ）を持つ。
+    """
+
+    __slots__ = (
+        "index", "path", "signature", "prompt_id", "backend", "submitted_at", "attempts", "timings", "batch", "lane"
+    )
+
+    def __init__(self, index: int, path: Path) -> None:
+        self.index = index
+        self.path = path
+        # スキップ集合の署名（計画段で分かっていれば。モデルの組み合わせの同一性判定に使う）
+        self.signature: Optional[str] = None
+        self.prompt_id: Optional[str] = None
+        self.backend: Optional[str] = None
+        self.submitted_at: Optional[float] = None
+        self.attempts = 0
+        # build / submit / queued / started / finished の時刻（job_metrics.STAGES 参照）
+        self.timings: Dict[str, float] = {}
+        self.batch: List["Job"] = []
+        # 優先度レーンの名前（priority_lanes で振り分けたとき）
+        self.lane: Optional[str] = None
+
+    def members(self) -> List["Job"]:
+        """このプロンプトで処理する画像ごとの Job（まとめていなければ自分だけ）。"""
+        return self.batch if self.batch else [self]
+
+
+def iter_jobs(paths: Iterable[Optional[Path]]) -> Iterator[Optional[Job]]:
+    """パス列を Job 列へ。None（まだ入力が無い）はそのまま None として流す。"""
+    index = 0
+    for path in paths:
+        if path is None:
+            yield None
+            continue
+        yield Job(index, path)
+        index += 1
+
+
+def _queue_prompt_ids(q: Dict[str, Any], key: str) -> List[str]:
+    """/queue の queue_running / queue_pending から prompt_id を取り出す。"""
+    ids: List[str] = []
+    for item in q.get(key, []) or []:
+        try:
+            ids.append(str(item[1]))
+        except (TypeError, IndexError):
+            continue
+    return ids
+
+
+class Backend:
+    """1つの ComfyUI プロセスの観測状態。"""
+
+    def __init__(self, url: str, max_pending: int = 1) -> None:
+        self.url = url
+        self.alive = True
+        self.failures = 0
+        # 空き判定: queue_pending がこの数未満なら投入できる（従来は 0 件のときだけ = 1）
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        # 回収待ちの /queue 問い合わせ（Future / 結果 / 例外）と、それを出した時刻
+        self.queue_request: Any = None
+        self.queue_requested_at: Optional[float] = None
+        # 直近の /queue に載っていた prompt_id（実行中 + 待機中）と、そのうち実行中のもの
+        self.queued_ids: Set[str] = set()
+        self.running_ids: Set[str] = set()
+        # 自分が投入してまだ完了を確認していないジョブ
+        self.inflight: Dict[str, Job] = {}
+        self.completed = 0
+        self.ema_exec: Optional[float] = None
+        # 直前に投入したジョブの署名（同じモデル構成を続けて送るための親和性判定）
+        self.last_signature: Optional[str] = None
+        self.listener: Optional[ComfyEventListener] = None
+        # websocket から得た実行開始/終了時刻（受信スレッドが書く）
+        self._lock = threading.Lock()
+        self._started_at: Dict[str, float] = {}
+        self._finished_at: Dict[str, float] = {}
+        # 稼働率: 直前のサンプルで実行中だったなら、その間は busy とみなす
+        self.busy_time = 0.0
+        self.observed_time = 0.0
+        self._last_sample: Optional[float] = None
+        self._last_busy = False
+
+    def on_event(self, ev_type: str, data: Dict[str, Any]) -> None:
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        with self._lock:
+            if ev_type == "execution_start":
+                self._started_at[str(prompt_id)] = time.time()
+            elif ev_type in ("execution_success", "execution_error", "execution_interrupted"):
+                self._finished_at[str(prompt_id)] = time.time()
+
+    def has_capacity(self) -> bool:
+        return self.alive and self.pending < self.max_pending
+
+    def expected_finish(self, default_exec: float) -> float:
+        """ここへ今投入した場合に、そのジョブが終わるまでの見込み秒数。"""
+        ema = self.ema_exec if self.ema_exec is not None else default_exec
+        return (self.pending + self.running + 1) * ema
+
+    def utilization(self) -> float:
+        return self.busy_time / self.observed_time if self.observed_time > 0 else 0.0
+
+    def update(self, q: Dict[str, Any], now: float, requested_at: Optional[float] = None) -> List[Job]:
+        """/queue の結果を反映し、完了を確認できた自分のジョブを返す。
+
+        requested_at は問い合わせを出した時刻。それより後に投入したジョブは結果に載っていなくても
+        完了とみなさない（間に合わなかった問い合わせを後の refresh で回収した場合）。
+        """
+        running_ids = _queue_prompt_ids(q, "queue_running")
+        pending_ids = _queue_prompt_ids(q, "queue_pending")
+        in_queue = set(running_ids) | set(pending_ids)
+        newer = [
+            prompt_id
+            for prompt_id, job in self.inflight.items()
+            if prompt_id not in in_queue
+            and requested_at is not None
+            and job.submitted_at is not None
+            and job.submitted_at >= requested_at
+        ]
+        # 問い合わせより後に投入したものは、まだ待機中として数える
+        self.pending = len(pending_ids) + len(newer)
+        self.running = len(running_ids)
+        self.failures = 0
+        self.alive = True
+
+        if self._last_sample is not None:
+            dt = now - self._last_sample
+            self.observed_time += dt
+            if self._last_busy:
+                self.busy_time += dt
+        self._last_sample = now
+        self._last_busy = bool(running_ids)
+
+        self.queued_ids = in_queue | set(newer)
+        self.running_ids = set(running_ids)
+        done: List[Job] = []
+        for prompt_id, job in list(self.inflight.items()):
+            if prompt_id in self.queued_ids:
+                if prompt_id in running_ids:
+                    with self._lock:
+                        self._started_at.setdefault(prompt_id, now)
+                continue
+            # キューから消えた = 完了（成功/失敗は問わない）
+            del self.inflight[prompt_id]
+            done.append(job)
+            with self._lock:
+                started = self._started_at.pop(prompt_id, None)
+                finished = self._finished_at.pop(prompt_id, now)
+            job.timings["finished"] = finished
+            if started is not None and finished >= started:
+                job.timings["started"] = started
+                duration = finished - started
+                self.ema_exec = duration if self.ema_exec is None else 0.7 * self.ema_exec + 0.3 * duration
+            self.completed += 1
+        return done
+
+    def withdraw(self, prompt_id: str) -> Optional[Job]:
+        """取り消したプロンプトを完了待ちから外して返す（自分のものでなければ None）。"""
+        job = self.inflight.pop(prompt_id, None)
+        if job is None:
+            return None
+        self.queued_ids.discard(prompt_id)
+        self.running_ids.discard(prompt_id)
+        with self._lock:
+            self._started_at.pop(prompt_id, None)
+            self._finished_at.pop(prompt_id, None)
+        return job
+
+    def mark_failure(self, down_after: int) -> List[Job]:
+        """/queue 失敗を記録。停止と判定したら投入済みジョブを返す（再投入用）。"""
+        self.failures += 1
+        self._last_sample = None
+        if self.failures < down_after:
+            return []
+        if self.alive:
+            print(f"[backend down] {self.url} ({len(self.inflight)} job(s) will be re-routed)")
+        self.alive = False
+        self.pending = 0
+        self.running = 0
+        self.queued_ids = set()
+        self.running_ids = set()
+        rerouted: List[Job] = list(self.inflight.values())
+        self.inflight.clear()
+        with self._lock:
+            self._started_at.clear()
+            self._finished_at.clear()
+        return rerouted
+
+
+class Scheduler:
+    """ジョブ列を複数バックエンドへ流し込む。submit/get_queue_status は loop.py の関数を渡す。
+
+    submit_fn(index, path, backend_url, timings, batch) は prompt_id を返す。timings には
+    組み立てを終えて送信を始めた時刻を "submit" として書き込む。batch は複数の画像を
+    1つのプロンプトにまとめたときのパス一覧（まとめていなければ None）。
+    """
+
+    def __init__(
+        self,
+        backend_urls: List[str],
+        submit_fn: Callable[[int, Path, str, Dict[str, float], Optional[List[Path]]], str],
+        queue_fn: Callable[[str], Any],
+        client_id: str,
+        use_websocket: bool = True,
+        down_after: int = 3,
+        report_interval: float = 60.0,
+        history_fn: Optional[Callable[[str, str], Dict[str, Any]]] = None,
+        ledger: Optional[JobLedger] = None,
+        max_attempts: int = 3,
+        refresh_wait: float = 0.5,
+        metrics: Optional[JobMetrics] = None,
+        depth: Optional["QueueDepthController"] = None,
+    ) -> None:
+        self.backends = [Backend(url) for url in backend_urls]
+        self.metrics = metrics
+        # 待ち数の制御器（queue_depth.QueueDepthController）。無ければ max_pending は 1 のまま
+        self.depth = depth
+        if metrics is not None:
+            metrics.set_backends(backend_urls)
+        self.submit_fn = submit_fn
+        self.queue_fn = queue_fn
+        self.history_fn = history_fn
+        self.ledger = ledger
+        self.max_attempts = max_attempts
+        self.refresh_wait = refresh_wait
+        self.down_after = down_after
+        self.report_interval = report_interval
+        self.retry: Deque[Job] = deque()
+        self.wake = threading.Event()
+        self._last_report = time.time()
+        self._reporters: List[Callable[[], str]] = []
+        self._finish_handlers: List[Callable[[Job], None]] = []
+        self._result_handlers: List[Callable[[Job, str, Optional[Dict[str, Any]]], None]] = []
+        # (handler, 間隔, 前回呼んだ時刻)
+        self._periodic: List[List[Any]] = []
+        if depth is not None:
+            self._finish_handlers.append(depth.observe_finish)
+        if use_websocket:
+            for be in self.backends:
+                listener = ComfyEventListener(be.url, client_id, wake=self.wake)
+                listener.add_handler(be.on_event)
+                if listener.start():
+                    be.listener = listener
+
+    def inflight_count(self) -> int:
+        return sum(len(be.inflight) for be in self.backends)
+
+    def refresh(self, block: bool = False) -> None:
+        """全バックエンドの /queue を確認し、完了・停止を反映する。
+
+        queue_fn が Future を返す場合は全バックエンドへ並行して問い合わせ、最大 refresh_wait 秒だけ
+        待つ（block なら全部の結果が揃うまで待つ）。再試行中などで間に合わなかった問い合わせは
+        次回の refresh で回収する（止まったバックエンドが他への投入を遅らせないように）。
+        その間に投入したジョブは、問い合わせを出した時刻と比べて完了の判定から外す。
+        """
+        for be in self.backends:
+            if be.queue_request is None:
+                be.queue_requested_at = time.time()
+                try:
+                    be.queue_request = self.queue_fn(be.url)
+                except Exception as e:
+                    be.queue_request = e
+        outstanding = [be.queue_request for be in self.backends if isinstance(be.queue_request, Future)]
+        if outstanding:
+            wait_futures(outstanding, timeout=None if block else self.refresh_wait)
+        for be in self.backends:
+            result = be.queue_request
+            if isinstance(result, Future):
+                if not result.done():
+                    continue
+                try:
+                    result = result.result()
+                except Exception as e:
+                    result = e
+            be.queue_request = None
+            if isinstance(result, Exception):
+                if be.alive:
+                    # 停止判定後は復帰まで黙って再試行する
+                    print(f"[queue check error] {be.url}: {result}")
+                    self._count_error("queue_check")
+                self._reroute(be)
+                continue
+            for job in be.update(result, time.time(), be.queue_requested_at):
+                self._finish(be, job)
+
+    def _count_error(self, kind: str) -> None:
+        if self.metrics is not None:
+            self.metrics.count_error(kind)
+
+    def _run_finish_handlers(self, job: Job) -> None:
+        for handler in self._finish_handlers:
+            try:
+                handler(job)
+            except Exception as e:
+                print(f"[finish handler error] index={job.index}: {e}")
+
+    def _requeue(self, job: Job, front: bool = False) -> None:
+        job.prompt_id = None
+        job.backend = None
+        if front:
+            self.retry.appendleft(job)
+        else:
+            self.retry.append(job)
+
+    def _reroute(self, be: Backend) -> None:
+        """/queue の失敗を数え、停止と判定したらそこへ投入済みのジョブを再投入に回す。"""
+        for job in be.mark_failure(self.down_after):
+            # キューから消えたジョブと同じく、prompt_id を消す前に後始末させる
+            self._run_finish_handlers(job)
+            self._requeue(job, front=True)
+
+    def _finish(self, be: Backend, job: Job) -> None:
+        """キューから消えたジョブの結果を記録し、add_finish_handler の関数を呼ぶ。"""
+        requeue = False
+        try:
+            requeue = self._record_result(be, job)
+        finally:
+            # 実行時間は /history の値で補正した後に、prompt_id を残したまま渡す
+            self._run_finish_handlers(job)
+        if requeue:
+            self._requeue(job)
+
+    def _record_result(self, be: Backend, job: Job) -> bool:
+        """キューから消えたジョブの結果を /history で確認し、台帳と集計へ記録する。投入し直すなら True。"""
+        members = job.members()
+        if self.history_fn is None or job.prompt_id is None:
+            if self.metrics is not None:
+                for _ in members:
+                    self.metrics.record("done", be.url, job.timings)
+            return False
+        try:
+            entry = (self.history_fn(be.url, job.prompt_id) or {}).get(job.prompt_id)
+        except Exception as e:
+            # 結果不明のまま submitted で残す（次回起動時に再確認）
+            print(f"[history error] {be.url} prompt_id={job.prompt_id}: {e}")
+            self._count_error("history")
+            return False
+        status, message = history_status(entry)
+        # 実行時間はサーバが記録した値を優先する（終了時刻はこちらで観測した時刻のまま）
+        window = history_exec_window(entry)
+        if window is not None and "finished" in job.timings:
+            job.timings["started"] = job.timings["finished"] - (window[1] - window[0])
+        for member in members:
+            print(f"[{status}] index={member.index} file={member.path} prompt_id={job.prompt_id}" + (f" ({message})" if message else ""))
+            if self.ledger is not None:
+                self.ledger.record_finished(member.path, job.prompt_id, status, message)
+            # images/hour は画像単位で数える（まとめたプロンプトは同じ時刻を画像数ぶん記録する）
+            if self.metrics is not None:
+                self.metrics.record(status, be.url, job.timings)
+        self._notify_result(job, status, entry)
+        return status == "lost" and job.attempts < self.max_attempts
+
+    def resume(self) -> None:
+        """前回 submitted のまま終わったジョブの行方を確認する。
+
+        履歴にあれば結果を記録、まだキューにあれば完了監視を引き継ぎ、どちらにも無ければ lost
+        （入力の走査で再び見つかった時点で再投入される）。/queue の結果は全バックエンドぶん揃うまで待ち、
+        それでも確認できなかったバックエンドのジョブは行方不明とせず完了監視を引き継ぐ（後の refresh で
+        完了を確認するか、停止と判定されたら再投入する）。
+        """
+        if self.ledger is None:
+            return
+        rows = self.ledger.inflight_rows()
+        if not rows:
+            return
+        self.refresh(block=True)
+        by_url = {be.url: be for be in self.backends}
+        adopted = 0
+        unknown = 0
+        # 停止中に終わっていたプロンプト: prompt_id → (結果, 履歴, 画像ごとの Job)
+        finished: Dict[str, Any] = {}
+        for path_str, index, prompt_id, backend_url in rows:
+            path = Path(path_str)
+            be = by_url.get(backend_url)
+            if be is None:
+                self.ledger.record_finished(path, prompt_id, "lost")
+                continue
+            if be.failures:
+                unknown += 1
+            if prompt_id in be.queued_ids or be.failures:
+                job = Job(int(index), path)
+                job.prompt_id = prompt_id
+                job.backend = be.url
+                job.attempts = 1
+                adopted += 1
+                head = be.inflight.get(prompt_id)
+                if head is not None:
+                    # 複数の画像をまとめたプロンプト: 同じ prompt_id の行を1つのジョブへ戻す
+                    if not head.batch:
+                        head.batch = [head]
+                    head.batch.append(job)
+                    continue
+                be.inflight[prompt_id] = job
+                continue
+            try:
+                entry = (self.history_fn(be.url, prompt_id) or {}).get(prompt_id) if self.history_fn else None
+            except Exception:
+                entry = None
+            status, message = history_status(entry)
+            self.ledger.record_finished(path, prompt_id, status, message)
+            job = Job(int(index), path)
+            job.prompt_id = prompt_id
+            job.backend = be.url
+            finished.setdefault(prompt_id, (status, entry, []))[2].append(job)
+        for status, entry, members in finished.values():
+            head = members[0]
+            if len(members) > 1:
+                head.batch = members
+            self._notify_result(head, status, entry)
+        print(
+            f"[resume] {len(rows)} unfinished job(s) from last run, {adopted} still queued"
+            + (f" ({unknown} on backends whose queue could not be checked)" if unknown else "")
+        )
+
+    def _default_exec(self) -> float:
+        known = [be.ema_exec for be in self.backends if be.ema_exec is not None]
+        # 未観測のバックエンドは平均値で見積もる（全く無ければ 0 で均等に試す）
+        return sum(known) / len(known) if known else 0.0
+
+    def add_reporter(self, reporter: Callable[[], str]) -> None:
+        """report() のたびに1行出力する関数を追加する。"""
+        self._reporters.append(reporter)
+
+    def add_finish_handler(self, handler: Callable[[Job], None]) -> None:
+        """ジョブがバックエンドのキューから消えたとき（成否を問わず）に呼ぶ関数を追加する。
+
+        再投入されるジョブ（停止したバックエンドから振り替えるものを含む）でも呼ばれるので、handler は
+        次の submit_fn で元に戻せる後始末だけを行うこと。job.prompt_id は消えたプロンプトのまま渡す。
+        投入に失敗し続けて諦めたジョブでも prompt_id=None で呼ぶ。
+        """
+        self._finish_handlers.append(handler)
+
+    def add_result_handler(self, handler: Callable[[Job, str, Optional[Dict[str, Any]]], None]) -> None:
+        """/history で結果を確認できたときに handler(job, status, 履歴の項目) を呼ぶ。
+
+        前回の実行中に終わっていたプロンプトも resume() で同じように渡す（ファイルの回収など用）。
+        """
+        self._result_handlers.append(handler)
+
+    def add_periodic(self, handler: Callable[[], None], interval: float) -> None:
+        """run() の周回ごとに、前回から interval 秒以上経っていれば handler() を呼ぶ。"""
+        self._periodic.append([handler, float(interval), time.time()])
+
+    def _run_periodic(self) -> None:
+        now = time.time()
+        for entry in self._periodic:
+            handler, interval, last = entry
+            if now - last < interval:
+                continue
+            entry[2] = now
+            try:
+                handler()
+            except Exception as e:
+                print(f"[periodic handler error] {e}")
+
+    def cancel(self, be: Backend, prompt_id: str, reason: str, requeue: Optional[Job] = None) -> Optional[Job]:
+        """取り消した（キューから削除・中断した）プロンプトを完了待ちから外し、台帳に cancelled と記録する。
+
+        add_finish_handler の関数も呼ぶ（ステージしたディレクトリの片付けなど）。requeue を渡すと
+        投入し直す（入力が差し替えられた場合など）。外したジョブを返す。
+        """
+        job = be.withdraw(prompt_id)
+        if job is None:
+            return None
+        for member in job.members():
+            print(f"[cancelled] index={member.index} file={member.path} prompt_id={prompt_id} ({reason})")
+            if self.ledger is not None:
+                self.ledger.record_finished(member.path, prompt_id, "cancelled", reason)
+        self._run_finish_handlers(job)
+        if requeue is not None:
+            requeue.timings = {}
+            self._requeue(requeue)
+        return job
+
+    def _notify_result(self, job: Job, status: str, entry: Optional[Dict[str, Any]]) -> None:
+        for handler in self._result_handlers:
+            try:
+                handler(job, status, entry)
+            except Exception as e:
+                print(f"[result handler error] index={job.index}: {e}")
+
+    def pick_backend(self, job: Optional[Job] = None) -> Optional[Backend]:
+        candidates = [be for be in self.backends if be.has_capacity()]
+        if not candidates:
+            return None
+        default_exec = self._default_exec()
+        signature = job.signature if job is not None else None
+
+        def _key(be: Backend) -> tuple:
+            # 見込み時間が同じなら、直前と同じモデル構成のバックエンドを優先
+            same_model = signature is not None and be.last_signature == signature
+            return (be.expected_finish(default_exec), 0 if same_model else 1, be.pending)
+
+        return min(candidates, key=_key)
+
+    def dispatch(self, jobs: Iterator[Optional[Job]]) -> bool:
+        """空いているバックエンドへ投入できるだけ投入する。ジョブが尽きたら False。
+
+        jobs が None を返したら「今は投入できるジョブが無い」とみなして戻る。
+        """
+        if self.depth is not None:
+            for be in self.backends:
+                be.max_pending = self.depth.target(be.url, be.ema_exec)
+        while True:
+            if not any(be.has_capacity() for be in self.backends):
+                return True
+            if self.retry:
+                job = self.retry.popleft()
+            else:
+                job = next(jobs, _END)
+                if job is _END:
+                    return False
+                if job is None:
+                    return True
+            be = self.pick_backend(job)
+            if be is None:
+                self.retry.appendleft(job)
+                return True
+            job.attempts += 1
+            job.timings = {"build": time.time()}
+            try:
+                batch = [m.path for m in job.batch] if job.batch else None
+                prompt_id = self.submit_fn(job.index, job.path, be.url, job.timings, batch)
+            except OSError as e:
+                # 入力の読み込み・ステージングなど手元の失敗はバックエンドのせいにせず、後回しにして他を進める
+                print(f"[submit error] index={job.index} file={job.path}: {e}")
+                if not self._give_up(be, job, e):
+                    self.retry.append(job)
+                return True
+            except Exception as e:
+                print(f"[submit error] {be.url} index={job.index}: {e}")
+                self._count_error("submit")
+                if not self._give_up(be, job, e):
+                    self.retry.appendleft(job)
+                self._reroute(be)
+                # 同じバックエンドへ即座に再送しないよう、一旦 refresh まで待つ
+                be.pending = be.max_pending
+                return True
+            job.prompt_id = prompt_id
+            job.backend = be.url
+            job.submitted_at = time.time()
+            job.timings["queued"] = job.submitted_at
+            if self.depth is not None:
+                self.depth.observe_submit(be.url, job.submitted_at - job.timings["build"])
+            be.inflight[prompt_id] = job
+            be.pending += 1
+            be.last_signature = job.signature
+            if self.ledger is not None:
+                for member in job.members():
+                    self.ledger.record_submitted(member.path, member.index, prompt_id, be.url)
+
+    def _give_up(self, be: Backend, job: Job, error: Exception) -> bool:
+        """投入の失敗が max_attempts 回に達したジョブを error として記録し、True を返す。"""
+        if job.attempts < self.max_attempts:
+            return False
+        message = f"submit failed: {error}"
+        for member in job.members():
+            print(f"[error] index={member.index} file={member.path} ({message})")
+            if self.ledger is not None:
+                self.ledger.record_failed(member.path, member.index, message)
+            if self.metrics is not None:
+                self.metrics.record("error", be.url, job.timings)
+        self._run_finish_handlers(job)
+        return True
+
+    def wait(self, poll_interval: float) -> None:
+        """いずれかのバックエンドの空きイベントか poll_interval まで待つ。"""
+        self.wake.wait(poll_interval)
+        self.wake.clear()
+
+    def report(self, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        if self.ledger is not None:
+            if force:
+                self.ledger.flush()
+            print(f"[ledger] {self.ledger.counts()} skipped_this_run={self.ledger.skipped}")
+        for reporter in self._reporters:
+            print(reporter())
+        for be in self.backends:
+            ema = f"{be.ema_exec:.1f}s" if be.ema_exec is not None else "-"
+            ws = "ws" if be.listener is not None and be.listener.connected else "poll"
+            print(
+                f"[backend] {be.url} {'up' if be.alive else 'DOWN'} {ws} "
+                f"util={be.utilization() * 100:.0f}% done={be.completed} avg={ema} "
+                f"running={be.running} pending={be.pending} inflight={len(be.inflight)}"
+            )
+
+    def close(self) -> None:
+        for be in self.backends:
+            if be.listener is not None:
+                be.listener.stop()
+
+    def run(self, jobs: Iterator[Optional[Job]], poll_interval: float) -> None:
+        """ジョブが尽き、投入済みジョブの完了を確認するまで回す。"""
+        exhausted = False
+        try:
+            while True:
+                self.refresh()
+                self._run_periodic()
+                if not exhausted:
+                    exhausted = not self.dispatch(jobs)
+                elif self.retry:
+                    self.dispatch(iter(()))
+                if exhausted and not self.retry and self.inflight_count() == 0:
+                    break
+                self.report()
+                self.wait(poll_interval)
+        finally:
+            self.report(force=True)
+            self.close()
@@ -0,0 +1,154 @@
+"""入力ファイルが消えた・差し替えられたジョブの取り消し。
+
+投入時に入力画像の（更新時刻, サイズ）を記録し、check() で完了待ちのジョブの入力を確かめる。
+変わっていれば、ComfyUI のキューで待機中なら POST /queue の delete で取り除き、実行中なら
+POST /interrupt で中断して、古い入力に GPU の時間を使わないようにする。差し替えられた入力は
+（requeue なら）新しい内容で投入し直し、消えた入力はそのまま諦める。
+
+/queue の確認と取り消しの間に実行が始まった場合に備え、取り除こうとしたプロンプトが次の
+check() で実行中になっていれば中断する。/interrupt の prompt_id 指定に対応していない古い ComfyUI では
+その時点で実行中のプロンプトが中断されるので、実行中と確認できたときだけ送る。
+"""
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from comfy_http import ComfyClient
+from hot_reload import file_signature
+from scheduler import Job, Scheduler
+
+
+class StaleJobCanceller:
+    """check を Scheduler.add_periodic に、forget を add_finish_handler に渡して使う。"""
+
+    def __init__(self, http: ComfyClient, requeue: bool = True) -> None:
+        self.http = http
+        self.requeue = requeue
+        # prompt_id → 投入時の [(入力パス, file_signature)]
+        self._stamps: Dict[str, List[Tuple[Path, Optional[Tuple[int, int]]]]] = {}
+        # 投入済みの入力パス → 件数と、取り消して再投入待ちの入力パス（同じ入力を重ねて投入しないため）
+        self._active: Dict[Path, int] = {}
+        self._requeued: Set[Path] = set()
+        # 取り除こうとした待機中のプロンプト → バックエンド（実行が始まっていたら中断する）
+        self._withdrawn: Dict[str, str] = {}
+        self.deleted = 0
+        self.interrupted = 0
+        self.requeued = 0
+        self.dropped = 0
+
+    def _hold(self, path: Path, delta: int) -> None:
+        n = self._active.get(path, 0) + delta
+        if n > 0:
+            self._active[path] = n
+        else:
+            self._active.pop(path, None)
+
+    def stamp(self, prompt_id: str, paths: List[Path]) -> None:
+        """投入したプロンプトの入力を記録する（submit の直後に呼ぶ）。"""
+        self._stamps[prompt_id] = [(p, file_signature(p)) for p in paths]
+        for p in paths:
+            self._hold(p, 1)
+            self._requeued.discard(p)
+
+    def forget(self, job: Job) -> None:
+        """キューから消えたジョブの記録を捨てる（Scheduler.add_finish_handler に渡す）。"""
+        stamps = self._stamps.pop(job.prompt_id or "", None)
+        if stamps is None:
+            # 投入できないまま諦めたジョブ: 再投入待ちのまま残すと、同じ入力が二度と投入されない
+            for m in job.members():
+                self._requeued.discard(m.path)
+            return
+        for p, _ in stamps:
+            self._hold(p, -1)
+
+    def filter(self, jobs: Iterator[Optional[Job]]) -> Iterator[Optional[Job]]:
+        """投入前に入力が消えたジョブと、同じ入力を投入済み・再投入待ちのジョブを飛ばす（None は素通し）。"""
+        for job in jobs:
+            if job is not None:
+                members = [m for m in job.members() if not self._queued(m.path) and m.path.exists()]
+                if len(members) != len(job.members()):
+                    self.dropped += len(job.members()) - len(members)
+                    for m in job.members():
+                        if m not in members:
+                            reason = "already queued" if self._queued(m.path) else "deleted before submit"
+                            print(f"[cancelled] index={m.index} file={m.path} ({reason})")
+                    job = _regroup(job, members)
+                    if job is None:
+                        continue
+            yield job
+
+    def check(self, scheduler: Scheduler) -> None:
+        """完了待ちのジョブの入力を確かめ、変わっていれば取り消す。"""
+        by_url = {be.url: be for be in scheduler.backends}
+        for prompt_id, url in list(self._withdrawn.items()):
+            be = by_url.get(url)
+            if be is None or prompt_id not in be.queued_ids:
+                del self._withdrawn[prompt_id]
+            elif prompt_id in be.running_ids:
+                del self._withdrawn[prompt_id]
+                self._interrupt(url, prompt_id)
+        for be in scheduler.backends:
+            if not be.alive:
+                continue
+            for prompt_id, job in list(be.inflight.items()):
+                stamps = self._stamps.get(prompt_id)
+                if not stamps:
+                    continue
+                current = [(p, file_signature(p)) for p, _ in stamps]
+                if current == stamps:
+                    continue
+                deleted = any(sig is None for _, sig in current)
+                if prompt_id in be.running_ids:
+                    if not self._interrupt(be.url, prompt_id):
+                        continue
+                else:
+                    try:
+                        self.http.delete_queued(be.url, [prompt_id])
+                    except Exception as e:
+                        print(f"[cancel error] {be.url} prompt_id={prompt_id}: {e}")
+                        continue
+                    self.deleted += 1
+                    self._withdrawn[prompt_id] = be.url
+                again: Optional[Job] = None
+                if self.requeue:
+                    again = _regroup(job, [m for m in job.members() if m.path.exists()])
+                reason = "input deleted" if deleted else "input replaced"
+                if again is not None:
+                    reason += ", requeued"
+                    self.requeued += len(again.members())
+                    # 再投入までの間、同じ入力が入力の列挙から来ても重ねて投入しない
+                    self._requeued.update(m.path for m in again.members())
+                # 記録は finish handler の forget で捨てる
+                scheduler.cancel(be, prompt_id, reason, requeue=again)
+
+    def _interrupt(self, url: str, prompt_id: str) -> bool:
+        try:
+            self.http.interrupt(url, prompt_id)
+        except Exception as e:
+            print(f"[cancel error] {url} interrupt prompt_id={prompt_id}: {e}")
+            return False
+        self.interrupted += 1
+        return True
+
+    def _queued(self, path: Path) -> bool:
+        return path in self._active or path in self._requeued
+
+    def report(self) -> str:
+        return (
+            f"[cancel] deleted={self.deleted} interrupted={self.interrupted} requeued={self.requeued} "
+            f"skipped={self.dropped} watching={len(self._stamps)}"
+        )
+
+
+def _regroup(job: Job, members: List[Job]) -> Optional[Job]:
+    """job（まとめたものを含む）を members だけに絞った Job。空なら None。"""
+    if not members:
+        return None
+    if len(members) == len(job.members()):
+        return job
+    head = members[0]
+    head.signature = job.signature
+    head.lane = job.lane
+    head.attempts = job.attempts
+    head.timings = {}
+    head.batch = members if len(members) > 1 else []
+    return head
@@ -0,0 +1,271 @@
+"""ベンチマーク用の合成ワークフロー生成。
+
+API形式（/prompt に送るグラフ）と UI形式（extract_model_loader_groups.py が読む
+ワークフロー）を同じ構成で作る。ノード数・Switch の割合・サブグラフの入れ子の深さ・
+モデルローダーグループ数を指定できる。
+
+- API形式: LoadImagesFromFolderKJ（title "LoadImage"）→ 処理ノード列 → SaveImage。
+  各グループは CheckpointLoaderSimple + LoraLoader の鎖で、ImpactSwitch が
+  PrimitiveInt の select でどれか1つを選ぶ。サブグラフ内のノードは "<instance>:<id>"。
+- UI形式: "ModelLoader" サブグラフにローダーを置き、グループ矩形で囲む。
+  nesting >= 2 ならラッパーのサブグラフの中に ModelLoader のインスタンスを置く。
+- groups: out/model_loader_groups.json と同じ形のグループ定義。
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+LOAD_NODE_ID = "1"
+MODEL_LOADER_SUBGRAPH_ID = "00000000-0000-4000-8000-000000000001"
+_PROCESS_TYPES = ["KSampler", "VAEDecode", "ImageScale", "CLIPTextEncode", "ImageBlend"]
+
+# グループ矩形のレイアウト（UI形式）
+_GROUP_W = 400.0
+_GROUP_H = 300.0
+_GROUPS_PER_ROW = 16
+
+
+class SyntheticWorkflow:
+    """生成結果。api / ui / groups / paths を持つ。"""
+
+    def __init__(
+        self,
+        api: Dict[str, Any],
+        ui: Dict[str, Any],
+        groups: List[Dict[str, Any]],
+        paths: List[Path],
+    ) -> None:
+        self.api = api
+        self.ui = ui
+        self.groups = groups
+        self.paths = paths
+
+
+def group_triggers(gi: int) -> List[str]:
+    return [f"trig{gi:03d}", f"alias{gi:03d}"]
+
+
+def _node(class_type: str, inputs: Dict[str, Any], title: Optional[str] = None) -> Dict[str, Any]:
+    return {"class_type": class_type, "inputs": inputs, "_meta": {"title": title or class_type}}
+
+
+def generate_workflow(
+    nodes: int = 1000,
+    switch_density: float = 0.05,
+    groups: int = 8,
+    nesting: int = 1,
+    loaders_per_group: int = 3,
+    paths: int = 256,
+    seed: int = 0,
+) -> SyntheticWorkflow:
+    """合成ワークフローを生成する。nodes は API形式のおおよそのノード数。"""
+    rng = random.Random(seed)
+    # サブグラフのインスタンスID（入れ子の深さぶん連結）
+    prefix = ":".join(str(100 + i) for i in range(max(0, nesting)))
+
+    def key(local_id: int, in_subgraph: bool) -> str:
+        return f"{prefix}:{local_id}" if prefix and in_subgraph else str(local_id)
+
+    api: Dict[str, Any] = {
+        LOAD_NODE_ID: _node(
+            "LoadImagesFromFolderKJ",
+            {"folder": "input", "start_index": 0, "image_load_cap": 1, "include_subfolders": True},
+            title="LoadImage",
+        )
+    }
+    next_id = 2
+    group_defs: List[Dict[str, Any]] = []
+    group_outputs: List[str] = []
+    ui_loader_nodes: List[Dict[str, Any]] = []
+    ui_groups: List[Dict[str, Any]] = []
+
+    # --- モデルローダーグループ ---
+    for gi in range(groups):
+        gx = (gi % _GROUPS_PER_ROW) * (_GROUP_W + 50)
+        gy = (gi // _GROUPS_PER_ROW) * (_GROUP_H + 50)
+        local_ids: List[int] = []
+        prev: Optional[str] = None
+        for li in range(max(1, loaders_per_group)):
+            nid = next_id
+            next_id += 1
+            if prev is None:
+                api[key(nid, True)] = _node("CheckpointLoaderSimple", {"ckpt_name": f"model_{gi:03d}.safetensors"})
+            else:
+                api[key(nid, True)] = _node(
+                    "LoraLoader",
+                    {"model": [prev, 0], "clip": [prev, 1], "lora_name": f"lora_{gi:03d}_{li}.safetensors",
+                     "strength_model": 1.0, "strength_clip": 1.0},
+                )
+            prev = key(nid, True)
+            local_ids.append(nid)
+            ui_loader_nodes.append({
+                "id": nid,
+                "type": api[prev]["class_type"],
+                "pos": [gx + 20 + (li % 4) * 90, gy + 40 + (li // 4) * 60],
+                "size": [80, 50],
+            })
+        group_outputs.append(prev)  # type: ignore[arg-type]
+        triggers = group_triggers(gi)
+        group_defs.append({
+            "subgraph_id": prefix or None,
+            "trigger_folder_name": triggers,
+            "node_ids": local_ids,
+        })
+        ui_groups.append({"title": ", ".join(triggers), "bounding": [gx, gy, _GROUP_W, _GROUP_H]})
+
+    producers: List[str] = [LOAD_NODE_ID]
+
+    def add(node: Dict[str, Any], in_subgraph: bool = False) -> str:
+        nonlocal next_id
+        k = key(next_id, in_subgraph)
+        next_id += 1
+        api[k] = node
+        return k
+
+    def add_switch(choices: List[str]) -> str:
+        selector = add(_node("PrimitiveInt", {"value": rng.randint(1, len(choices))}))
+        inputs: Dict[str, Any] = {"select": [selector, 0]}
+        for ci, src in enumerate(choices):
+            inputs[f"input{ci + 1}"] = [src, 0]
+        return add(_node("ImpactSwitch", inputs))
+
+    # グループの出力を選ぶ Switch（選ばれたモデルが以降の処理に流れる）
+    model = add_switch(group_outputs) if group_outputs else LOAD_NODE_ID
+    producers.append(model)
+
+    # --- 処理ノード（局所性のある乱択で上流を選ぶ） ---
+    filler_ui: List[Dict[str, Any]] = []
+    since_save = 0
+    while len(api) < max(nodes, 2) - 1:
+        recent = producers[-64:]
+        if rng.random() < switch_density and len(recent) >= 2:
+            k = add_switch(rng.sample(recent, min(len(recent), rng.randint(2, 3))))
+        else:
+            inputs: Dict[str, Any] = {"seed": rng.randint(0, 2 ** 31)}
+            for ii in range(rng.randint(1, 3)):
+                inputs[f"in{ii}"] = [rng.choice(recent), 0]
+            in_subgraph = bool(prefix) and rng.random() < 0.2
+            k = add(_node(rng.choice(_PROCESS_TYPES), inputs), in_subgraph=in_subgraph)
+            if in_subgraph:
+                local = int(k.rsplit(":", 1)[1])
+                filler_ui.append({
+                    "id": local,
+                    "type": api[k]["class_type"],
+                    "pos": [rng.uniform(0, _GROUPS_PER_ROW * (_GROUP_W + 50)), rng.uniform(-2000, -100)],
+                    "size": [80, 50],
+                })
+        producers.append(k)
+        since_save += 1
+        if since_save >= 50:
+            add(_node("SaveImage", {"images": [k, 0], "filename_prefix": "bench"}))
+            since_save = 0
+    add(_node("SaveImage", {"images": [producers[-1], 0], "filename_prefix": "bench"}))
+
+    ui = _build_ui(prefix, ui_loader_nodes + filler_ui, ui_groups)
+    sample = _sample_paths(rng, groups, paths)
+    return SyntheticWorkflow(api, ui, group_defs, sample)
+
+
+def generate_dispatch_workflow(
+    groups: int = 4, loaders_per_group: int = 2, paths: int = 200, seed: int = 0
+) -> SyntheticWorkflow:
+    """投入方式のベンチマーク（dispatch_benchmark.py）用の小さな API形式ワークフロー。
+
+    各グループのローダーの鎖が1つの処理ノードへ並列に繋がるので、フォルダ名で選ばれなかった
+    グループのローダーは送信前に取り除かれ、入力ごとにローダーの組み合わせが変わる
+    （fake_comfy_server はその変化をモデルの読み込み直しとして扱う）。ui は空。
+    """
+    rng = random.Random(seed)
+    api: Dict[str, Any] = {
+        LOAD_NODE_ID: _node(
+            "LoadImagesFromFolderKJ",
+            {"folder": "input", "start_index": 0, "image_load_cap": 1, "include_subfolders": True},
+            title="LoadImage",
+        )
+    }
+    next_id = 2
+    group_defs: List[Dict[str, Any]] = []
+    process_inputs: Dict[str, Any] = {"images": [LOAD_NODE_ID, 0], "seed": rng.randint(0, 2 ** 31)}
+    for gi in range(groups):
+        local_ids: List[int] = []
+        prev: Optional[str] = None
+        for li in range(max(1, loaders_per_group)):
+            nid = str(next_id)
+            next_id += 1
+            if prev is None:
+                api[nid] = _node("CheckpointLoaderSimple", {"ckpt_name": f"model_{gi:03d}.safetensors"})
+            else:
+                api[nid] = _node(
+                    "LoraLoader",
+                    {"model": [prev, 0], "clip": [prev, 1], "lora_name": f"lora_{gi:03d}_{li}.safetensors",
+                     "strength_model": 1.0, "strength_clip": 1.0},
+                )
+            prev = nid
+            local_ids.append(int(nid))
+        process_inputs[f"model{gi}"] = [prev, 0]
+        group_defs.append({"subgraph_id": None, "trigger_folder_name": group_triggers(gi), "node_ids": local_ids})
+    process = str(next_id)
+    api[process] = _node("KSampler", process_inputs)
+    api[str(next_id + 1)] = _node("SaveImage", {"images": [process, 0], "filename_prefix": "bench"})
+    return SyntheticWorkflow(api, {}, group_defs, _sample_paths(rng, groups, paths))
+
+
+def _build_ui(prefix: str, loader_nodes: List[Dict[str, Any]], groups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """ModelLoader サブグラフを（必要ならラッパーの中に）置いた UI形式のワークフロー。"""
+    instances = [int(x) for x in prefix.split(":")] if prefix else []
+    model_loader = {"id": MODEL_LOADER_SUBGRAPH_ID, "name": "ModelLoader", "nodes": loader_nodes, "groups": groups}
+    subgraphs: List[Dict[str, Any]] = [model_loader]
+    if not instances:
+        # サブグラフを使わない構成: ローダーとグループをルートに置く
+        return {"nodes": loader_nodes, "links": [], "groups": groups, "definitions": {"subgraphs": []}}
+    # 外側から順に: ルート → wrapper_0 → ... → ModelLoader
+    wrapper_ids = [f"00000000-0000-4000-8000-{i + 2:012d}" for i in range(len(instances) - 1)]
+    types = wrapper_ids + [MODEL_LOADER_SUBGRAPH_ID]
+    for depth, wid in enumerate(wrapper_ids):
+        subgraphs.append({
+            "id": wid,
+            "name": f"Wrapper{depth}",
+            "nodes": [{"id": instances[depth + 1], "type": types[depth + 1], "pos": [0, 0], "size": [200, 100]}],
+            "groups": [],
+        })
+    root_nodes = [{"id": instances[0], "type": types[0], "pos": [0, 0], "size": [200, 100]}]
+    return {"nodes": root_nodes, "links": [], "groups": [], "definitions": {"subgraphs": subgraphs}}
+
+
+def _sample_paths(rng: random.Random, groups: int, count: int) -> List[Path]:
+    """入力パス。大半はトリガーのフォルダ1つの下で、一部は0個・2個（実運用に近い分布）。"""
+    out: List[Path] = []
+    for i in range(count):
+        parts = ["in"]
+        r = rng.random()
+        n_triggers = (0 if r < 0.1 else 2 if r > 0.9 else 1) if groups else 0
+        for _ in range(n_triggers):
+            parts.append(rng.choice(group_triggers(rng.randrange(groups))))
+        parts.append(f"img{i:06d}.png")
+        out.append(Path(*parts))
+    return out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成ワークフローを書き出す")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--switch-density", type=float, default=0.05)
+    parser.add_argument("--groups", type=int, default=8)
+    parser.add_argument("--nesting", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out-dir", type=str, default="out/synthetic")
+    args = parser.parse_args()
+
+    sw = generate_workflow(args.nodes, args.switch_density, args.groups, args.nesting, seed=args.seed)
+    out = Path(args.out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    (out / "api.json").write_text(json.dumps(sw.api, ensure_ascii=False), encoding="utf-8")
+    (out / "ui.json").write_text(json.dumps(sw.ui, ensure_ascii=False), encoding="utf-8")
+    (out / "model_loader_groups.json").write_text(json.dumps(sw.groups, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[synthetic] nodes={len(sw.api)} groups={len(sw.groups)} -> {out}")
+
+
+if __name__ == "__main__":
+    main()
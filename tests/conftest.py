@@ -0,0 +1,129 @@
+"""テスト共通のフィクスチャ: 空いているポートで立てる簡易サーバと、それに投入する関数。"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from comfy_http import ComfyClient, RetryPolicy  # noqa: E402
+from fake_comfy_server import SimProfile, make_server  # noqa: E402
+from scheduler import Scheduler  # noqa: E402
+
+CLIENT_ID = "test-client"
+
+
+@pytest.fixture
+def fake_comfy() -> Iterator[Callable[..., Tuple[str, Any]]]:
+    """fake_comfy(exec_time=..., **SimProfile の引数) で簡易サーバを立て、(URL, FakeComfyState) を返す。"""
+    servers: List[Any] = []
+
+    def start(exec_time: float = 0.2, **profile: Any) -> Tuple[str, Any]:
+        server = make_server("127.0.0.1", 0, exec_time, profile=SimProfile(exec_time=exec_time, **profile))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}", server.state
+
+    yield start
+    for server in servers:
+        server.state.stop()
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(scope="session")
+def loop_module(tmp_path_factory: pytest.TempPathFactory) -> ModuleType:
+    """loop.py（import 時にカレントの config.json とワークフローを読む）を、最小のワークフローで読み込む。"""
+    workdir = tmp_path_factory.mktemp("loop")
+    (workdir / "input").mkdir()
+    workflow = {
+        "1": {
+            "class_type": "LoadImagesFromFolderKJ",
+            "_meta": {"title": "LoadImage"},
+            "inputs": {"folder": "", "start_index": 0, "image_load_cap": 1},
+        },
+        "2": {"class_type": "SaveImage", "inputs": {"images": ["1", 0], "filename_prefix": "out"}},
+    }
+    (workdir / "workflow.json").write_text(json.dumps(workflow), encoding="utf-8")
+    config = {"workflow": "workflow.json", "input_dir": "input", "ledger_path": "", "metrics_port": 0, "auto_extract": False}
+    (workdir / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        sys.modules.pop("loop", None)
+        loop = importlib.import_module("loop")
+    finally:
+        os.chdir(cwd)
+    # 通信はしないので HTTP クライアントのスレッドは止めておく
+    loop.HTTP.close()
+    return loop
+
+
+@pytest.fixture
+def http() -> Iterator[ComfyClient]:
+    client = ComfyClient(retry=RetryPolicy(attempts=2, base_delay=0.05, max_delay=0.1))
+    yield client
+    client.close()
+
+
+class PromptSubmitter:
+    """Scheduler の submit_fn。出力ノードだけのプロンプトを送り、送った (index, path, prompt_id) を記録する。"""
+
+    def __init__(self, http: ComfyClient) -> None:
+        self.http = http
+        self.calls: List[Tuple[int, Path, str]] = []
+        self.fail: Dict[Path, Exception] = {}
+
+    def __call__(
+        self, index: int, path: Path, base: str, timings: Dict[str, float], batch: Optional[List[Path]] = None
+    ) -> str:
+        error = self.fail.get(path)
+        if error is not None:
+            raise error
+        timings["submit"] = time.time()
+        prompt = {"1": {"class_type": "SaveImage", "inputs": {"filename_prefix": path.stem}}}
+        prompt_id = self.http.post_prompt(base, {"prompt": prompt, "client_id": CLIENT_ID})["prompt_id"]
+        self.calls.append((index, path, prompt_id))
+        return prompt_id
+
+    def paths(self) -> List[Path]:
+        return [path for _, path, _ in self.calls]
+
+
+@pytest.fixture
+def submitter(http: ComfyClient) -> PromptSubmitter:
+    return PromptSubmitter(http)
+
+
+def make_scheduler(urls: List[str], http: ComfyClient, submit: PromptSubmitter, **kwargs: Any) -> Scheduler:
+    """websocket を使わない（/queue の確認だけで進む）スケジューラ。"""
+    kwargs.setdefault("refresh_wait", 0.1)
+    return Scheduler(
+        urls, submit, http.get_queue_future, CLIENT_ID, use_websocket=False, history_fn=http.get_history, **kwargs
+    )
+
+
+def drive(scheduler: Scheduler, jobs: Iterator[Any], timeout: float = 10.0, poll: float = 0.05) -> bool:
+    """Scheduler.run と同じ順で回し、全部終われば True（timeout 秒で打ち切る）。"""
+    exhausted = False
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        scheduler.refresh()
+        scheduler._run_periodic()
+        if not exhausted:
+            exhausted = not scheduler.dispatch(jobs)
+        elif scheduler.retry:
+            scheduler.dispatch(iter(()))
+        if exhausted and not scheduler.retry and scheduler.inflight_count() == 0:
+            return True
+        scheduler.wait(poll)
+    return False
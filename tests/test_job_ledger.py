@@ -0,0 +1,63 @@
+from pathlib import Path
+
+from job_ledger import JobLedger, history_status
+from scheduler import Job
+
+
+def test_filter_skips_success_and_submitted(tmp_path: Path) -> None:
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    ok, queued, failed, new = (tmp_path / f"{n}.png" for n in ("ok", "queued", "failed", "new"))
+    ledger.record_submitted(ok, 0, "p0", "http://a")
+    ledger.record_finished(ok, "p0", "success")
+    ledger.record_submitted(queued, 1, "p1", "http://a")
+    ledger.record_submitted(failed, 2, "p2", "http://a")
+    ledger.record_finished(failed, "p2", "error", "boom")
+    # コミット前でも status() は最新の状態を返す
+    assert ledger.status(ok) == "success"
+    kept = [job.path for job in ledger.filter_jobs(iter([Job(i, p) for i, p in enumerate([ok, queued, failed, new])]))]
+    assert kept == [failed, new]
+    assert ledger.skipped == 2
+    ledger.close()
+
+
+def test_state_survives_reopen(tmp_path: Path) -> None:
+    db = str(tmp_path / "ledger.sqlite3")
+    ledger = JobLedger(db)
+    a, b = tmp_path / "a.png", tmp_path / "b.png"
+    ledger.record_submitted(a, 0, "p0", "http://a")
+    ledger.record_submitted(b, 1, "p1", "http://b")
+    ledger.record_finished(b, "p1", "success")
+    # 別の prompt_id の完了は、投入し直した行を上書きしない
+    ledger.record_finished(a, "stale", "lost")
+    ledger.close()
+
+    reopened = JobLedger(db)
+    assert reopened.inflight_rows() == [(str(a), 0, "p0", "http://a")]
+    assert reopened.counts() == {"submitted": 1, "success": 1}
+    reopened.close()
+
+
+def test_record_failed_is_retried_on_next_run(tmp_path: Path) -> None:
+    db = str(tmp_path / "ledger.sqlite3")
+    ledger = JobLedger(db)
+    a, b = tmp_path / "a.png", tmp_path / "b.png"
+    ledger.record_submitted(a, 0, "p0", "http://a")
+    ledger.record_failed(a, 0, "submit failed: boom")
+    ledger.record_failed(b, 1, "submit failed: boom")
+    assert ledger.status(b) == "error"
+    ledger.close()
+
+    reopened = JobLedger(db)
+    assert reopened.inflight_rows() == []
+    assert reopened.counts() == {"error": 2}
+    kept = [job.path for job in reopened.filter_jobs(iter([Job(0, a), Job(1, b)]))]
+    assert kept == [a, b]
+    reopened.close()
+
+
+def test_history_status() -> None:
+    assert history_status(None) == ("lost", None)
+    assert history_status({"status": {"status_str": "success"}}) == ("success", None)
+    err = {"status": {"status_str": "error", "messages": [["execution_error", {"exception_message": "oom"}]]}}
+    assert history_status(err) == ("error", "oom")
+    assert history_status({"status": {}, "outputs": {"9": {}}}) == ("success", None)
@@ -0,0 +1,231 @@
+import random
+from types import ModuleType
+from typing import Any, Dict, List, Set
+
+import pytest
+
+from remove_switches import _eval_math, _is_connection, find_output_nodes, prune_unreachable, remove_switch_nodes
+from workflow_graph import WorkflowGraph, compile_api
+
+
+def dangling_references(graph: Dict[str, Any]) -> List[Any]:
+    """グラフに無いノードを指している (ノードID, 入力キー, 参照)。"""
+    found = []
+    for node_id, node in graph.items():
+        for key, value in (node.get("inputs") or {}).items():
+            if _is_connection(value) and str(value[0]) not in graph:
+                found.append((node_id, key, value))
+    return found
+
+
+def random_graph(seed: int, size: int = 80) -> Dict[str, Any]:
+    """Switch・定数ノード・Reroute・出力ノードを混ぜたランダムな API形式のグラフ。"""
+    rng = random.Random(seed)
+    graph: Dict[str, Any] = {"1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}}}
+    # ノードID → 出力の数
+    outputs = {"1": 1}
+    constants: List[str] = []
+
+    def ref() -> List[Any]:
+        src = rng.choice(list(outputs))
+        return [src, rng.randrange(outputs[src])]
+
+    def select() -> Any:
+        roll = rng.random()
+        if roll < 0.4:
+            return rng.choice([0, 1, 2])
+        if roll < 0.7 and constants:
+            return [rng.choice(constants), 0]
+        # 定数に解決できない select
+        return ref()
+
+    for num in range(2, size):
+        node_id = str(num)
+        roll = rng.random()
+        if roll < 0.1:
+            graph[node_id] = {"class_type": "PrimitiveInt", "inputs": {"value": rng.choice([0, 1, 2])}}
+            constants.append(node_id)
+            continue
+        if roll < 0.25:
+            graph[node_id] = {"class_type": "ImpactInversedSwitch", "inputs": {"select": select(), "input": ref()}}
+            outputs[node_id] = 2
+            continue
+        if roll < 0.4:
+            graph[node_id] = {
+                "class_type": "ImpactSwitch",
+                "inputs": {"select": select(), "input1": ref(), "input2": ref()},
+            }
+        elif roll < 0.5:
+            graph[node_id] = {"class_type": "Reroute", "inputs": {"": ref()}}
+        elif roll < 0.65:
+            graph[node_id] = {"class_type": "SaveImage", "inputs": {"images": ref(), "filename_prefix": node_id}}
+            continue
+        else:
+            graph[node_id] = {"class_type": "ImageScale", "inputs": {"image": ref(), "width": 512}}
+        outputs[node_id] = 1
+    return graph
+
+
+def nested_graph(seed: int) -> Dict[str, Any]:
+    """random_graph の一部のノードを "<subgraph_id>:<id>" のキーへ移したグラフ（末尾の id は他と重なり得る）。"""
+    rng = random.Random(seed + 1000)
+    graph = random_graph(seed)
+    rename: Dict[str, str] = {}
+    used = set(graph)
+    for node_id in graph:
+        if node_id == "1" or rng.random() > 0.4:
+            continue
+        key = f"{rng.choice(['100', '200'])}:{rng.randint(2, 30)}"
+        if key not in used:
+            rename[node_id] = key
+            used.add(key)
+    nested: Dict[str, Any] = {}
+    for node_id, node in graph.items():
+        inputs = {
+            k: [rename.get(v[0], v[0]), v[1]] if _is_connection(v) else v for k, v in node["inputs"].items()
+        }
+        nested[rename.get(node_id, node_id)] = {"class_type": node["class_type"], "inputs": inputs}
+    return nested
+
+
+def skip_ids(graph: Dict[str, Any], seed: int) -> Set[str]:
+    """スキップ指定: 完全なキー・サブグラフ内ノードの末尾 id・Switch とその下流（連続したバイパス）を混ぜる。"""
+    rng = random.Random(seed + 2000)
+    keys = list(graph)
+    skip: Set[str] = set()
+    for key in rng.sample(keys, rng.randint(1, 6)):
+        skip.add(key.rsplit(":", 1)[1] if ":" in key and rng.random() < 0.5 else key)
+    consumers: Dict[str, List[str]] = {}
+    for node_id, node in graph.items():
+        for value in node["inputs"].values():
+            if _is_connection(value):
+                consumers.setdefault(value[0], []).append(node_id)
+    switches = [k for k in keys if "Switch" in graph[k]["class_type"] and consumers.get(k)]
+    for sid in rng.sample(switches, min(2, len(switches))):
+        # Switch へのバイパス（下流を飛ばす）と、Switch 自体・その下流の連続したバイパス
+        consumer = rng.choice(consumers[sid])
+        skip.add(consumer)
+        if rng.random() < 0.5:
+            skip.add(sid)
+        if consumers.get(consumer):
+            skip.add(rng.choice(consumers[consumer]))
+    return skip
+
+
+def test_unselected_inversed_output_is_removed_downstream() -> None:
+    graph = {
+        "5": {"class_type": "LoadImage", "inputs": {"image": "a.png"}},
+        "6": {"class_type": "ImpactInversedSwitch", "inputs": {"select": 1, "input": ["5", 0]}},
+        "9": {"class_type": "SaveImage", "inputs": {"images": ["6", 0]}},
+        "10": {"class_type": "ImageScale", "inputs": {"image": ["6", 1]}},
+        "11": {"class_type": "SaveImage", "inputs": {"images": ["10", 0]}},
+    }
+    for prune in (True, False):
+        result = remove_switch_nodes(graph, prune=prune)
+        assert result == {
+            "5": graph["5"],
+            "9": {"class_type": "SaveImage", "inputs": {"images": ["5", 0]}},
+        }
+
+
+def test_switch_without_upstream_keeps_its_consumers() -> None:
+    # 上流を決められない Switch は誤ったワークフローとして参照を残し、出力ノードを黙って消さない
+    graph = {
+        "1": {"class_type": "ImpactSwitch", "inputs": {"select": 1}},
+        "2": {"class_type": "SaveImage", "inputs": {"images": ["1", 0]}},
+        "3": {"class_type": "LoadImage", "inputs": {}},
+        "4": {"class_type": "ImpactInversedSwitch", "inputs": {"select": 1, "input": ["3", 0]}},
+        "5": {"class_type": "SaveImage", "inputs": {"images": ["4", 1]}},
+    }
+    for prune in (True, False):
+        result = remove_switch_nodes(graph, prune=prune)
+        assert result["2"] == graph["2"]
+        assert "5" not in result
+
+
+def test_huge_power_in_select_is_left_unresolved() -> None:
+    assert _eval_math("2**10 + a", {"a": lambda: 1}) == 1025
+    assert _eval_math("(-3)**3", {}) == -27
+    assert _eval_math("9**9**9", {}) is None
+    assert _eval_math("(2**64)**64**2", {}) is None
+    graph = {
+        "1": {"class_type": "LoadImage", "inputs": {}},
+        "2": {"class_type": "LoadImage", "inputs": {}},
+        "3": {"class_type": "SimpleMath+", "inputs": {"value": "9**9**9"}},
+        "4": {"class_type": "ImpactSwitch", "inputs": {"select": ["3", 0], "input1": ["1", 0], "input2": ["2", 0]}},
+        "5": {"class_type": "SaveImage", "inputs": {"images": ["4", 0]}},
+    }
+    # 確定できない select は最初の入力を使う
+    result = remove_switch_nodes(graph)
+    assert result == {"1": graph["1"], "5": {"class_type": "SaveImage", "inputs": {"images": ["1", 0]}}}
+
+
+def test_select_from_constant_node() -> None:
+    graph = {
+        "1": {"class_type": "LoadImage", "inputs": {}},
+        "2": {"class_type": "LoadImage", "inputs": {}},
+        "3": {"class_type": "PrimitiveInt", "inputs": {"value": 2}},
+        "4": {"class_type": "ImpactSwitch", "inputs": {"select": ["3", 0], "input1": ["1", 0], "input2": ["2", 0]}},
+        "5": {"class_type": "SaveImage", "inputs": {"images": ["4", 0]}},
+    }
+    result = remove_switch_nodes(graph)
+    assert result == {"2": graph["2"], "5": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}}}
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("prune", [True, False])
+def test_no_reference_to_missing_node(seed: int, prune: bool) -> None:
+    graph = random_graph(seed)
+    result = remove_switch_nodes(graph, prune=prune)
+    assert dangling_references(result) == []
+    assert not any("Switch" in node["class_type"] for node in result.values())
+    assert dangling_references(graph) == []
+
+
+def test_prune_unreachable_keeps_only_ancestors_of_roots() -> None:
+    graph = random_graph(3)
+    roots = find_output_nodes(graph)
+    pruned = dict(graph)
+    removed = prune_unreachable(pruned, roots)
+    assert set(removed) | set(pruned) == set(graph)
+    assert dangling_references(pruned) == []
+    assert all(r in pruned for r in roots)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_graph_model_matches_dict_transform(seed: int) -> None:
+    graph = random_graph(seed)
+    roots = find_output_nodes(graph)
+    compact = WorkflowGraph.from_api(graph)
+    assert compact is not None
+    expected = remove_switch_nodes(graph, roots=roots)
+    assert compile_api(compact, [], roots) == expected
+    # 同じ WorkflowGraph から何度変換しても同じ結果になる
+    assert compile_api(compact, [], roots) == expected
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_graph_model_matches_dict_pipeline_with_skips(seed: int, loop_module: ModuleType) -> None:
+    graph = nested_graph(seed)
+    skip = skip_ids(graph, seed)
+    roots = find_output_nodes(graph)
+    compact = WorkflowGraph.from_api(graph)
+    assert compact is not None
+    expected = remove_switch_nodes(loop_module.bypass_nodes(graph, skip), roots=roots)
+    assert compile_api(compact, skip, roots) == expected
+
+
+def test_skip_sets_cover_nested_ids_and_switches() -> None:
+    # 上の比較で、末尾 id の指定（同じ id の通常キーがある場合も）と Switch まわりのバイパスを確かめている
+    suffix = plain_and_nested = into_switch = 0
+    for seed in range(40):
+        graph = nested_graph(seed)
+        for rid in skip_ids(graph, seed):
+            if ":" not in rid and any(k.endswith(":" + rid) for k in graph):
+                suffix += 1
+                plain_and_nested += rid in graph
+            if rid in graph and any(
+                _is_connection(v) and "Switch" in graph[v[0]]["class_type"] for v in graph[rid]["inputs"].values()
+            ):
+                into_switch += 1
+    assert suffix and plain_and_nested and into_switch
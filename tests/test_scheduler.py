@@ -0,0 +1,107 @@
+
+from comfy_http import ComfyRequestError
+from conftest import drive, make_scheduler
+from job_ledger import JobLedger
+from scheduler import iter_jobs
+
+
+def test_dispatches_across_backends(tmp_path, fake_comfy, http, submitter) -> None:
+    url_a, state_a = fake_comfy(exec_time=0.05)
+    url_b, state_b = fake_comfy(exec_time=0.05)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([url_a, url_b], http, submitter, ledger=ledger)
+    paths = [tmp_path / f"{i}.png" for i in range(6)]
+    assert drive(scheduler, iter_jobs(paths))
+    ledger.flush()
+    assert sorted(submitter.paths()) == sorted(paths)
+    assert ledger.counts() == {"success": 6}
+    assert state_a.stats["prompts"] + state_b.stats["prompts"] == 6
+    ledger.close()
+
+
+def test_late_queue_answer_does_not_finish_newer_prompt(tmp_path, fake_comfy, http, submitter) -> None:
+    # /queue の応答が refresh_wait に間に合わず、その間に投入したプロンプトが載っていない古い結果を後で回収する
+    url, state = fake_comfy(exec_time=1.0, queue_delay=0.5)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([url], http, submitter, ledger=ledger)
+    scheduler.refresh()
+    assert scheduler.backends[0].queue_request is not None
+    path = tmp_path / "a.png"
+    jobs = iter_jobs([path])
+    scheduler.dispatch(jobs)
+    assert submitter.paths() == [path]
+    assert drive(scheduler, jobs)
+    ledger.flush()
+    assert submitter.paths() == [path]
+    assert ledger.status(path) == "success"
+    assert state.stats["prompts"] == 1
+    ledger.close()
+
+
+def test_resume_waits_for_slow_queue(tmp_path, fake_comfy, http, submitter) -> None:
+    url, state = fake_comfy(exec_time=1.0, queue_delay=0.6)
+    path = tmp_path / "a.png"
+    prompt_id = http.post_prompt(url, {"prompt": {"1": {"class_type": "SaveImage", "inputs": {}}}})["prompt_id"]
+    db = str(tmp_path / "ledger.sqlite3")
+    previous = JobLedger(db)
+    previous.record_submitted(path, 0, prompt_id, url)
+    previous.close()
+
+    ledger = JobLedger(db)
+    scheduler = make_scheduler([url], http, submitter, ledger=ledger)
+    scheduler.resume()
+    assert prompt_id in scheduler.backends[0].inflight
+    assert ledger.status(path) == "submitted"
+    # 入力の走査で同じ画像が来ても投入し直さない
+    assert drive(scheduler, ledger.filter_jobs(iter_jobs([path])))
+    ledger.flush()
+    assert submitter.calls == []
+    assert ledger.status(path) == "success"
+    ledger.close()
+
+
+def test_resume_keeps_jobs_on_unreachable_backend(tmp_path, fake_comfy, http, submitter) -> None:
+    url, _ = fake_comfy(exec_time=0.05, http_error_rate=1.0)
+    path = tmp_path / "a.png"
+    db = str(tmp_path / "ledger.sqlite3")
+    previous = JobLedger(db)
+    previous.record_submitted(path, 0, "p0", url)
+    previous.close()
+
+    ledger = JobLedger(db)
+    scheduler = make_scheduler([url], http, submitter, ledger=ledger)
+    scheduler.resume()
+    # /queue を確認できないうちは lost にしない（停止と判定されたら再投入に回る）
+    assert "p0" in scheduler.backends[0].inflight
+    assert ledger.status(path) == "submitted"
+    ledger.close()
+
+
+def test_local_submit_error_gives_up_without_blocking_backend(tmp_path, fake_comfy, http, submitter) -> None:
+    url, _ = fake_comfy(exec_time=0.05)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([url], http, submitter, ledger=ledger, max_attempts=3)
+    paths = [tmp_path / f"{i}.png" for i in range(4)]
+    submitter.fail[paths[1]] = FileNotFoundError("no such file")
+    assert drive(scheduler, iter_jobs(paths))
+    ledger.flush()
+    assert sorted(submitter.paths()) == sorted(p for p in paths if p != paths[1])
+    assert ledger.status(paths[1]) == "error"
+    assert ledger.counts() == {"success": 3, "error": 1}
+    # 手元の失敗ではバックエンドを停止扱いにしない
+    assert scheduler.backends[0].alive and scheduler.backends[0].failures == 0
+    ledger.close()
+
+
+def test_backend_submit_error_is_limited_by_max_attempts(tmp_path, fake_comfy, http, submitter) -> None:
+    url, _ = fake_comfy(exec_time=0.05)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([url], http, submitter, ledger=ledger, max_attempts=2, down_after=5)
+    paths = [tmp_path / f"{i}.png" for i in range(3)]
+    submitter.fail[paths[0]] = ComfyRequestError("POST /prompt failed")
+    assert drive(scheduler, iter_jobs(paths))
+    ledger.flush()
+    assert sorted(submitter.paths()) == sorted(paths[1:])
+    assert ledger.counts() == {"success": 2, "error": 1}
+    assert ledger.status(paths[0]) == "error"
+    ledger.close()
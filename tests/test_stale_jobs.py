@@ -0,0 +1,90 @@
+from pathlib import Path
+from typing import Any, List
+
+from conftest import PromptSubmitter, drive, make_scheduler
+from job_ledger import JobLedger
+from scheduler import Job, iter_jobs
+from stale_jobs import StaleJobCanceller
+
+
+class StampingSubmitter(PromptSubmitter):
+    """loop.submit_one と同じく、投入したプロンプトを StaleJobCanceller に記録する。"""
+
+    def __init__(self, http: Any, canceller: StaleJobCanceller) -> None:
+        super().__init__(http)
+        self.canceller = canceller
+
+    def __call__(self, index: int, path: Path, base: str, timings: Any, batch: Any = None) -> str:
+        prompt_id = super().__call__(index, path, base, timings, batch)
+        self.canceller.stamp(prompt_id, [path])
+        return prompt_id
+
+
+def make_inputs(tmp_path: Path, n: int) -> List[Path]:
+    paths = [tmp_path / f"{i}.png" for i in range(n)]
+    for p in paths:
+        p.write_bytes(b"png")
+    return paths
+
+
+def assert_released(canceller: StaleJobCanceller, paths: List[Path]) -> None:
+    assert canceller._stamps == {}
+    assert canceller._active == {}
+    # 同じ画像を投入し直すときに already queued で落とさない
+    assert [job.path for job in canceller.filter(iter([Job(i, p) for i, p in enumerate(paths)]))] == paths
+
+
+def test_lost_retries_release_stamps(tmp_path, fake_comfy, http) -> None:
+    url, _ = fake_comfy(exec_time=0.05, lost_rate=1.0)
+    canceller = StaleJobCanceller(http)
+    submit = StampingSubmitter(http, canceller)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([url], http, submit, ledger=ledger, max_attempts=2)
+    scheduler.add_finish_handler(canceller.forget)
+    paths = make_inputs(tmp_path, 2)
+    assert drive(scheduler, iter_jobs(paths))
+    ledger.flush()
+    assert len(submit.calls) == 4
+    assert ledger.counts() == {"lost": 2}
+    assert_released(canceller, paths)
+    ledger.close()
+
+
+def test_rerouted_jobs_release_stamps(tmp_path, fake_comfy, http) -> None:
+    # /queue に答えないバックエンドは停止と判定され、投入済みのジョブがもう一方へ回る
+    down, _ = fake_comfy(exec_time=0.05, http_error_rate=1.0)
+    up, _ = fake_comfy(exec_time=0.05)
+    canceller = StaleJobCanceller(http)
+    submit = StampingSubmitter(http, canceller)
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite3"))
+    scheduler = make_scheduler([down, up], http, submit, ledger=ledger, down_after=2)
+    scheduler.add_finish_handler(canceller.forget)
+    paths = make_inputs(tmp_path, 4)
+    assert drive(scheduler, iter_jobs(paths))
+    ledger.flush()
+    assert not scheduler.backends[0].alive
+    # 停止したバックエンドに投入した分を投入し直している
+    assert len(submit.calls) > len(paths)
+    assert ledger.counts() == {"success": 4}
+    assert_released(canceller, paths)
+    ledger.close()
+
+
+def test_requeued_job_that_is_given_up_is_not_blocked(tmp_path, fake_comfy, http) -> None:
+    url, _ = fake_comfy(exec_time=1.0)
+    canceller = StaleJobCanceller(http)
+    submit = StampingSubmitter(http, canceller)
+    scheduler = make_scheduler([url], http, submit, max_attempts=2)
+    scheduler.add_finish_handler(canceller.forget)
+    paths = make_inputs(tmp_path, 1)
+    jobs = iter_jobs(paths)
+    scheduler.dispatch(jobs)
+    scheduler.refresh(block=True)
+    # 入力を差し替えると取り消して再投入待ちになるが、その投入が失敗し続けて諦める
+    paths[0].write_bytes(b"replaced png")
+    submit.fail[paths[0]] = OSError("unreadable")
+    canceller.check(scheduler)
+    assert canceller.requeued == 1 and paths[0] in canceller._requeued
+    assert drive(scheduler, jobs)
+    assert len(submit.calls) == 1
+    assert_released(canceller, paths)
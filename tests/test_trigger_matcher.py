@@ -0,0 +1,59 @@
+import random
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from trigger_matcher import TriggerMatcher
+
+
+def _path_contains_any_keyword(path: Path, keywords: List[str]) -> bool:
+    p = str(path).lower()
+    return any(kw and str(kw).lower() in p for kw in keywords)
+
+
+def per_group_skip_ids(groups: List[Dict[str, Any]], path: Path) -> Set[str]:
+    """TriggerMatcher 導入前の loop.collect_skip_node_ids_for_path（グループごとに照合）。"""
+    skip: Set[str] = set()
+    for grp in groups:
+        sub_id = grp.get("subgraph_id")
+        if not _path_contains_any_keyword(path, [str(t) for t in grp.get("trigger_folder_name") or []]):
+            for nid in grp.get("node_ids") or []:
+                skip.add(f"{sub_id}:{nid}" if sub_id else str(nid))
+    return skip
+
+
+def test_matches_per_group_keyword_search() -> None:
+    rng = random.Random(7)
+    # 部分文字列どうし（"sd"・"sdxl"・"xl"）や大文字小文字の違いも含める
+    words = ["sd", "sdxl", "xl", "Anime", "anime_v2", "real", "realistic", "pony", "flux", "lora"]
+    groups: List[Dict[str, Any]] = []
+    for gi in range(12):
+        groups.append(
+            {
+                "trigger_folder_name": rng.sample(words, rng.randint(0, 3)),
+                "node_ids": [gi * 10 + k for k in range(rng.randint(1, 3))],
+                "subgraph_id": "sub" if gi % 4 == 0 else None,
+            }
+        )
+    matcher = TriggerMatcher(groups)
+    for _ in range(500):
+        parts = [rng.choice(words + ["img", "out", "2024"]) + rng.choice(["", "_x", "-1"]) for _ in range(rng.randint(1, 4))]
+        path = Path("/in", *parts, "a.png")
+        assert set(matcher.skip_ids_for_path(path)) == per_group_skip_ids(groups, path), path
+
+
+def test_same_skip_set_gets_same_signature() -> None:
+    groups = [
+        {"trigger_folder_name": ["anime"], "node_ids": [1]},
+        {"trigger_folder_name": ["real"], "node_ids": [2]},
+    ]
+    matcher = TriggerMatcher(groups)
+    sig_a, skip_a = matcher.classify(Path("/in/anime/a.png"))
+    sig_b, skip_b = matcher.classify(Path("/in/ANIME/b.png"))
+    sig_c, skip_c = matcher.classify(Path("/in/real/c.png"))
+    assert (sig_a, skip_a) == (sig_b, skip_b) == (sig_a, frozenset({"2"}))
+    assert sig_c != sig_a and skip_c == frozenset({"1"})
+    assert matcher.skip_ids_for_signature(sig_c) == skip_c
+
+
+def test_no_groups_skips_nothing() -> None:
+    assert TriggerMatcher([]).skip_ids_for_path(Path("/in/x.png")) == frozenset()
@@ -0,0 +1,69 @@
+import json
+from typing import Any, Dict, Tuple
+
+import pytest
+
+from workflow_cache import CompiledWorkflowCache, PromptTemplate, encode_json, patch_node_inputs
+
+GRAPH: Dict[str, Any] = {
+    "1": {"class_type": "LoadImagesFromFolderKJ", "inputs": {"folder": "", "start_index": 0, "image_load_cap": 1}},
+    "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "日本語 \"quoted\" \\ back", "clip": ["3", 0]}},
+    "3": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+    "4": {"class_type": "SaveImage", "inputs": {"images": ["1", 0], "filename_prefix": "out"}},
+}
+# loop.LOAD_FIELDS（folder / staged / upload）
+FIELDS = ("start_index",)
+STAGED_FIELDS = ("folder", "start_index", "image_load_cap")
+UPLOAD_FIELDS = ("image",)
+
+
+def expected_body(values: Dict[str, Any], **extra: Any) -> bytes:
+    payload = {"prompt": patch_node_inputs(GRAPH, "1", values), "client_id": "cid"}
+    payload.update(extra)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "fields, values",
+    [
+        (FIELDS, {"start_index": 5}),
+        (STAGED_FIELDS, {"folder": "C:\\in\\日本語 \"x\"", "start_index": 0, "image_load_cap": 3}),
+        (UPLOAD_FIELDS, {"image": "comfyui-client/ab.png"}),
+        (STAGED_FIELDS, {"folder": "/in/a\nb\tc\u2028", "start_index": 0, "image_load_cap": 1}),
+    ],
+)
+def test_render_matches_json_dumps(fields: Tuple[str, ...], values: Dict[str, Any]) -> None:
+    template = PromptTemplate({"prompt": GRAPH, "client_id": "cid"}, "1", fields)
+    assert template.render(values) == expected_body(values)
+    assert template.render(values, {"front": True}) == expected_body(values, front=True)
+    assert json.loads(template.render(values, {"front": True}))["front"] is True
+
+
+def test_render_ignores_unknown_fields_and_keeps_graph() -> None:
+    template = PromptTemplate({"prompt": GRAPH, "client_id": "cid"}, "1", FIELDS)
+    body = template.render({"start_index": 2, "unknown": 1})
+    assert body == expected_body({"start_index": 2})
+    assert GRAPH["1"]["inputs"]["start_index"] == 0
+
+
+def test_missing_node_renders_constant_body() -> None:
+    template = PromptTemplate({"prompt": GRAPH, "client_id": "cid"}, "99", FIELDS)
+    assert template.render({"start_index": 3}) == encode_json({"prompt": GRAPH, "client_id": "cid"})
+
+
+def test_cache_reuses_templates_per_signature() -> None:
+    compiled = []
+
+    def compile_fn(skip: frozenset) -> Dict[str, Any]:
+        compiled.append(skip)
+        return {k: v for k, v in GRAPH.items() if k not in skip}
+
+    cache = CompiledWorkflowCache(compile_fn, maxsize=2)
+    first = cache.get_template({"3"}, "cid", "1", FIELDS)
+    assert cache.get_template({"3"}, "cid", "1", FIELDS) is first
+    assert json.loads(first.render({"start_index": 1}))["prompt"].keys() == {"1", "2", "4"}
+    cache.get_template({"2"}, "cid", "1", FIELDS)
+    cache.get_template(set(), "cid", "1", FIELDS)
+    # 古いものから捨てる
+    cache.get_template({"3"}, "cid", "1", FIELDS)
+    assert compiled == [frozenset({"3"}), frozenset({"2"}), frozenset(), frozenset({"3"})]
@@ -0,0 +1,106 @@
+"""パス → モデルローダーグループ分類を1パスで行うトリガー照合器。
+
+out/model_loader_groups.json から一度だけ構築する。全グループのトリガーを
+1本の正規表現（各位置で最長一致する先読み）にまとめ、パスを1回走査して
+一致したグループを求める。ある位置で最長のトリガー t が一致したとき、t に
+部分文字列として含まれるトリガーも同時に一致しているので、それらのグループも
+まとめて一致扱いにする（これで「どれかのトリガーがパスに含まれるか」と等価になる）。
+"""
+import re
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from workflow_cache import skip_set_signature
+
+
+def group_skip_ids(grp: Dict[str, Any]) -> List[str]:
+    """グループのノードをグラフ上のキー（サブグラフ内なら "<subgraph_id>:<id>"）で返す。"""
+    sub_id = grp.get("subgraph_id")
+    node_ids = grp.get("node_ids") or []
+    if sub_id:
+        return [f"{str(sub_id)}:{str(nid)}" for nid in node_ids]
+    return [str(nid) for nid in node_ids]
+
+
+class TriggerMatcher:
+    """グループ定義から構築し、パスごとのスキップ集合とその署名を返す。"""
+
+    def __init__(self, groups: List[Dict[str, Any]]) -> None:
+        self.groups = [g for g in groups if isinstance(g, dict)]
+        self._all_mask = (1 << len(self.groups)) - 1
+        self._group_skip_ids = [group_skip_ids(g) for g in self.groups]
+
+        # トリガー → それを持つグループのビットマスク
+        trigger_groups: Dict[str, int] = {}
+        for gi, grp in enumerate(self.groups):
+            for t in grp.get("trigger_folder_name") or []:
+                kw = str(t).lower()
+                if kw:
+                    trigger_groups[kw] = trigger_groups.get(kw, 0) | (1 << gi)
+
+        # トリガー t が一致したとき同時に一致している（t の部分文字列である）トリガーのグループ
+        self._implied: Dict[str, int] = {}
+        for t in trigger_groups:
+            mask = 0
+            for other, gmask in trigger_groups.items():
+                if other in t:
+                    mask |= gmask
+            self._implied[t] = mask
+
+        self._regex: Optional["re.Pattern[str]"] = None
+        if trigger_groups:
+            alternation = "|".join(re.escape(t) for t in sorted(trigger_groups, key=len, reverse=True))
+            self._regex = re.compile(f"(?=({alternation}))")
+
+        # 署名（スキップ対象グループのマスク）ごとの結果キャッシュ
+        self._by_mask: Dict[int, Tuple[str, FrozenSet[str]]] = {}
+
+    def matched_mask(self, path: Path) -> int:
+        """トリガーがパスに含まれるグループのビットマスク。"""
+        if self._regex is None:
+            return 0
+        mask = 0
+        for m in self._regex.finditer(str(path).lower()):
+            mask |= self._implied[m.group(1)]
+            if mask == self._all_mask:
+                break
+        return mask
+
+    def skip_mask(self, path: Path) -> int:
+        """トリガーが含まれない（＝スキップする）グループのビットマスク。"""
+        return self._all_mask & ~self.matched_mask(path)
+
+    def _resolve(self, skip_mask: int) -> Tuple[str, FrozenSet[str]]:
+        hit = self._by_mask.get(skip_mask)
+        if hit is not None:
+            return hit
+        skip: set = set()
+        for gi, ids in enumerate(self._group_skip_ids):
+            if skip_mask & (1 << gi):
+                skip.update(ids)
+        frozen = frozenset(skip)
+        hit = (skip_set_signature(frozen), frozen)
+        self._by_mask[skip_mask] = hit
+        return hit
+
+    def classify(self, path: Path) -> Tuple[str, FrozenSet[str]]:
+        """(スキップ集合の署名, スキップ集合)。"""
+        return self._resolve(self.skip_mask(path))
+
+    def skip_ids_for_path(self, path: Path) -> FrozenSet[str]:
+        return self.classify(path)[1]
+
+    def classify_paths(self, paths: Iterable[Path]) -> Dict[Path, str]:
+        """複数パスをまとめて分類し、パス → スキップ集合の署名 を返す。"""
+        return {p: self._resolve(self.skip_mask(p))[0] for p in paths}
+
+    def classify_directory(self, root: str, pattern: str = "*.png") -> Dict[Path, str]:
+        """root 以下の pattern に一致するファイルをまとめて分類する。"""
+        return self.classify_paths(Path(root).rglob(pattern))
+
+    def skip_ids_for_signature(self, signature: str) -> Optional[FrozenSet[str]]:
+        """分類済みの署名からスキップ集合を引く（未知の署名なら None）。"""
+        for sig, skip in self._by_mask.values():
+            if sig == signature:
+                return skip
+        return None
@@ -0,0 +1,175 @@
+"""スキップ集合ごとに変換済みワークフローをキャッシュする。
+
+画像ごとに違うのは start_index などごく一部の入力だけで、バイパス・Switch除去の
+結果はスキップ集合（collect_skip_node_ids_for_path の戻り値）だけで決まる。
+変換結果をスキップ集合の署名で LRU キャッシュし、投入時は可変フィールドだけを
+浅いコピーで差し替える。
+
+/prompt の本文は PromptTemplate としてエンコード済みの bytes でも持つ。可変フィールドの位置は
+作成時に一度だけ探し、投入時はその位置へ値の JSON を差し込むだけで本文を作る（グラフ全体を
+毎回 JSON化しない）。
+"""
+import hashlib
+import json
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def skip_set_signature(skip_ids: Iterable[str]) -> str:
+    """スキップ集合の正規化ハッシュ（順序・重複に依存しない）。"""
+    joined = "\n".join(sorted({str(s) for s in skip_ids}))
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+
+def patch_node_inputs(graph: Dict[str, Any], node_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """graph を壊さずに node_id の inputs だけ差し替えたグラフを返す。
+
+    トップレベル dict と対象ノード・inputs のみコピーし、他ノードはキャッシュと共有する。
+    """
+    node = graph.get(node_id)
+    if not isinstance(node, dict):
+        return graph
+    new_node = dict(node)
+    new_node["inputs"] = dict(node.get("inputs") or {})
+    new_node["inputs"].update(fields)
+    new_graph = dict(graph)
+    new_graph[node_id] = new_node
+    return new_graph
+
+
+def encode_json(obj: Any) -> bytes:
+    """/prompt へ送る形（区切りの空白なし・UTF-8）でエンコードする。"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PromptTemplate:
+    """node_id の fields だけを後から差し込める、エンコード済みの /prompt 本文。
+
+    payload（{"prompt": グラフ, "client_id": ...}）のグラフ部分は変換済みグラフをそのまま使う。
+    node_id がグラフに無い場合（不要ノードとして削除された等）は差し込む場所が無く、常に同じ本文になる。
+    """
+
+    def __init__(self, payload: Dict[str, Any], node_id: str, fields: Sequence[str]) -> None:
+        graph = payload["prompt"]
+        self.fields: Tuple[str, ...] = tuple(fields) if isinstance(graph.get(node_id), dict) else ()
+        token = uuid.uuid4().hex
+        markers = {f: f"__comfy_field_{token}_{i}__" for i, f in enumerate(self.fields)}
+        patched = dict(payload)
+        patched["prompt"] = patch_node_inputs(graph, node_id, markers)
+        body = encode_json(patched)
+        # 値ごと（引用符を含めて）置き換えるので、"__marker__" の位置で分割する
+        spots: List[Tuple[int, int, str]] = []
+        for field, marker in markers.items():
+            quoted = f'"{marker}"'.encode("utf-8")
+            pos = body.find(quoted)
+            if pos < 0 or body.find(quoted, pos + 1) >= 0:
+                raise ValueError(f"placeholder for {node_id}.{field} not found exactly once")
+            spots.append((pos, pos + len(quoted), field))
+        spots.sort()
+        self._chunks: List[bytes] = []
+        self._order: List[str] = []
+        last = 0
+        for start, end, field in spots:
+            self._chunks.append(body[last:start])
+            self._order.append(field)
+            last = end
+        self._chunks.append(body[last:])
+        self.size = len(body)
+
+    def render(self, values: Dict[str, Any], extra: Optional[Dict[str, Any]] = None) -> bytes:
+        """fields の値を差し込んだ本文。fields 以外のキーは無視する。
+
+        extra は payload のトップレベルに足すキー（{"front": True} など）で、末尾の "}" の前に書き足す。
+        """
+        parts: List[bytes] = []
+        for chunk, field in zip(self._chunks, self._order):
+            parts.append(chunk)
+            parts.append(encode_json(values[field]))
+        parts.append(self._chunks[-1])
+        if extra:
+            parts[-1] = parts[-1][:-1]
+            parts.append(b"," + encode_json(extra)[1:])
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+
+class CompiledWorkflowCache:
+    """署名 → 変換済みグラフ の LRU。返すグラフは共有物なので呼び出し側で変更しないこと。"""
+
+    def __init__(self, compile_fn: Callable[[frozenset], Dict[str, Any]], maxsize: int = 16) -> None:
+        self.compile_fn = compile_fn
+        self.maxsize = max(1, int(maxsize))
+        # テンプレートだけを受け取った署名（put_template）はグラフを None で持つ
+        self._entries: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        # (署名, client_id, ノードID, 可変フィールド) → エンコード済みの本文。グラフと一緒に捨てる
+        self._templates: Dict[Tuple[str, str, str, Tuple[str, ...]], PromptTemplate] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, skip_ids: Iterable[str], signature: Optional[str]) -> str:
+        if signature is not None:
+            return signature
+        return skip_set_signature(frozenset(str(s) for s in skip_ids))
+
+    def get(self, skip_ids: Iterable[str], signature: Optional[str] = None) -> Dict[str, Any]:
+        skip = frozenset(str(s) for s in skip_ids)
+        key = self._key(skip, signature)
+        compiled = self._entries.get(key)
+        if compiled is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+        self.misses += 1
+        compiled = self.compile_fn(skip)
+        self._entries[key] = compiled
+        self._entries.move_to_end(key)
+        self._evict()
+        return compiled
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            for tkey in [t for t in self._templates if t[0] == evicted]:
+                del self._templates[tkey]
+
+    def get_template(
+        self,
+        skip_ids: Iterable[str],
+        client_id: str,
+        node_id: str,
+        fields: Sequence[str],
+        signature: Optional[str] = None,
+    ) -> PromptTemplate:
+        """変換済みグラフの /prompt 本文テンプレート（node_id の fields を投入時に差し込む）。"""
+        key = self._key(skip_ids, signature)
+        tkey = (key, client_id, node_id, tuple(fields))
+        template = self._templates.get(tkey)
+        if template is not None and key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return template
+        compiled = self.get(skip_ids, signature=signature)
+        template = PromptTemplate({"prompt": compiled, "client_id": client_id}, node_id, fields)
+        self._templates[tkey] = template
+        return template
+
+    def has_template(self, signature: str, client_id: str, node_id: str, fields: Sequence[str]) -> bool:
+        """テンプレートがあるか（別スレッドから読んでもよい。順序は変えない）。"""
+        return (signature, client_id, node_id, tuple(fields)) in self._templates
+
+    def put_template(
+        self, signature: str, client_id: str, node_id: str, fields: Sequence[str], template: PromptTemplate
+    ) -> None:
+        """別スレッド・別プロセスで作ったテンプレートを登録する（グラフは必要になったときに作る）。"""
+        if signature not in self._entries:
+            self._entries[signature] = None
+        self._entries.move_to_end(signature)
+        self._templates[(signature, client_id, node_id, tuple(fields))] = template
+        self._evict()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._templates.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,335 @@
+"""API形式のワークフローを、変換用のコンパクトなグラフとして持つ。
+
+loop.py のバイパスと remove_switches の Switch 除去・定数畳み込み・不要ノード削除は、dict の
+グラフを丸ごと複製してから入力値を書き換えていく。スキップ集合ごとに複製・逆引き索引の
+構築・比較用の str() が繰り返されるので、大きなワークフローほど1回の変換が重い。
+
+WorkflowGraph は起動時に一度だけ作る読み取り専用のグラフ:
+- ノードは __slots__ の GraphNode。ノードIDは整数に置き換える（グラフに無い参照先も番号を振る）
+- 接続は (入力キー, 参照先の番号, 出力スロット) を配列にまとめて持ち、リテラルの入力は元の値を共有する
+
+GraphEdit は変換1回ぶんの差分（削除したノードと、参照の付け替え先）だけを持つ。元のグラフは
+書き換えないので、複製せずに何度でも変換を始められる。参照の付け替えは消費側を書き換えず、
+接続を読むときに付け替え先を辿って解決する。ComfyUI に送る dict へは最後の to_api() で戻す。
+
+変換結果は loop.bypass_nodes → remove_switches.remove_switch_nodes と同じになる。定数の解決・
+Switch の選択は remove_switches の登録表と関数をそのまま使う（GraphEdit を dict の代わりに渡す）。
+配列の中の参照など、この形で表せない入力を含むワークフローは from_api() が None を返すので、
+呼び出し側は従来の dict の変換を使う。
+"""
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import remove_switches
+
+
+class GraphNode:
+    """1ノード。source は元の dict（class_type・_meta などはそこから読む。書き換えない）。"""
+
+    __slots__ = ("key", "class_type", "source", "order", "literals", "link_start", "link_end")
+
+    def __init__(self, key: str, source: Dict[str, Any]) -> None:
+        self.key = key
+        self.class_type = source.get("class_type", "")
+        self.source = source
+        # inputs のキー順（接続もリテラルも含む）
+        self.order: Tuple[str, ...] = ()
+        self.literals: Dict[str, Any] = {}
+        # WorkflowGraph の接続配列のうち、このノードの分の範囲
+        self.link_start = 0
+        self.link_end = 0
+
+
+def _is_representable(value: Any) -> bool:
+    """接続 ["<id>", <int>] か、参照を含まないリテラルなら True。"""
+    if remove_switches._is_connection(value):
+        return isinstance(value[0], str) and type(value[1]) is int
+    if not isinstance(value, list):
+        return True
+    if remove_switches._is_loose_reference(value):
+        return False
+    return not any(remove_switches._is_loose_reference(inner) for inner in value)
+
+
+class WorkflowGraph:
+    """読み取り専用のコンパクトなグラフ。edit() で変換を始める。"""
+
+    __slots__ = ("nodes", "keys", "ids", "link_input", "link_src", "link_slot", "_suffix")
+
+    def __init__(self) -> None:
+        self.nodes: List[GraphNode] = []
+        # 番号 → ノードID。len(nodes) 以降はグラフに無い参照先
+        self.keys: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.link_input: List[str] = []
+        self.link_src = array("l")
+        self.link_slot = array("l")
+        # "<subgraph>:<id>" の末尾 id → ノード番号（グラフ上の順）
+        self._suffix: Dict[str, List[int]] = {}
+
+    def intern(self, key: str) -> int:
+        num = self.ids.get(key)
+        if num is None:
+            num = len(self.keys)
+            self.ids[key] = num
+            self.keys.append(key)
+        return num
+
+    @classmethod
+    def from_api(cls, graph: Dict[str, Any]) -> Optional["WorkflowGraph"]:
+        """API形式の dict から作る。表せない入力を含むなら None。"""
+        self = cls()
+        for key, node_obj in graph.items():
+            if not isinstance(key, str) or not isinstance(node_obj, dict):
+                return None
+            inputs = node_obj.get("inputs", {})
+            if inputs is not None and not isinstance(inputs, dict):
+                return None
+            self.intern(key)
+            self.nodes.append(GraphNode(key, node_obj))
+        for num, node in enumerate(self.nodes):
+            inputs = node.source.get("inputs") or {}
+            node.order = tuple(inputs)
+            node.link_start = len(self.link_input)
+            for input_key, value in inputs.items():
+                if not _is_representable(value):
+                    return None
+                if remove_switches._is_connection(value):
+                    self.link_input.append(input_key)
+                    self.link_src.append(self.intern(value[0]))
+                    self.link_slot.append(value[1])
+                else:
+                    node.literals[input_key] = value
+            node.link_end = len(self.link_input)
+            if ":" in node.key:
+                self._suffix.setdefault(node.key.rsplit(":", 1)[1], []).append(num)
+        return self
+
+    def edit(self) -> "GraphEdit":
+        return GraphEdit(self)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+
+class GraphEdit:
+    """WorkflowGraph に対する変換1回ぶんの差分。
+
+    remove_switches の関数が dict のグラフとして読めるよう、get(ノードID) で現在のノードを返す。
+    """
+
+    def __init__(self, graph: WorkflowGraph) -> None:
+        self.graph = graph
+        self.removed = bytearray(len(graph.nodes))
+        # ノード番号 → 全出力の付け替え先 (番号, スロット)。None は参照ごと削除
+        self._forward: Dict[int, Optional[Tuple[int, int]]] = {}
+        # (ノード番号, スロット) → その出力だけの付け替え先
+        self._forward_slot: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+    # --- 参照の解決 ---
+    def resolve(self, src: int, slot: int) -> Optional[Tuple[int, int]]:
+        """付け替えを辿った参照先。参照ごと削除されていれば None。"""
+        for _ in range(len(self._forward) + len(self._forward_slot) + 1):
+            target = self._forward_slot.get((src, slot))
+            if target is None:
+                if src not in self._forward:
+                    return src, slot
+                target = self._forward[src]
+                if target is None:
+                    return None
+            if target == (src, slot):
+                return target
+            src, slot = target
+        return src, slot
+
+    def _alive(self, num: int) -> bool:
+        return num < len(self.removed) and not self.removed[num]
+
+    def inputs_of(self, num: int) -> Dict[str, Any]:
+        """ノードの現在の inputs（接続は付け替え後の ["<id>", slot]。削除された参照は含まない）。"""
+        g = self.graph
+        node = g.nodes[num]
+        links: Dict[str, Any] = {}
+        for i in range(node.link_start, node.link_end):
+            target = self.resolve(g.link_src[i], g.link_slot[i])
+            if target is not None:
+                links[g.link_input[i]] = [g.keys[target[0]], target[1]]
+        literals = node.literals
+        out: Dict[str, Any] = {}
+        for input_key in node.order:
+            if input_key in literals:
+                out[input_key] = literals[input_key]
+            elif input_key in links:
+                out[input_key] = links[input_key]
+        return out
+
+    def _sources(self, num: int) -> Iterable[int]:
+        g = self.graph
+        node = g.nodes[num]
+        for i in range(node.link_start, node.link_end):
+            target = self.resolve(g.link_src[i], g.link_slot[i])
+            if target is not None:
+                yield target[0]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """dict のグラフ相当: 残っているノードの {"class_type", "inputs"}。"""
+        num = self.graph.ids.get(str(key))
+        if num is None or not self._alive(num):
+            return default
+        node = self.graph.nodes[num]
+        return {"class_type": node.class_type, "inputs": self.inputs_of(num)}
+
+    def _connection_target(self, conn: List[Any]) -> Tuple[int, int]:
+        return self.graph.intern(str(conn[0])), int(conn[1])
+
+    # --- 変換 ---
+    def target_keys(self, raw_ids: Iterable[str]) -> List[int]:
+        """スキップ指定IDをノード番号へ解決する（loop._resolve_target_keys と同じ規則）。"""
+        g = self.graph
+        raw = [str(r) for r in raw_ids]
+        nums: List[int] = []
+        seen: Set[int] = set()
+        for rid in raw:
+            if ":" in rid:
+                num = g.ids.get(rid)
+                if num is not None and self._alive(num) and num not in seen:
+                    nums.append(num)
+                    seen.add(num)
+        plain = [rid for rid in raw if ":" not in rid]
+        hits: Set[int] = set()
+        for rid in plain:
+            hits.update(n for n in g._suffix.get(rid, ()) if self._alive(n) and n not in seen)
+        for num in sorted(hits):
+            nums.append(num)
+            seen.add(num)
+        for rid in plain:
+            num = g.ids.get(rid)
+            if num is not None and self._alive(num) and num not in seen:
+                nums.append(num)
+                seen.add(num)
+        return nums
+
+    def bypass(self, node_ids_to_skip: Iterable[str]) -> None:
+        """指定ノードを最初のデータ入力へバイパスして削除する（loop.bypass_nodes 相当）。"""
+        for num in self.target_keys(node_ids_to_skip):
+            if not self._alive(num):
+                continue
+            node_obj = {"class_type": self.graph.nodes[num].class_type, "inputs": self.inputs_of(num)}
+            conns = remove_switches._list_connection_inputs(node_obj)
+            # 接続が無ければ、参照している入力ごと消す
+            self._forward[num] = self._connection_target(conns[0][1]) if conns else None
+            self.removed[num] = 1
+
+    def remove_switches(self, roots: Iterable[str], prune: bool = True) -> None:
+        """Switch の除去・素通しノードの付け替え・不要ノードの削除（remove_switch_nodes 相当）。"""
+        g = self.graph
+        switch_ids: List[int] = []
+        passthrough_ids: List[int] = []
+        for num, node in enumerate(g.nodes):
+            if self.removed[num]:
+                continue
+            if isinstance(node.class_type, str) and "Switch" in node.class_type:
+                switch_ids.append(num)
+            elif node.class_type in remove_switches.PASSTHROUGH_NODE_TYPES:
+                passthrough_ids.append(num)
+
+        unresolved: List[str] = []
+        inversed: List[int] = []
+        for num in switch_ids:
+            node_obj = self.get(g.keys[num])
+            class_type = node_obj["class_type"]
+            inputs = node_obj["inputs"]
+            if "ImpactInversedSwitch" in class_type:
+                data_conns = remove_switches._list_connection_inputs(node_obj)
+                inp_conn = data_conns[0][1] if data_conns else None
+                out = remove_switches._inversed_switch_output(
+                    remove_switches._resolve_input_value(self, inputs.get("select"))  # type: ignore[arg-type]
+                )
+                if inp_conn is not None and out is not None:
+                    self._forward_slot[(num, out)] = self._connection_target(inp_conn)
+                    inversed.append(num)
+                    continue
+            replacement, resolved = remove_switches._choose_switch_upstream(self, node_obj)  # type: ignore[arg-type]
+            if replacement is None:
+                continue
+            if not resolved:
+                unresolved.append(g.keys[num])
+            self._forward[num] = self._connection_target(replacement)
+
+        for num in passthrough_ids:
+            node_obj = self.get(g.keys[num])
+            upstream = remove_switches._passthrough_upstream(node_obj)
+            if upstream is not None and upstream[0] != g.keys[num]:
+                self._forward_slot[(num, 0)] = self._connection_target(upstream)
+
+        for num in switch_ids:
+            self.removed[num] = 1
+        # ImpactInversedSwitch の選ばれなかった出力を使うノードは下流ごと削除する（上流を決められなかった Switch への参照は残す）
+        self.remove_blocked(inversed)
+
+        if prune:
+            self.prune(roots)
+
+        if unresolved:
+            print(
+                f"[remove_switches] 選択を定数で確定できず最初の入力を使用: {', '.join(unresolved)}",
+                file=sys.stderr,
+            )
+
+    def remove_blocked(self, sources: Iterable[int]) -> None:
+        """sources をまだ参照しているノードを、下流へ辿って削除する（remove_switches.remove_blocked_nodes 相当）。"""
+        g = self.graph
+        consumers: Dict[int, List[int]] = {}
+        for num in range(len(g.nodes)):
+            if self.removed[num]:
+                continue
+            for src in self._sources(num):
+                consumers.setdefault(src, []).append(num)
+        stack = [c for src in sources for c in consumers.get(src, ())]
+        while stack:
+            num = stack.pop()
+            if self.removed[num]:
+                continue
+            self.removed[num] = 1
+            stack.extend(consumers.get(num, ()))
+
+    def prune(self, roots: Iterable[str]) -> None:
+        """roots から入力を遡って到達できないノードを削除する。起点が1つも残っていなければ何もしない。"""
+        g = self.graph
+        stack = [num for num in (g.ids.get(str(r)) for r in roots) if num is not None and self._alive(num)]
+        if not stack:
+            return
+        reachable = bytearray(len(g.nodes))
+        for num in stack:
+            reachable[num] = 1
+        while stack:
+            for src in self._sources(stack.pop()):
+                if self._alive(src) and not reachable[src]:
+                    reachable[src] = 1
+                    stack.append(src)
+        for num in range(len(g.nodes)):
+            if not reachable[num]:
+                self.removed[num] = 1
+
+    def to_api(self) -> Dict[str, Any]:
+        """残っているノードを API形式の dict にする（リテラルの値は元のグラフと共有）。"""
+        out: Dict[str, Any] = {}
+        for num, node in enumerate(self.graph.nodes):
+            if self.removed[num]:
+                continue
+            node_obj = dict(node.source)
+            if isinstance(node_obj.get("inputs"), dict):
+                node_obj["inputs"] = self.inputs_of(num)
+            out[node.key] = node_obj
+        return out
+
+
+def compile_api(graph: WorkflowGraph, skip_ids: Iterable[str], roots: Iterable[str]) -> Dict[str, Any]:
+    """スキップ集合のバイパス → Switch除去 → 不要ノード削除 を行った API形式の dict。"""
+    edit = graph.edit()
+    skip = set(skip_ids)
+    if skip:
+        edit.bypass(skip)
+    edit.remove_switches(roots=roots)
+    return edit.to_api()